@@ -2,17 +2,64 @@
 
 from Queue import Empty, Full, _time
 import Queue as _Queue
+from array import array as _array
+from collections import deque as _deque
+import heapq as _heapq
 
 class Closed(Exception):
     """Exception raised by CloseableQueue.put/get on a closed queue."""
     pass
 
-def CloseableQueueFactory(base=_Queue.Queue, name="CloseableQueue"):
+class _Expiring(object):
+    """Wrapper for a queued item which has a deadline.
+
+    Compares as its item does, so that it can be stored in a priority queue
+      alongside unwrapped items.
+    """
+    __slots__ = ('deadline', 'item')
+
+    def __init__(self, deadline, item):
+        self.deadline = deadline
+        self.item = item
+
+    def __lt__(self, other):
+        if type(other) is _Expiring:
+            other = other.item
+        return self.item < other
+
+    def __gt__(self, other):
+        if type(other) is _Expiring:
+            other = other.item
+        return self.item > other
+
+# Returned by `_unwrap` in place of an item whose deadline has passed.
+_EXPIRED = object()
+
+def _expired(item, now):
+    """True iff `item` is wrapped with a deadline which has passed by `now`."""
+    return type(item) is _Expiring and item.deadline <= now
+
+# Placeholder for the absence of an item.
+_NOTHING = object()
+
+def CloseableQueueFactory(base=_Queue.Queue, name="CloseableQueue",
+                          registry=None):
     """Create a closeable descendant class of `base`.
 
     Used instead of a mixin approach because the Queue module's classes
       are old-style.
+
+    If a `QueueRegistry` is given as `registry`,
+      every instance of the class is registered in it,
+      under its `name` constructor argument or else an automatic name.
     """
+    # Bases which decide per item whether `put` must wait
+    #   can't have a run of items put in a single chunk.
+    put_each = hasattr(base, '_full_for')
+    # Bases which store items in a form of their own
+    #   can't hold the `_Expiring` wrappers of items with deadlines.
+    deadlines = not getattr(base, '_no_deadlines', False)
+
     class CloseableQueue(base):
         """This class provides a means to permanently close a queue.
 
@@ -28,13 +75,105 @@ def CloseableQueueFactory(base=_Queue.Queue, name="CloseableQueue"):
 
         If the latter is done, the entire operation is performed atomically;
           the close will only take place if the put succeeds.
+
+        Items can be given a deadline, either by passing `deadline`
+          (a `time.time` value) to `put`, or by passing `ttl` (in seconds)
+          to the constructor to give every item a deadline.
+        Items whose deadline has passed are skipped by `get`,
+          which counts them in the `expired` attribute and treats them
+          as done for the purposes of `join`.
+        Expired items are also swept from the middle of the queue
+          whenever the number of `put`s since the last sweep
+          reaches the size of the queue, or when `sweep` is called.
+        Deadlines are only supported by queue classes which store
+          their items as given, such as those of the `Queue` module;
+          others raise `TypeError` when given a `ttl` or `deadline`.
+
+        Passing `overflow` to the constructor makes `put` on a full queue
+          drop an item instead of blocking:
+          with 'drop_oldest', the oldest item in the queue is dropped;
+          with 'drop_newest', the item being put is dropped;
+          with 'drop_lowest', which applies to priority queues,
+          the item of lowest priority, possibly the new one, is dropped.
+        Dropped items are counted in the `dropped` attribute,
+          and passed to the `on_drop` callback if one is given.
+        The callback is called after the queue's mutex has been released.
+
+        `get_async` and `put_async` return `concurrent.futures.Future`s
+          in place of blocking the calling thread.
+
+        `put_count` counts the items put,
+          and `put_wait` totals the seconds `put`s have spent waiting for space.
+
+        Passing `high_watermark` to the constructor sets `congested`
+          once the queue holds that many items,
+          and clears it once the queue is down to `low_watermark` items
+          (half of `high_watermark` by default) or is closed.
+        The `on_high_watermark` and `on_low_watermark` callbacks,
+          if given, are called with the queue as each happens,
+          after the queue's mutex has been released.
+        This lets a producer pause and resume its source of items
+          instead of blocking in `put`.
+        Since the callbacks are called outside the mutex, those due to
+          different threads may overlap; `congested` is authoritative.
+
+        Passing `name` to the constructor registers the queue under that name
+          in the class's registry, or else in `queue_registry`,
+          so that its stats are exported with those of the other queues there.
         """
         def __init__(self, *args, **kwargs):
+            self.name = kwargs.pop('name', None)
+            self.ttl = kwargs.pop('ttl', None)
+            self.overflow = kwargs.pop('overflow', None)
+            self.on_drop = kwargs.pop('on_drop', None)
+            self.high_watermark = kwargs.pop('high_watermark', None)
+            self.low_watermark = kwargs.pop('low_watermark', None)
+            self.on_high_watermark = kwargs.pop('on_high_watermark', None)
+            self.on_low_watermark = kwargs.pop('on_low_watermark', None)
             base.__init__(self, *args, **kwargs)
             assert not hasattr(self, '_closed')
             self._closed = False
+            self.expired = 0
+            self._expiring = self.ttl is not None
+            self._puts_since_sweep = 0
+            self.dropped = 0
+            self.discarded = 0
+            self.put_count = 0
+            # The total time spent by `put`s waiting for space.
+            self.put_wait = 0.0
+            self.congested = False
+            # The futures of waiting `get_async`s and `put_async`s,
+            #   created by the first of either.
+            self._get_waiters = self._put_waiters = None
+            # True iff operations must call `_serve` before they return,
+            #   to serve futures or check the watermarks.
+            self._hooked = self.high_watermark is not None
+            if self.high_watermark is not None:
+                if self.low_watermark is None:
+                    self.low_watermark = self.high_watermark // 2
+                if not 0 <= self.low_watermark < self.high_watermark:
+                    raise ValueError("need 0 <= low_watermark < high_watermark")
+            if self.overflow not in (None, 'drop_oldest', 'drop_newest',
+                                     'drop_lowest'):
+                raise ValueError("unknown overflow policy %r" % (self.overflow,))
+            storage = getattr(self, 'queue', None)
+            if ((self.overflow == 'drop_oldest'
+                 and not hasattr(base, '_drop_oldest')
+                 and not issubclass(base, _Queue.LifoQueue)
+                 and not isinstance(storage, _deque))
+                or (self.overflow == 'drop_lowest'
+                    and not hasattr(base, '_drop_lowest')
+                    and not issubclass(base, _Queue.PriorityQueue))):
+                raise TypeError("%s does not support the %r policy"
+                                % (name, self.overflow))
+            if self.ttl is not None and not deadlines:
+                raise TypeError("%s does not support deadlines" % (name,))
+            if registry is not None:
+                self.name = registry.register(self, self.name)
+            elif self.name is not None:
+                queue_registry.register(self, self.name)
 
-        def close(self):
+        def close(self, discard=False):
             """Close the queue.
 
             This will prevent further `put`s, and only allow `get`s
@@ -45,17 +184,28 @@ def CloseableQueueFactory(base=_Queue.Queue, name="CloseableQueue"):
             Calling `close` will also cause `Closed` exceptions to be raised
               in blocked `get`s or `put`s as though they had just been called.
 
+            If `discard` is true, the items in the queue are discarded,
+              so that `get`s raise `Closed` at once.
+            This lets a consumer which gives up early stop its producers.
+            Discarded items are counted in the `discarded` attribute
+              and treated as done for the purposes of `join`.
+
             Normally it is only useful to call this method
               from a thread which is the sole producer or sole consumer.
             """
+            served = None
             self.mutex.acquire()
             try:
-                if not self._closed:
-                    self._closed = True
-                    self.not_empty.notify_all()
-                    self.not_full.notify_all()
+                if not self._closed or discard:
+                    if discard:
+                        self._discard()
+                    self._close()
+                    if self._hooked:
+                        served = self._serve()
             finally:
                 self.mutex.release()
+            if served:
+                self._complete(served)
 
         def closed(self):
             """True iff the queue is closed.  Unreliable like `empty` and `full`."""
@@ -68,7 +218,32 @@ def CloseableQueueFactory(base=_Queue.Queue, name="CloseableQueue"):
             self.mutex.release()
             return n
 
-        def put(self, item, block=True, timeout=None, last=False):
+
+        # These readers take no lock, so that monitoring threads
+        #   don't contend with `put` and `get`.
+        # Each field is read atomically, but a reading may be stale,
+        #   and the fields of `approx_stats` needn't be mutually consistent.
+        def approx_qsize(self):
+            """Return the approximate size of the queue without locking."""
+            return self._qsize()
+
+        def approx_closed(self):
+            """Return whether the queue appears closed, without locking."""
+            return self._closed
+
+        def approx_stats(self):
+            """Return a dict of the queue's size, state and counters,
+              read without locking.
+            """
+            return dict(qsize=self._qsize(), maxsize=self.maxsize,
+                        closed=self._closed,
+                        unfinished_tasks=self.unfinished_tasks,
+                        put_wait=self.put_wait, expired=self.expired,
+                        dropped=self.dropped, discarded=self.discarded,
+                        congested=self.congested, put_count=self.put_count)
+
+        def put(self, item, block=True, timeout=None, last=False,
+                deadline=None, **kwargs):
             """Put an item into the queue.
 
             Works as does `Queue.Queue.put`, but with these differences:
@@ -80,37 +255,224 @@ def CloseableQueueFactory(base=_Queue.Queue, name="CloseableQueue"):
 
             Also raises `Closed` in the event that the queue is closed
               while the `put` is blocked.
+
+            If `deadline` is given, the item will be dropped
+              rather than gotten after that time.
+
+            If the queue has an `overflow` policy, `put` never blocks;
+              an item is dropped instead if the queue is full.
+
+            Any additional keyword arguments are passed on
+              to the `_put` method of the base class,
+              whose return value is returned.
             """
+            if deadline is None and self.ttl is not None:
+                deadline = _time() + self.ttl
+            if deadline is not None:
+                if not deadlines:
+                    raise TypeError("%s does not support deadlines" % (name,))
+                item = _Expiring(deadline, item)
+            dropped = _NOTHING
+            overfull = False
+            served = None
             self.not_full.acquire()
             try:
-                if self.maxsize > 0:
-                    if not block:
-                        if self._qsize() == self.maxsize and not self._closed:
-                            raise Full
-                    elif timeout is None:
-                        while self._qsize() == self.maxsize and not self._closed:
+                if self.overflow is not None:
+                    if not self._closed and self._full_for(item):
+                        if self.overflow == 'drop_oldest':
+                            # The oldest item is dropped once `item` is put,
+                            #   so that none is lost if `_put` fails.
+                            overfull = True
+                        else:
+                            # `_drop_lowest` takes the arguments of `_put`,
+                            #   and checks them before dropping anything.
+                            dropped = self._drop(item, kwargs)
+                            if dropped is item:
+                                if last:
+                                    self._close()
+                                return None
+                elif not block:
+                    if self._full_for(item) and not self._closed:
+                        raise Full
+                elif timeout is None:
+                    if self._full_for(item) and not self._closed:
+                        waited = _time()
+                        while self._full_for(item) and not self._closed:
                             self.not_full.wait()
-                    elif timeout < 0:
-                        raise ValueError("'timeout' must be a positive number")
-                    else:
-                        endtime = _time() + timeout
-                        while self._qsize() == self.maxsize and not self._closed:
+                        self.put_wait += _time() - waited
+                elif timeout < 0:
+                    raise ValueError("'timeout' must be a positive number")
+                elif self._full_for(item) and not self._closed:
+                    waited = _time()
+                    endtime = waited + timeout
+                    try:
+                        while self._full_for(item) and not self._closed:
                             remaining = endtime - _time()
                             if remaining <= 0.0:
                                 raise Full
                             self.not_full.wait(remaining)
+                    finally:
+                        self.put_wait += _time() - waited
                 if self._closed:
                     raise Closed
-                self._put(item)
+                if deadline is not None:
+                    self._expiring = True
+                if self._expiring:
+                    self._puts_since_sweep += 1
+                    size = self._qsize()
+                    if size and self._puts_since_sweep >= size:
+                        self._sweep()
+                result = self._put(item, **kwargs)
                 self.unfinished_tasks += 1
+                self.put_count += 1
+                if overfull:
+                    dropped = self._drop(item, kwargs)
                 if last:
-                    self._closed = True
-                    self.not_empty.notify_all()
-                    self.not_full.notify_all()
+                    self._close()
                 else:
                     self.not_empty.notify()
+                return result
             finally:
+                if self._hooked:
+                    served = self._serve()
                 self.not_full.release()
+                if served:
+                    self._complete(served)
+                if dropped is not _NOTHING and self.on_drop is not None:
+                    self.on_drop(self._unwrap_dropped(dropped))
+
+        def task_done(self, n=1):
+            """Indicate that `n` formerly enqueued tasks are complete.
+
+            Works as does `Queue.Queue.task_done`, but accounts for
+              a batch of items, e.g. those returned by `get_many`,
+              with a single acquisition of the mutex.
+            """
+            self.all_tasks_done.acquire()
+            try:
+                unfinished = self.unfinished_tasks - n
+                if unfinished <= 0:
+                    if unfinished < 0:
+                        raise ValueError('task_done() called too many times')
+                    self.all_tasks_done.notify_all()
+                self.unfinished_tasks = unfinished
+            finally:
+                self.all_tasks_done.release()
+
+        def join(self, timeout=None):
+            """Block until all items in the queue have been gotten and processed.
+
+            Works as does `Queue.Queue.join`, except that it gives up
+              after `timeout` seconds if `timeout` is given.
+            Returns True iff all of the tasks are done.
+            """
+            return self._join(timeout, False)
+
+        def join_closed(self, timeout=None):
+            """Block until the queue is closed and all of its tasks are done.
+
+            Unlike `join`, doesn't return while producers may yet put items.
+            Returns True iff the queue is closed and its tasks done,
+              which may be False only if `timeout` is given.
+            """
+            return self._join(timeout, True)
+
+        def _join(self, timeout, closed):
+            self.all_tasks_done.acquire()
+            try:
+                if timeout is None:
+                    while self.unfinished_tasks or (closed and not self._closed):
+                        self.all_tasks_done.wait()
+                elif timeout < 0:
+                    raise ValueError("'timeout' must be a positive number")
+                else:
+                    endtime = _time() + timeout
+                    while self.unfinished_tasks or (closed and not self._closed):
+                        remaining = endtime - _time()
+                        if remaining <= 0.0:
+                            return False
+                        self.all_tasks_done.wait(remaining)
+                return True
+            finally:
+                self.all_tasks_done.release()
+
+        def _discard(self):
+            """Discard all of the items in the queue.  The mutex must be held."""
+            count = self._clear()
+            if count:
+                self.discarded += count
+                self.unfinished_tasks -= count
+                if not self.unfinished_tasks:
+                    self.all_tasks_done.notify_all()
+
+        if not hasattr(base, '_clear'):
+            def _clear(self):
+                """Remove all items from the storage; return their number.
+
+                The storage is simply created afresh by `_init`.
+                """
+                count = self._qsize()
+                self._init(self.maxsize)
+                return count
+
+        def _close(self):
+            """Close the queue.  The mutex must be held."""
+            self._closed = True
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+            # For `join_closed`.
+            self.all_tasks_done.notify_all()
+
+        def _drop(self, item, kwargs):
+            """Apply the `overflow` policy to make room for `item`.
+
+            Returns the dropped item, which is `item` itself if it is
+              the one which is to be dropped.
+            """
+            if self.overflow == 'drop_newest':
+                dropped = item
+            elif self.overflow == 'drop_oldest':
+                dropped = self._drop_oldest()
+            else:
+                dropped = self._drop_lowest(item, **kwargs)
+            self.dropped += 1
+            if dropped is not item:
+                self.unfinished_tasks -= 1
+                if not self.unfinished_tasks:
+                    self.all_tasks_done.notify_all()
+            return dropped
+
+        @staticmethod
+        def _unwrap_dropped(item):
+            if type(item) is _Expiring:
+                return item.item
+            return item
+
+        # Used by the 'drop_oldest' and 'drop_lowest' overflow policies.
+        # The defaults suit the deque of `Queue.Queue`, the list
+        #   of `Queue.LifoQueue` and the heap of `Queue.PriorityQueue`.
+        if not hasattr(base, '_drop_oldest'):
+            if issubclass(base, _Queue.LifoQueue):
+                def _drop_oldest(self):
+                    return self.queue.pop(0)
+            else:
+                def _drop_oldest(self):
+                    return self.queue.popleft()
+
+        if not hasattr(base, '_drop_lowest'):
+            def _drop_lowest(self, item):
+                """Remove and return the greatest item, if it exceeds `item`."""
+                heap = self.queue
+                index = max(xrange(len(heap) // 2, len(heap)),
+                            key=heap.__getitem__)
+                lowest = heap[index]
+                if not item < lowest:
+                    return item
+                last = heap.pop()
+                if index < len(heap):
+                    heap[index] = last
+                    _heapq._siftdown(heap, 0, index)
+                return lowest
 
         def get(self, block=True, timeout=None):
             """Remove and return an item from the queue.
@@ -120,31 +482,583 @@ def CloseableQueueFactory(base=_Queue.Queue, name="CloseableQueue"):
 
             Similarly, a blocked `get` will raise `Closed`
               if the queue is closed during the block.
+
+            Expired items are skipped.
             """
+            served = None
             self.not_empty.acquire()
             try:
-                if not block:
-                    if not self._qsize() and not self._closed:
-                        raise Empty
-                elif timeout is None:
-                    while not self._qsize() and not self._closed:
-                        self.not_empty.wait()
-                elif timeout < 0:
-                    raise ValueError("'timeout' must be a positive number")
-                else:
+                if block and timeout is not None:
+                    if timeout < 0:
+                        raise ValueError("'timeout' must be a positive number")
                     endtime = _time() + timeout
-                    while not self._qsize() and not self._closed:
-                        remaining = endtime - _time()
-                        if remaining <= 0.0:
+                while True:
+                    if not block:
+                        if not self._qsize() and not self._closed:
                             raise Empty
-                        self.not_empty.wait(remaining)
-                if self._closed and not self._qsize():
-                    raise Closed
-                item = self._get()
-                self.not_full.notify()
+                    elif timeout is None:
+                        while not self._qsize() and not self._closed:
+                            self.not_empty.wait()
+                    else:
+                        while not self._qsize() and not self._closed:
+                            remaining = endtime - _time()
+                            if remaining <= 0.0:
+                                raise Empty
+                            self.not_empty.wait(remaining)
+                    if self._closed and not self._qsize():
+                        raise Closed
+                    item = self._get()
+                    self.not_full.notify()
+                    if self._expiring:
+                        item = self._unwrap(item)
+                        if item is _EXPIRED:
+                            continue
+                    return item
+            finally:
+                if self._hooked:
+                    served = self._serve()
+                self.not_empty.release()
+                if served:
+                    self._complete(served)
+
+        def _unwrap(self, item, now=None):
+            """Return the item wrapped by `item`, or `_EXPIRED` if it has expired."""
+            if type(item) is not _Expiring:
                 return item
+            if item.deadline > (_time() if now is None else now):
+                return item.item
+            self._expire(1)
+            return _EXPIRED
+
+        def _unwrap_many(self, items):
+            """Return a list of the unexpired items wrapped by `items`."""
+            now = _time()
+            unwrapped = (self._unwrap(item, now) for item in items)
+            return [item for item in unwrapped if item is not _EXPIRED]
+
+        def _expire(self, count):
+            """Count `count` removed items as expired and their tasks as done."""
+            self.expired += count
+            self.unfinished_tasks -= count
+            if not self.unfinished_tasks:
+                self.all_tasks_done.notify_all()
+
+        def sweep(self):
+            """Remove expired items from anywhere in the queue.
+
+            Returns the number of items removed.
+            This is done automatically as items are put,
+              but can also be called periodically, e.g. by a timer thread,
+              to reclaim the memory held by expired items sooner.
+            """
+            served = None
+            self.mutex.acquire()
+            try:
+                count = self._sweep()
+                if count and self._hooked:
+                    served = self._serve()
+                return count
+            finally:
+                self.mutex.release()
+                if served:
+                    self._complete(served)
+
+        def _sweep(self):
+            self._puts_since_sweep = 0
+            if not deadlines:
+                return 0
+            count = self._remove_expired(_time())
+            if count:
+                self._expire(count)
+                self.not_full.notify(count)
+            return count
+
+        # Used by `_sweep` to remove the items which have expired by `now`
+        #   from the storage, keeping the order of the rest,
+        #   and return their number.
+        # The defaults suit the heap of `Queue.PriorityQueue`
+        #   and the deque and list of `Queue.Queue` and `Queue.LifoQueue`.
+        if not hasattr(base, '_remove_expired'):
+            if issubclass(base, _Queue.PriorityQueue):
+                def _remove_expired(self, now):
+                    heap = self.queue
+                    kept = [item for item in heap if not _expired(item, now)]
+                    if len(kept) < len(heap):
+                        _heapq.heapify(kept)
+                        self.queue = kept
+                    return len(heap) - len(kept)
+            else:
+                def _remove_expired(self, now):
+                    queue = self.queue
+                    kept = [item for item in queue
+                            if not _expired(item, now)]
+                    if len(kept) < len(queue):
+                        self.queue = type(queue)(kept)
+                    return len(queue) - len(kept)
+
+        def put_many(self, items, block=True, timeout=None, last=False):
+            """Put each of the `items` into the queue.
+
+            Works as would a series of calls to `put`,
+              but the items are transferred in as few chunks as the
+              queue's free space allows, with one mutex acquisition per chunk.
+
+            If `Full` or `Closed` is raised partway through,
+              the items which have already been put remain in the queue.
+
+            If `last` is True, the queue will be atomically closed
+              along with the put of the final chunk.
+
+            Returns the concatenated return values of `_put_many`,
+              e.g. the handles of the items put to a priority queue,
+              or None if it returns nothing.
+
+            If the queue has an `overflow` policy,
+              or its base class decides which items must wait
+              for space with `_full_for`,
+              the items are put one at a time with `put`.
+            """
+            if self.overflow is not None or put_each:
+                items = list(items)
+                for item in items[:-1]:
+                    self.put(item, block, timeout)
+                if items:
+                    self.put(items[-1], block, timeout, last)
+                elif last:
+                    self.close()
+                return None
+            items = self._prepare_many(items)
+            if self.ttl is not None:
+                deadline = _time() + self.ttl
+                items = [_Expiring(deadline, item) for item in items]
+            count = len(items)
+            done = 0
+            results = None
+            served = None
+            self.not_full.acquire()
+            try:
+                if timeout is not None:
+                    if timeout < 0:
+                        raise ValueError("'timeout' must be a positive number")
+                    endtime = _time() + timeout
+                while True:
+                    if self.maxsize > 0 and done < count:
+                        if not block:
+                            if self._qsize() >= self.maxsize and not self._closed:
+                                raise Full
+                        elif (self._qsize() >= self.maxsize
+                              and not self._closed):
+                            waited = _time()
+                            try:
+                                while (self._qsize() >= self.maxsize
+                                       and not self._closed):
+                                    if timeout is None:
+                                        self.not_full.wait()
+                                        continue
+                                    remaining = endtime - _time()
+                                    if remaining <= 0.0:
+                                        raise Full
+                                    self.not_full.wait(remaining)
+                            finally:
+                                self.put_wait += _time() - waited
+                    if self._closed:
+                        raise Closed
+                    if self.maxsize > 0:
+                        end = min(count, done + self.maxsize - self._qsize())
+                    else:
+                        end = count
+                    if done == 0 and end == count:
+                        result = self._put_many(items)
+                    else:
+                        result = self._put_many(items[done:end])
+                    if result is not None:
+                        if results is None:
+                            results = result
+                        else:
+                            results.extend(result)
+                    self.unfinished_tasks += end - done
+                    self.put_count += end - done
+                    if end == count:
+                        break
+                    self.not_empty.notify(end - done)
+                    done = end
+                if last:
+                    self._close()
+                else:
+                    self.not_empty.notify(count - done)
+                return results
+            finally:
+                if self._hooked:
+                    served = self._serve()
+                self.not_full.release()
+                if served:
+                    self._complete(served)
+
+        def get_many(self, max_items=None, block=True, timeout=None):
+            """Remove and return up to `max_items` items from the queue.
+
+            Blocks, times out and raises `Closed` as does `get`,
+              waiting until at least one item is available.
+            All of the available items, up to `max_items`,
+              are then removed under a single acquisition of the mutex,
+              and any expired items among them are dropped.
+
+            The items are returned as a list,
+              or as some other sequence for queue classes
+              which override `_get_many`.
+            """
+            served = None
+            self.not_empty.acquire()
+            try:
+                if block and timeout is not None:
+                    if timeout < 0:
+                        raise ValueError("'timeout' must be a positive number")
+                    endtime = _time() + timeout
+                while True:
+                    if not block:
+                        if not self._qsize() and not self._closed:
+                            raise Empty
+                    elif timeout is None:
+                        while not self._qsize() and not self._closed:
+                            self.not_empty.wait()
+                    else:
+                        while not self._qsize() and not self._closed:
+                            remaining = endtime - _time()
+                            if remaining <= 0.0:
+                                raise Empty
+                            self.not_empty.wait(remaining)
+                    if self._closed and not self._qsize():
+                        raise Closed
+                    count = self._qsize()
+                    if max_items is not None:
+                        count = min(count, max_items)
+                    items = self._get_many(count)
+                    self.not_full.notify(count)
+                    if self._expiring:
+                        items = self._unwrap_many(items)
+                        if not items and count:
+                            continue
+                    return items
             finally:
+                if self._hooked:
+                    served = self._serve()
                 self.not_empty.release()
+                if served:
+                    self._complete(served)
+
+        def drain(self, max_items=None):
+            """Remove and return up to `max_items` of the items in the queue.
+
+            Never blocks, and returns an empty list rather than raising
+              `Empty` or `Closed` if there is nothing in the queue.
+            The items are removed under a single acquisition of the mutex.
+            """
+            served = None
+            self.mutex.acquire()
+            try:
+                count = self._available()
+                if max_items is not None:
+                    count = min(count, max_items)
+                if not count:
+                    return []
+                items = self._get_many(count)
+                self.not_full.notify(count)
+                if self._expiring:
+                    return self._unwrap_many(items)
+                return items
+            finally:
+                if self._hooked:
+                    served = self._serve()
+                self.mutex.release()
+                if served:
+                    self._complete(served)
+
+        def transfer_to(self, other, max_items=None, close=False):
+            """Move up to `max_items` items from the queue to the queue `other`.
+
+            `other` must be another queue of a class made by
+              `CloseableQueueFactory`, which takes runs of items in a chunk;
+              `TypeError` is raised if it is not, or if it has an `overflow`
+              policy, before any items are moved.
+            The items are moved under a single acquisition of each queue's
+              mutex, taken in a consistent order so that transfers in
+              opposite directions can't deadlock.
+            No more items are moved than there is room for in `other`,
+              and the call never blocks.
+            The moved items count as done in this queue
+              and as new tasks in `other`; any deadlines are not carried over,
+              but the items are given new ones if `other` has a `ttl`.
+            If `other` can't store the items, e.g. an `ArrayQueue` given
+              items of another type, they are put back in this queue
+              (at the back, for a FIFO queue) and the error is raised.
+
+            If `close` is true and this queue is closed and left empty,
+              `other` is closed along with the transfer.
+            Raises `Closed` if `other` is closed.
+            Returns the number of items moved.
+            """
+            if other is self:
+                raise ValueError("can't transfer a queue's items to itself")
+            if not getattr(other, '_put_in_chunks', False):
+                raise TypeError("can't transfer items to a %s"
+                                % (other.__class__.__name__,))
+            if other.overflow is not None:
+                raise TypeError("can't transfer items to a queue"
+                                " with an overflow policy")
+            first, second = sorted((self, other), key=id)
+            served = other_served = None
+            first.mutex.acquire()
+            try:
+                second.mutex.acquire()
+                try:
+                    if other._closed:
+                        raise Closed
+                    count = self._available()
+                    if max_items is not None:
+                        count = min(count, max_items)
+                    if other.maxsize > 0:
+                        count = min(count,
+                                    max(0, other.maxsize - other._qsize()))
+                    staged = items = self._get_many(count) if count else []
+                    if self._expiring:
+                        now = _time()
+                        staged = [item for item in staged
+                                  if not _expired(item, now)]
+                        if len(staged) < count:
+                            self._expire(count - len(staged))
+                        items = [self._unwrap(item, now) for item in staged]
+                    moved = len(items)
+                    if moved:
+                        if other.ttl is not None:
+                            deadline = _time() + other.ttl
+                            items = [_Expiring(deadline, item)
+                                     for item in items]
+                        try:
+                            items = other._prepare_many(items)
+                        except:
+                            # Put the items back before anything is counted.
+                            if isinstance(self, _Queue.LifoQueue):
+                                staged = staged[::-1]
+                            self._put_many(self._prepare_many(staged))
+                            self.not_full.notify(count - moved)
+                            raise
+                        if other.ttl is not None:
+                            other._expiring = True
+                        other._put_many(items)
+                        other.unfinished_tasks += moved
+                        other.put_count += moved
+                        other.not_empty.notify(moved)
+                    if count:
+                        self.not_full.notify(count)
+                        self.unfinished_tasks -= moved
+                        if not self.unfinished_tasks:
+                            self.all_tasks_done.notify_all()
+                    if close and self._closed and not self._qsize():
+                        other._close()
+                    return moved
+                finally:
+                    if self._hooked:
+                        served = self._serve()
+                    if other._hooked:
+                        other_served = other._serve()
+                    second.mutex.release()
+            finally:
+                first.mutex.release()
+                if served:
+                    self._complete(served)
+                if other_served:
+                    other._complete(other_served)
+
+        def get_async(self):
+            """Return a `concurrent.futures.Future` of an item from the queue.
+
+            The future is completed with the item once one is available,
+              or failed with `Closed` once the queue is closed and empty.
+            Waiting futures are given items in the order they were created,
+              ahead of any threads blocked in `get`.
+            A future which is cancelled stops waiting at once.
+            """
+            return self._wait_async(True, None)
+
+        def put_async(self, item, last=False, deadline=None, **kwargs):
+            """Return a `concurrent.futures.Future` of a `put` of `item`.
+
+            The item is put once there is space for it,
+              and then the future is completed with `put`'s return value;
+              it is failed with `Closed` if the queue is closed first.
+            Waiting futures' items are put in the order they were created,
+              ahead of those of any threads blocked in `put`.
+            A future which is cancelled stops waiting at once,
+              and its item is not put.
+            """
+            if self.overflow is not None:
+                # `put` never blocks.
+                from concurrent.futures import Future
+                future = Future()
+                try:
+                    result = self.put(item, False, None, last, deadline,
+                                      **kwargs)
+                except Closed, e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+                return future
+            if deadline is None and self.ttl is not None:
+                deadline = _time() + self.ttl
+            if deadline is not None:
+                if not deadlines:
+                    raise TypeError("%s does not support deadlines" % (name,))
+                item = _Expiring(deadline, item)
+            return self._wait_async(False, (item, kwargs, last, deadline))
+
+        def _wait_async(self, get, put):
+            """Make a future wait for a `get`, or for the `put` described."""
+            from concurrent.futures import Future
+            future = Future()
+            future.add_done_callback(self._unlink)
+            self.mutex.acquire()
+            try:
+                if self._get_waiters is None:
+                    from collections import OrderedDict
+                    self._get_waiters = OrderedDict()
+                    self._put_waiters = OrderedDict()
+                    self._hooked = True
+                if get:
+                    self._get_waiters[future] = None
+                else:
+                    self._put_waiters[future] = put
+                served = self._serve()
+            finally:
+                self.mutex.release()
+            self._complete(served)
+            return future
+
+        def _unlink(self, future):
+            """Stop `future` waiting if it has been cancelled."""
+            if future.cancelled():
+                self.mutex.acquire()
+                try:
+                    self._get_waiters.pop(future, None)
+                    self._put_waiters.pop(future, None)
+                finally:
+                    self.mutex.release()
+
+        def _serve(self):
+            """Serve as many waiting futures as possible,
+              and check the watermarks.  The mutex must be held.
+
+            Returns a list of ``(function, argument)`` pairs
+              to be called once the mutex is released,
+              which complete the futures and call the watermark callbacks.
+            A future is marked as running once it has been chosen,
+              so that it can't then be cancelled.
+            """
+            served = []
+            if self._get_waiters is not None:
+                self._serve_futures(served)
+            if self.high_watermark is not None:
+                size = self._qsize()
+                if self.congested:
+                    if size <= self.low_watermark or self._closed:
+                        self.congested = False
+                        if self.on_low_watermark is not None:
+                            served.append((self.on_low_watermark, self))
+                elif size >= self.high_watermark and not self._closed:
+                    self.congested = True
+                    if self.on_high_watermark is not None:
+                        served.append((self.on_high_watermark, self))
+            return served
+
+        def _serve_futures(self, served):
+            getters = self._get_waiters
+            putters = self._put_waiters
+            progress = True
+            while progress:
+                progress = False
+                while putters and not self._closed:
+                    future = next(iter(putters))
+                    item, kwargs, last, deadline = putters[future]
+                    if self._full_for(item):
+                        break
+                    del putters[future]
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    if deadline is not None:
+                        self._expiring = True
+                    result = self._put(item, **kwargs)
+                    self.unfinished_tasks += 1
+                    self.put_count += 1
+                    self.not_empty.notify()
+                    if last:
+                        self._close()
+                    served.append((future.set_result, result))
+                    progress = True
+                while getters and self._qsize():
+                    future = next(iter(getters))
+                    if (not future.running()
+                        and not future.set_running_or_notify_cancel()):
+                        del getters[future]
+                        continue
+                    item = self._get()
+                    self.not_full.notify()
+                    if self._expiring:
+                        item = self._unwrap(item)
+                        if item is _EXPIRED:
+                            continue
+                    del getters[future]
+                    served.append((future.set_result, item))
+                    progress = True
+            if self._closed:
+                for future in putters:
+                    if future.set_running_or_notify_cancel():
+                        served.append((future.set_exception, Closed()))
+                putters.clear()
+                if not self._qsize():
+                    for future in getters:
+                        if (future.running()
+                            or future.set_running_or_notify_cancel()):
+                            served.append((future.set_exception, Closed()))
+                    getters.clear()
+
+        @staticmethod
+        def _complete(served):
+            for function, argument in served:
+                function(argument)
+
+        if not put_each:
+            def _full_for(self, item):
+                """True iff `put` must wait for space before putting `item`."""
+                return 0 < self.maxsize <= self._qsize()
+
+        # True iff a run of items can be put in a single chunk,
+        #   as `transfer_to` requires of its target.
+        _put_in_chunks = not put_each
+
+        def _available(self):
+            """Return the number of items which can be gotten at once.
+
+            `drain` and `transfer_to` get no more items than this.
+            """
+            return self._qsize()
+
+        # `put_many` and `get_many` use these methods to transfer items
+        #   to and from the underlying storage.
+        # Queue classes with more efficient bulk operations can override them.
+        if not hasattr(base, '_prepare_many'):
+            def _prepare_many(self, items):
+                """Convert `items` to a sequence which supports slicing."""
+                if isinstance(items, (list, tuple)):
+                    return items
+                return list(items)
+
+        if not hasattr(base, '_put_many'):
+            def _put_many(self, items):
+                for item in items:
+                    self._put(item)
+
+        if not hasattr(base, '_get_many'):
+            def _get_many(self, count):
+                return [self._get() for i in xrange(count)]
     CloseableQueue.__name__ = name
     return CloseableQueue
 
@@ -154,90 +1068,3314 @@ CloseableLifoQueue = CloseableQueueFactory(_Queue.LifoQueue,
 CloseablePriorityQueue = CloseableQueueFactory(_Queue.PriorityQueue,
                                                "CloseablePriorityQueue")
 
-def dequeue(q, getargs={}, on_empty='stop'):
-    """Generates values from the queue `q`.
+class ArrayQueue(_Queue.Queue):
+    """Variant of `Queue.Queue` which stores numeric items in typed arrays.
 
-    This is a fairly flexible function which can also be meaningfully applied
-      to non-closeable queues, by passing a `timeout` in `getargs`.
+    Items are kept in a ring of `array.array` blocks of `blocksize` items,
+      so that each item occupies the native width of `typecode`
+      instead of a reference to a boxed Python object.
 
-    The default arguments are suitable for generating an iteration
-      from a queue which is closed after/as the last value is `put` to it.
+    `put_many` on a closeable `ArrayQueue` accepts arrays of the same
+      typecode, NumPy arrays of the matching dtype and other buffer objects
+      without boxing their elements; `get_many` returns an `array.array`,
+      which can in turn be wrapped by `numpy.frombuffer`.
+    """
+    # Items are stored unboxed, so they can't be given deadlines.
+    _no_deadlines = True
 
-    To avoid false StopIterations, if a timeout is used with a closeable queue,
-      `on_empty` should be passed as `raise` or some sentinel value.
+    def __init__(self, typecode, maxsize=0, blocksize=4096):
+        self.typecode = typecode
+        self.blocksize = blocksize
+        _Queue.Queue.__init__(self, maxsize)
 
-    `getargs` is a dict which will comprise the keyword arguments to `q.get`.
+    def _init(self, maxsize):
+        # `queue` holds the blocks; the first item is at `_head`
+        #   in the first block and the last is at the end of the last one.
+        # A single consumed block is kept in `_spare` for reuse.
+        self.queue = _deque()
+        self._head = 0
+        self._count = 0
+        self._spare = None
 
-    `on_empty` determines the response to an `Empty` exception raised by `get`.
-      If 'raise', the `Empty` exception will be raised.
-      If 'stop', the `Empty` exception will be treated as a `Closed` exception.
-      Otherwise, the value passed in `on_empty` will be yielded.
+    def _qsize(self):
+        return self._count
 
-    Note that with the default value of `getargs`,
-      `Empty` exceptions will not occur.
-    """
-    try:
-        while True:
-            yield q.get(**getargs)
-    except Closed:
-        raise StopIteration
-    except Empty:
-        if on_empty == 'raise':
-            raise
-        elif on_empty == 'stop':
-            raise StopIteration
+    def _new_block(self):
+        block = self._spare
+        if block is None:
+            return _array(self.typecode)
+        self._spare = None
+        return block
+
+    def _release_head(self):
+        """Recycle the first block once all of its items have been gotten."""
+        block = self.queue.popleft()
+        self._head = 0
+        del block[:]
+        self._spare = block
+
+    def _put(self, item):
+        queue = self.queue
+        if not queue or len(queue[-1]) >= self.blocksize:
+            queue.append(self._new_block())
+        queue[-1].append(item)
+        self._count += 1
+
+    def _get(self):
+        block = self.queue[0]
+        item = block[self._head]
+        self._head += 1
+        self._count -= 1
+        if self._head == len(block):
+            self._release_head()
+        return item
+
+    def _drop_oldest(self):
+        return self._get()
+
+    def _prepare_many(self, items):
+        """Convert `items` to an array of this queue's typecode."""
+        if isinstance(items, _array) and items.typecode == self.typecode:
+            return items
+        result = _array(self.typecode)
+        dtype = getattr(items, 'dtype', None)
+        if dtype is not None:
+            if dtype.char != self.typecode:
+                raise TypeError("dtype %r does not match typecode %r"
+                                % (dtype.char, self.typecode))
+            if not items.flags['C_CONTIGUOUS']:
+                items = items.copy()
+            result.fromstring(buffer(items))
+        elif isinstance(items, _array):
+            result.fromlist(items.tolist())
+        elif isinstance(items, (buffer, bytearray)):
+            result.fromstring(buffer(items))
+        elif isinstance(items, memoryview):
+            result.fromstring(items.tobytes())
         else:
-            yield on_empty
+            result.extend(items)
+        return result
 
-def enqueue(it, q, putargs={}, join=False, close=True):
-    """`put`s the successive values of the iterable `it` into `q`.
+    def _put_many(self, items):
+        queue = self.queue
+        start, count = 0, len(items)
+        while start < count:
+            if not queue or len(queue[-1]) >= self.blocksize:
+                queue.append(self._new_block())
+            tail = queue[-1]
+            end = min(count, start + self.blocksize - len(tail))
+            tail.extend(items[start:end])
+            start = end
+        self._count += count
 
-    The default values will close the queue after the final iterated value.
+    def _get_many(self, count):
+        result = _array(self.typecode)
+        while count:
+            block = self.queue[0]
+            end = min(len(block), self._head + count)
+            result.extend(block[self._head:end])
+            count -= end - self._head
+            self._count -= end - self._head
+            self._head = end
+            if end == len(block):
+                self._release_head()
+        return result
 
-    `putargs` is a dict which will comprise the keyword arguments to `q.put`.
+CloseableArrayQueue = CloseableQueueFactory(ArrayQueue, "CloseableArrayQueue")
 
-    If `close` is true,
-      `q` must support the `close` method, i.e. be a CloseableQueue.
-    This will have the effect of closing the queue after the end of iteration.
+def _priority(item, key):
+    """Return the priority of `item` by `key`, ignoring any deadline."""
+    if type(item) is _Expiring:
+        item = item.item
+    return item if key is None else key(item)
 
-    If `join` is true, the queue is joined after the values are put,
-      and after optionally being closed.
+class PriorityHandle(object):
+    """Handle of an item put to an `IndexedPriorityQueue`.
+
+    `index` is the item's position in the queue's heap,
+      or None once it has been gotten or cancelled.
     """
-    for value in iter(it):
-        q.put(value, **putargs)
-    if close:
-        q.close()
-    if join:
-        q.join()
+    __slots__ = ('_stored', 'priority', 'sequence', 'index')
 
-def EnqueueThread(it, q=None, name='enqueue', start=True, enqueue=enqueue,
-                  **kwargs):
-    """Starts a thread which enqueues the values of the iterable `it`.
+    def __init__(self, item, priority, sequence, index):
+        # The item as stored, which may be wrapped with a deadline.
+        self._stored = item
+        self.priority = priority
+        self.sequence = sequence
+        self.index = index
 
-    If a queue is not passed, a new one is created.
+    @property
+    def item(self):
+        """The item, without any deadline it was put with."""
+        item = self._stored
+        if type(item) is _Expiring:
+            item = item.item
+        return item
 
-    A reference to the queue is stored as the property `q`
-      of the returned thread.
+    @property
+    def pending(self):
+        """True iff the item is still in the queue."""
+        return self.index is not None
 
-    The thread will be started unless `start` is false.
+    def __repr__(self):
+        return '<PriorityHandle %r at priority %r>' % (self.item, self.priority)
 
-    This is ideal for processing generators
-      and other iterables which lazily process I/O-bound operations.
 
-    Passing the return value of a `dequeue` call will have the effect
-      of creating a processing thread which pulls from and pushes to
-      thread-safe data structures.
+class IndexedPriorityQueue(_Queue.Queue):
+    """Variant of `Queue.PriorityQueue` whose items can be updated or cancelled.
 
-    Additional keyword arguments are passed on to `enqueue`.
+    `put` returns a `PriorityHandle`, which can be passed
+      to `update_priority` or `cancel` to change or remove the item
+      in O(log n) time while it is still in the queue.
+    Cancelled items are removed from the heap immediately,
+      rather than being left behind as dead entries.
+
+    The priority of an item is given by the `priority` argument to `put`,
+      or else is `key(item)`, or the item itself if `key` is None.
+    Items of equal priority are gotten in the order in which they were put.
+    `get` returns the item alone, without its priority.
     """
-    from threading import Thread
-    if q is None:
-        q = CloseableQueue()
-    thread = Thread(name=name,
-                    target=enqueue,
-                    args=(it, q),
-                    kwargs=kwargs)
-    thread.q = q
-    if start:
-        thread.start()
-    return thread
+    def __init__(self, maxsize=0, key=None):
+        self.key = key
+        _Queue.Queue.__init__(self, maxsize)
+
+    def _init(self, maxsize):
+        self.queue = []
+        self._sequence = 0
+
+    def _qsize(self, len=len):
+        return len(self.queue)
+
+    def _handle(self, item, priority):
+        if priority is None:
+            priority = _priority(item, self.key)
+        handle = PriorityHandle(item, priority, self._sequence, len(self.queue))
+        self._sequence += 1
+        return handle
+
+    def _put(self, item, priority=None):
+        handle = self._handle(item, priority)
+        self.queue.append(handle)
+        self._sift_up(handle.index)
+        return handle
+
+    def _put_many(self, items):
+        heap = self.queue
+        handles = [self._handle(item, None) for item in items]
+        for index, handle in enumerate(handles):
+            handle.index += index
+        heap.extend(handles)
+        if len(handles) > len(heap) // 4:
+            for index in reversed(xrange(len(heap) // 2)):
+                self._sift_down(index)
+        else:
+            for handle in handles:
+                self._sift_up(handle.index)
+        return handles
+
+    def _get(self):
+        return self._remove(0)._stored
+
+    def _drop_lowest(self, item, priority=None):
+        heap = self.queue
+        lowest = heap[len(heap) // 2]
+        for handle in heap[len(heap) // 2 + 1:]:
+            if self._before(lowest, handle):
+                lowest = handle
+        if priority is None:
+            priority = _priority(item, self.key)
+        if not priority < lowest.priority:
+            return item
+        return self._remove(lowest.index)._stored
+
+    def _remove_expired(self, now):
+        heap = self.queue
+        kept = []
+        for handle in heap:
+            if _expired(handle._stored, now):
+                handle.index = None
+            else:
+                kept.append(handle)
+        count = len(heap) - len(kept)
+        if count:
+            self.queue = kept
+            for index, handle in enumerate(kept):
+                handle.index = index
+            for index in reversed(xrange(len(kept) // 2)):
+                self._sift_down(index)
+        return count
+
+    def _remove(self, index):
+        """Remove and return the handle at position `index` of the heap."""
+        heap = self.queue
+        handle = heap[index]
+        last = heap.pop()
+        if last is not handle:
+            heap[index] = last
+            last.index = index
+            self._sift_down(index)
+            self._sift_up(last.index)
+        handle.index = None
+        return handle
+
+    @staticmethod
+    def _before(a, b):
+        """True iff the handle `a` should be gotten before the handle `b`."""
+        if a.priority == b.priority:
+            return a.sequence < b.sequence
+        return a.priority < b.priority
+
+    def _sift_up(self, index):
+        heap, before = self.queue, self._before
+        handle = heap[index]
+        while index > 0:
+            parent_index = (index - 1) >> 1
+            parent = heap[parent_index]
+            if not before(handle, parent):
+                break
+            heap[index] = parent
+            parent.index = index
+            index = parent_index
+        heap[index] = handle
+        handle.index = index
+
+    def _sift_down(self, index):
+        heap, before = self.queue, self._before
+        size = len(heap)
+        handle = heap[index]
+        while True:
+            child_index = 2 * index + 1
+            if child_index >= size:
+                break
+            child = heap[child_index]
+            if child_index + 1 < size and before(heap[child_index + 1], child):
+                child_index += 1
+                child = heap[child_index]
+            if not before(child, handle):
+                break
+            heap[index] = child
+            child.index = index
+            index = child_index
+        heap[index] = handle
+        handle.index = index
+
+    def update_priority(self, handle, priority):
+        """Change the priority of a pending item.
+
+        The item keeps its place among items of the same priority
+          according to when it was originally put.
+        Raises `ValueError` if the item is no longer in the queue.
+        """
+        served = None
+        self.mutex.acquire()
+        try:
+            if handle.index is None:
+                raise ValueError("item is no longer in the queue")
+            handle.priority = priority
+            self._sift_down(handle.index)
+            self._sift_up(handle.index)
+            if handle.index == 0:
+                self.not_empty.notify()
+        finally:
+            # A closeable queue serves its futures and checks its watermarks
+            #   as after any other operation.
+            if getattr(self, '_hooked', False):
+                served = self._serve()
+            self.mutex.release()
+            if served:
+                self._complete(served)
+
+    def cancel(self, handle):
+        """Remove a pending item from the queue.
+
+        The item is treated as though it had been gotten and its task done.
+        Returns False if the item was no longer in the queue.
+        """
+        served = None
+        self.mutex.acquire()
+        try:
+            if handle.index is None:
+                return False
+            self._remove(handle.index)
+            self.unfinished_tasks -= 1
+            if not self.unfinished_tasks:
+                self.all_tasks_done.notify_all()
+            self.not_full.notify()
+            return True
+        finally:
+            if getattr(self, '_hooked', False):
+                served = self._serve()
+            self.mutex.release()
+            if served:
+                self._complete(served)
+
+    def _clear(self):
+        for handle in self.queue:
+            handle.index = None
+        count = len(self.queue)
+        self._init(self.maxsize)
+        return count
+
+CloseableIndexedPriorityQueue = CloseableQueueFactory(
+    IndexedPriorityQueue, "CloseableIndexedPriorityQueue")
+
+class _KeyBucket(_deque):
+    """The items of a `KeyPriorityQueue` which share a priority."""
+    __slots__ = ()
+
+
+class KeyPriorityQueue(_Queue.Queue):
+    """Variant of `Queue.PriorityQueue` which never compares its items.
+
+    The priority of an item is given by the `priority` argument to `put`,
+      or else is computed once by `key(item)`;
+      if `key` is None, the item is its own priority.
+    Priorities should be numbers, or other hashable and cheaply compared keys.
+
+    The heap holds only the distinct priorities, so that `heapq`
+      compares plain numbers rather than ``(priority, sequence, item)`` tuples,
+      and no tuple is allocated per item.
+    The items are kept in a dict keyed by priority,
+      with a deque for each priority shared by several pending items,
+      so that items of equal priority are gotten in the order they were put.
+    `get` returns the item alone, without its priority.
+    """
+    def __init__(self, maxsize=0, key=None):
+        self.key = key
+        _Queue.Queue.__init__(self, maxsize)
+
+    def _init(self, maxsize):
+        self.queue = []
+        self._items = {}
+        self._count = 0
+
+    def _qsize(self):
+        return self._count
+
+    def _put(self, item, priority=None, heappush=_heapq.heappush):
+        if priority is None:
+            priority = _priority(item, self.key)
+        items = self._items
+        if priority in items:
+            pending = items[priority]
+            if type(pending) is _KeyBucket:
+                pending.append(item)
+            else:
+                items[priority] = _KeyBucket((pending, item))
+        else:
+            items[priority] = item
+            heappush(self.queue, priority)
+        self._count += 1
+
+    def _get(self, heappop=_heapq.heappop):
+        priority = self.queue[0]
+        items = self._items
+        pending = items[priority]
+        self._count -= 1
+        if type(pending) is _KeyBucket:
+            item = pending.popleft()
+            if pending:
+                return item
+        else:
+            item = pending
+        del items[priority]
+        heappop(self.queue)
+        return item
+
+    def _drop_lowest(self, item, priority=None):
+        """Remove the newest of the items of the lowest priority."""
+        heap = self.queue
+        index = max(xrange(len(heap) // 2, len(heap)), key=heap.__getitem__)
+        lowest = heap[index]
+        if priority is None:
+            priority = _priority(item, self.key)
+        if not priority < lowest:
+            return item
+        self._count -= 1
+        pending = self._items[lowest]
+        if type(pending) is _KeyBucket:
+            dropped = pending.pop()
+            if pending:
+                return dropped
+        else:
+            dropped = pending
+        del self._items[lowest]
+        last = heap.pop()
+        if index < len(heap):
+            heap[index] = last
+            _heapq._siftdown(heap, 0, index)
+        return dropped
+
+    def _remove_expired(self, now):
+        items = self._items
+        count = 0
+        for priority, pending in items.items():
+            if type(pending) is _KeyBucket:
+                kept = [item for item in pending if not _expired(item, now)]
+                count += len(pending) - len(kept)
+                if len(kept) > 1:
+                    items[priority] = _KeyBucket(kept)
+                elif kept:
+                    items[priority] = kept[0]
+                else:
+                    del items[priority]
+            elif _expired(pending, now):
+                count += 1
+                del items[priority]
+        if count:
+            self.queue = [priority for priority in self.queue
+                          if priority in items]
+            _heapq.heapify(self.queue)
+            self._count -= count
+        return count
+
+CloseableKeyPriorityQueue = CloseableQueueFactory(KeyPriorityQueue,
+                                                  "CloseableKeyPriorityQueue")
+
+class _TimerWheelQueue(_Queue.Queue):
+    """Storage for `CloseableDelayQueue`: a hierarchical timer wheel.
+
+    Time is divided into ticks of `resolution` seconds.
+    Level 0 of the wheel has a bucket for each of the next `slots` ticks,
+      and each bucket of level L spans ``slots ** L`` ticks;
+      when the current tick reaches the start of a higher-level bucket,
+      its entries are cascaded into the lower levels.
+    Entries due after the range of the top level are kept in `_overflow`
+      and redistributed each time the top level wraps around.
+
+    Inserting an entry takes O(`levels`) time regardless of the number
+      of pending entries.
+    Entries whose time has come are moved to the `_ready` deque.
+    `_qsize` counts both ready and pending entries, so that `maxsize`
+      bounds the total.
+    """
+    def __init__(self, maxsize=0, resolution=0.001, slots=256, levels=4):
+        self.resolution = resolution
+        self.slots = slots
+        self.levels = levels
+        _Queue.Queue.__init__(self, maxsize)
+
+    def _init(self, maxsize):
+        self._spans = [self.slots ** level for level in xrange(self.levels + 1)]
+        self._wheels = [[None] * self.slots for level in xrange(self.levels)]
+        self._overflow = []
+        self._ready = _deque()
+        self._current = self._tick(_time())
+        self._next_tick = None
+        self._pending = 0
+        self._count = 0
+
+    def _tick(self, t):
+        return int(t / self.resolution)
+
+    def _qsize(self):
+        return self._count
+
+    def _put(self, item, delay=None, at=None):
+        if delay is not None:
+            at = _time() + delay
+        if at is None:
+            self._ready.append(item)
+        else:
+            self._schedule((int(-(-at // self.resolution)), item))
+        self._count += 1
+
+    def _get(self):
+        self._count -= 1
+        return self._ready.popleft()
+
+    def _schedule(self, entry):
+        """Place `entry`, a (due tick, item) pair, relative to `_current`."""
+        due, current = entry[0], self._current
+        if due <= current:
+            self._ready.append(entry[1])
+            return
+        spans = self._spans
+        for level in xrange(self.levels):
+            if due // spans[level + 1] == current // spans[level + 1]:
+                block = due // spans[level]
+                wheel, index = self._wheels[level], block % self.slots
+                if wheel[index] is None:
+                    wheel[index] = [entry]
+                else:
+                    wheel[index].append(entry)
+                processed = block * spans[level]
+                break
+        else:
+            self._overflow.append(entry)
+            top = spans[self.levels]
+            processed = (current // top + 1) * top
+        self._pending += 1
+        if self._next_tick is None or processed < self._next_tick:
+            self._next_tick = processed
+
+    def _find_next_tick(self):
+        """Return the next tick at which any pending entry must be processed."""
+        if not self._pending:
+            return None
+        spans, slots, current = self._spans, self.slots, self._current
+        for level in xrange(self.levels):
+            wheel, span = self._wheels[level], spans[level]
+            end = (current // spans[level + 1] + 1) * slots
+            for block in xrange(current // span + 1, end):
+                if wheel[block % slots]:
+                    return block * span
+        top = spans[self.levels]
+        return (current // top + 1) * top
+
+    def _process(self, tick):
+        """Advance to `tick`, cascading and expiring the entries due then."""
+        self._current = tick
+        spans, slots = self._spans, self.slots
+        if not tick % spans[self.levels] and self._overflow:
+            entries, self._overflow = self._overflow, []
+            self._pending -= len(entries)
+            for entry in entries:
+                self._schedule(entry)
+        for level in reversed(xrange(1, self.levels)):
+            if not tick % spans[level]:
+                wheel = self._wheels[level]
+                index = (tick // spans[level]) % slots
+                entries, wheel[index] = wheel[index], None
+                if entries:
+                    self._pending -= len(entries)
+                    for entry in entries:
+                        self._schedule(entry)
+        wheel, index = self._wheels[0], tick % slots
+        entries, wheel[index] = wheel[index], None
+        if entries:
+            self._pending -= len(entries)
+            self._ready.extend(entry[1] for entry in entries)
+
+    def _advance(self, now):
+        """Make ready all of the entries which are due by the time `now`."""
+        tick = self._tick(now)
+        while self._next_tick is not None and self._next_tick <= tick:
+            self._process(self._next_tick)
+            self._next_tick = self._find_next_tick()
+        if tick > self._current:
+            self._current = tick
+
+    def _remove_expired(self, now):
+        ready = self._ready
+        kept = [item for item in ready if not _expired(item, now)]
+        count = len(ready) - len(kept)
+        if count:
+            self._ready = _deque(kept)
+        pending = 0
+        for wheel in self._wheels:
+            for index, entries in enumerate(wheel):
+                if entries:
+                    kept = [entry for entry in entries
+                            if not _expired(entry[1], now)]
+                    pending += len(entries) - len(kept)
+                    wheel[index] = kept or None
+        kept = [entry for entry in self._overflow
+                if not _expired(entry[1], now)]
+        pending += len(self._overflow) - len(kept)
+        self._overflow = kept
+        if pending:
+            # `_next_tick` is left as it was, since processing a tick
+            #   whose entries have been removed does no harm.
+            self._pending -= pending
+            if not self._pending:
+                self._next_tick = None
+        self._count -= count + pending
+        return count + pending
+
+    def _discard_pending(self):
+        """Drop all entries which are not yet due."""
+        self._wheels = [[None] * self.slots for level in xrange(self.levels)]
+        self._overflow = []
+        self._count -= self._pending
+        self.unfinished_tasks -= self._pending
+        self._pending = 0
+        self._next_tick = None
+        if not self.unfinished_tasks:
+            self.all_tasks_done.notify_all()
+        self.not_full.notify_all()
+
+
+_CloseableTimerWheelQueue = CloseableQueueFactory(_TimerWheelQueue,
+                                                  "CloseableDelayQueue")
+
+class CloseableDelayQueue(_CloseableTimerWheelQueue):
+    """Closeable queue whose items become visible only when they are due.
+
+    `put(item, delay=seconds)` or `put(item, at=timestamp)` schedules
+      the item to be gotten no earlier than the given time;
+      an item put without either is due immediately.
+    Due items are gotten in order of their due ticks,
+      and `get` sleeps until the next item is due.
+    Items are scheduled on a hierarchical timer wheel with ticks
+      of `resolution` seconds, so that `put` takes constant time
+      however many items are pending.
+
+    A `ttl` given to the constructor counts from when each item is due,
+      rather than from when it is put.
+
+    `on_close` determines what happens to items which are not yet due
+      when the queue is closed:
+      with 'drain', `get` goes on delivering them as they become due,
+      and only raises `Closed` once all have been gotten;
+      with 'discard', they are dropped and count as done for `join`.
+    Other keyword arguments, such as `name` and `high_watermark`,
+      are those of the other `Closeable*Queue` classes.
+    """
+    def __init__(self, maxsize=0, resolution=0.001, slots=256, levels=4,
+                 on_close='drain', **kwargs):
+        if on_close not in ('drain', 'discard'):
+            raise ValueError("'on_close' must be 'drain' or 'discard'")
+        self.on_close = on_close
+        _CloseableTimerWheelQueue.__init__(self, maxsize, resolution,
+                                           slots, levels, **kwargs)
+
+    def close(self, discard=False):
+        """Close the queue, discarding pending items if `on_close` says so.
+
+        If `discard` is true, due items are discarded as well.
+        """
+        _CloseableTimerWheelQueue.close(self, discard)
+        if self.on_close == 'discard':
+            self.mutex.acquire()
+            try:
+                self._discard_pending()
+            finally:
+                self.mutex.release()
+
+    def get_async(self):
+        """Not supported, since nothing would complete a future on time."""
+        raise TypeError("CloseableDelayQueue does not support get_async")
+
+    def _available(self):
+        """Return the number of due items, since `_qsize` counts all."""
+        self._advance(_time())
+        return len(self._ready)
+
+    def put(self, item, block=True, timeout=None, last=False, deadline=None,
+            **kwargs):
+        """Put an item into the queue, as does `CloseableQueue.put`.
+
+        The item is due after `delay` seconds or at the time `at`,
+          and a `ttl` counts from when it becomes due.
+        """
+        return _CloseableTimerWheelQueue.put(
+            self, item, block, timeout, last,
+            self._deadline(deadline, **kwargs), **kwargs)
+
+    def put_async(self, item, last=False, deadline=None, **kwargs):
+        """Put an item into the queue, as does `CloseableQueue.put_async`."""
+        return _CloseableTimerWheelQueue.put_async(
+            self, item, last, self._deadline(deadline, **kwargs), **kwargs)
+
+    def _deadline(self, deadline, delay=None, at=None):
+        """Return the deadline of an item due after `delay` or at `at`."""
+        if deadline is None and self.ttl is not None:
+            if delay is not None:
+                at = _time() + delay
+            elif at is None:
+                at = _time()
+            deadline = at + self.ttl
+        return deadline
+
+    @staticmethod
+    def _endtime(timeout):
+        """Return the time at which a `get` with `timeout` gives up."""
+        if timeout is None:
+            return None
+        if timeout < 0:
+            raise ValueError("'timeout' must be a positive number")
+        return _time() + timeout
+
+    def _wait_ready(self, block, endtime):
+        """Wait until an item is due, as `get` does, or until `endtime`."""
+        while True:
+            now = _time()
+            self._advance(now)
+            if self._ready:
+                return
+            if self._closed:
+                if self._pending and self.on_close == 'discard':
+                    self._discard_pending()
+                if not self._pending:
+                    raise Closed
+            if not block:
+                raise Empty
+            wait = None
+            if self._next_tick is not None:
+                wait = max(0.0, self._next_tick * self.resolution - now)
+            if endtime is not None:
+                remaining = endtime - now
+                if remaining <= 0.0:
+                    raise Empty
+                if wait is None or remaining < wait:
+                    wait = remaining
+            self.not_empty.wait(wait)
+
+    def get(self, block=True, timeout=None):
+        """Remove and return the next due item.
+
+        Works as does `CloseableQueue.get`, but waits for an item to be due
+          rather than merely present.
+        """
+        served = None
+        endtime = self._endtime(timeout)
+        self.not_empty.acquire()
+        try:
+            while True:
+                self._wait_ready(block, endtime)
+                item = self._get()
+                self.not_full.notify()
+                if self._expiring:
+                    item = self._unwrap(item)
+                    if item is _EXPIRED:
+                        continue
+                return item
+        finally:
+            if self._hooked:
+                served = self._serve()
+            self.not_empty.release()
+            if served:
+                self._complete(served)
+
+    def get_many(self, max_items=None, block=True, timeout=None):
+        """Remove and return up to `max_items` due items, as a list."""
+        served = None
+        endtime = self._endtime(timeout)
+        self.not_empty.acquire()
+        try:
+            while True:
+                self._wait_ready(block, endtime)
+                count = len(self._ready)
+                if max_items is not None:
+                    count = min(count, max_items)
+                items = [self._get() for i in xrange(count)]
+                self.not_full.notify(count)
+                if self._expiring:
+                    items = self._unwrap_many(items)
+                    if not items and count:
+                        continue
+                return items
+        finally:
+            if self._hooked:
+                served = self._serve()
+            self.not_empty.release()
+            if served:
+                self._complete(served)
+
+class CoalescingQueue(_Queue.Queue):
+    """Variant of `Queue.Queue` which keeps only the latest value of each key.
+
+    Items are ``(key, value)`` pairs, and `get` returns such a pair.
+    Putting an item whose key is still pending in the queue
+      replaces the pending value, so that getters only see the latest one.
+    The key keeps its original position in the queue,
+      or is moved to the back if `move_to_back` is true.
+
+    A replacing `put` never waits for space,
+      and the replaced value counts as done for the purposes of `join`.
+    `coalesced` counts the values which have been replaced.
+    """
+    # Values are stored apart from their keys, so they can't be given deadlines.
+    _no_deadlines = True
+
+    def __init__(self, maxsize=0, move_to_back=False):
+        self.move_to_back = move_to_back
+        self.coalesced = 0
+        _Queue.Queue.__init__(self, maxsize)
+
+    def _init(self, maxsize):
+        from collections import OrderedDict
+        self.queue = OrderedDict()
+
+    def _qsize(self, len=len):
+        return len(self.queue)
+
+    def _full_for(self, item):
+        return 0 < self.maxsize <= len(self.queue) and item[0] not in self.queue
+
+    def _put(self, item):
+        key, value = item
+        queue = self.queue
+        if key in queue:
+            if self.move_to_back:
+                del queue[key]
+            self.coalesced += 1
+            # `put` counts a new task for each item;
+            #   that of the replaced value will never be done by a getter.
+            self.unfinished_tasks -= 1
+        queue[key] = value
+
+    def _get(self):
+        return self.queue.popitem(last=False)
+
+    _drop_oldest = _get
+
+CloseableCoalescingQueue = CloseableQueueFactory(CoalescingQueue,
+                                                 "CloseableCoalescingQueue")
+
+class FairQueue(_Queue.Queue):
+    """Variant of `Queue.Queue` which shares its capacity fairly among tenants.
+
+    Items are ``(tenant, value)`` pairs, and `get` returns such a pair.
+    Each tenant's items are kept in a sub-queue of their own,
+      and the sub-queues are served by deficit round robin:
+      on each of its turns a tenant may have up to its weight's worth
+      of items gotten, so that a tenant with weight 2 is served twice
+      as often as one with weight 1 while both have items pending.
+    Fractional weights are carried over from turn to turn.
+
+    `weights` maps tenants to their weights;
+      tenants which are not in it have the weight `default_weight`.
+    It may be changed while the queue is in use.
+
+    `maxsize` bounds the number of items in the queue as a whole,
+      and `tenant_maxsize`, if greater than 0, the number of each tenant's.
+    A tenant's sub-queue is created by the first put of its items,
+      and reclaimed as soon as its last item is gotten.
+    """
+    def __init__(self, maxsize=0, tenant_maxsize=0, weights=None,
+                 default_weight=1):
+        if default_weight <= 0:
+            raise ValueError("'default_weight' must be a positive number")
+        self.tenant_maxsize = tenant_maxsize
+        self.weights = {} if weights is None else weights
+        self.default_weight = default_weight
+        _Queue.Queue.__init__(self, maxsize)
+
+    def _init(self, maxsize):
+        self.queue = {}
+        # The tenants with pending items, in the order they will be served,
+        #   and the number of items each may have gotten on its current turn.
+        self._active = _deque()
+        self._deficit = {}
+        self._size = 0
+
+    def _qsize(self):
+        return self._size
+
+    def tenant_qsize(self, tenant):
+        """Return the approximate number of `tenant`'s items in the queue."""
+        self.mutex.acquire()
+        try:
+            sub = self.queue.get(tenant)
+            return 0 if sub is None else len(sub)
+        finally:
+            self.mutex.release()
+
+    @staticmethod
+    def _tenant(item):
+        if type(item) is _Expiring:
+            item = item.item
+        return item[0]
+
+    def _full_for(self, item):
+        if 0 < self.maxsize <= self._size:
+            return True
+        if self.tenant_maxsize > 0:
+            sub = self.queue.get(self._tenant(item))
+            return sub is not None and len(sub) >= self.tenant_maxsize
+        return False
+
+    def _put(self, item):
+        tenant = self._tenant(item)
+        sub = self.queue.get(tenant)
+        if sub is None:
+            sub = self.queue[tenant] = _deque()
+            self._deficit[tenant] = 0
+            self._active.append(tenant)
+        sub.append(item)
+        self._size += 1
+
+    def _get(self):
+        active = self._active
+        deficit = self._deficit
+        tenant = active[0]
+        while deficit[tenant] < 1:
+            weight = self.weights.get(tenant, self.default_weight)
+            if weight <= 0:
+                raise ValueError("the weight of %r must be a positive number"
+                                 % (tenant,))
+            deficit[tenant] += weight
+            if deficit[tenant] < 1:
+                active.rotate(-1)
+                tenant = active[0]
+        sub = self.queue[tenant]
+        item = sub.popleft()
+        self._size -= 1
+        deficit[tenant] -= 1
+        if not sub:
+            del self.queue[tenant]
+            del deficit[tenant]
+            active.popleft()
+        elif deficit[tenant] < 1:
+            active.rotate(-1)
+        if self.tenant_maxsize > 0:
+            # A waiting `put` may be waiting on this tenant's cap
+            #   rather than on `maxsize`, so any of them might now proceed.
+            self.not_full.notify_all()
+        return item
+
+    def _remove_expired(self, now):
+        count = 0
+        for tenant, sub in self.queue.items():
+            kept = [item for item in sub if not _expired(item, now)]
+            if len(kept) < len(sub):
+                count += len(sub) - len(kept)
+                if kept:
+                    self.queue[tenant] = _deque(kept)
+                else:
+                    del self.queue[tenant]
+                    del self._deficit[tenant]
+                    self._active.remove(tenant)
+        self._size -= count
+        if count and self.tenant_maxsize > 0:
+            self.not_full.notify_all()
+        return count
+
+CloseableFairQueue = CloseableQueueFactory(FairQueue, "CloseableFairQueue")
+
+class BroadcastSubscription(object):
+    """A subscriber's view of a `CloseableBroadcastQueue`.
+
+    Created by `CloseableBroadcastQueue.subscribe`.
+    `get` returns each item put to the queue after the subscription was made,
+      and raises `Closed` once the queue is closed
+      and this subscriber has gotten all of its items.
+
+    `dropped` counts the items this subscriber lost
+      to the queue's 'drop' policy.
+    """
+    def __init__(self, queue, cursor):
+        self.queue = queue
+        self.cursor = cursor
+        self.dropped = 0
+
+    def get(self, block=True, timeout=None):
+        """Return this subscriber's next item, as does `CloseableQueue.get`."""
+        return self.queue._get(self, block, timeout)
+
+    def qsize(self):
+        """The approximate number of items not yet gotten by this subscriber."""
+        return self.queue._tail - self.cursor
+
+    def unsubscribe(self):
+        """Stop receiving items, releasing any which are held only for us."""
+        self.queue._unsubscribe(self)
+
+
+class CloseableBroadcastQueue(object):
+    """Closeable queue which delivers each item to every subscriber.
+
+    Each item is stored once, and each subscriber, created with `subscribe`,
+      reads the items through its own cursor.
+    An item is released once the slowest subscriber has gotten it;
+      items put while there are no subscribers are discarded.
+
+    `maxsize` bounds the number of items held for the slowest subscriber.
+    When it is reached, `policy` determines the behaviour of `put`:
+      with 'block', `put` blocks as would that of `CloseableQueue`;
+      with 'drop', the oldest item is discarded for the slowest subscribers,
+      and counted in their `dropped` attributes and in the queue's own.
+
+    Closing the queue raises `Closed` in each subscriber's `get`
+      once that subscriber has gotten all of its items.
+    """
+    def __init__(self, maxsize=0, policy='block'):
+        import threading
+        if policy not in ('block', 'drop'):
+            raise ValueError("'policy' must be 'block' or 'drop'")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.mutex = threading.Lock()
+        self.not_empty = threading.Condition(self.mutex)
+        self.not_full = threading.Condition(self.mutex)
+        # `_items[0]` is the item numbered `_head`; `_tail` numbers the next.
+        self._items = _deque()
+        self._head = 0
+        self._tail = 0
+        self._subscriptions = []
+        self._closed = False
+
+    def subscribe(self):
+        """Return a new `BroadcastSubscription` to the items put from now on."""
+        self.mutex.acquire()
+        try:
+            subscription = BroadcastSubscription(self, self._tail)
+            self._subscriptions.append(subscription)
+            return subscription
+        finally:
+            self.mutex.release()
+
+    def close(self, discard=False):
+        """Close the queue, as does `CloseableQueue.close`.
+
+        If `discard` is true, the items held for the subscribers
+          are discarded.
+        """
+        self.mutex.acquire()
+        try:
+            if discard:
+                self._items.clear()
+                self._head = self._tail
+                for subscription in self._subscriptions:
+                    subscription.cursor = self._tail
+            if not self._closed:
+                self._closed = True
+                self.not_empty.notify_all()
+                self.not_full.notify_all()
+        finally:
+            self.mutex.release()
+
+    def closed(self):
+        """True iff the queue is closed.  Unreliable like `empty` and `full`."""
+        return self._closed
+
+    def qsize(self):
+        """The approximate number of items held for the slowest subscriber."""
+        return self._tail - self._head
+
+    def put(self, item, block=True, timeout=None, last=False):
+        """Put an item into the queue for all current subscribers.
+
+        Works as does `CloseableQueue.put`,
+          except that with the 'drop' policy it never blocks.
+        """
+        self.not_full.acquire()
+        try:
+            if self.maxsize > 0 and self.policy == 'block':
+                if not block:
+                    if self._full() and not self._closed:
+                        raise Full
+                elif timeout is None:
+                    while self._full() and not self._closed:
+                        self.not_full.wait()
+                elif timeout < 0:
+                    raise ValueError("'timeout' must be a positive number")
+                else:
+                    endtime = _time() + timeout
+                    while self._full() and not self._closed:
+                        remaining = endtime - _time()
+                        if remaining <= 0.0:
+                            raise Full
+                        self.not_full.wait(remaining)
+            if self._closed:
+                raise Closed
+            if self._subscriptions:
+                if self.maxsize > 0 and self._full():
+                    self._drop_oldest()
+                self._items.append(item)
+                self._tail += 1
+            else:
+                self._head = self._tail = self._tail + 1
+            if last:
+                self._closed = True
+                self.not_full.notify_all()
+            self.not_empty.notify_all()
+        finally:
+            self.not_full.release()
+
+    def _full(self):
+        return self._tail - self._head >= self.maxsize
+
+    def _drop_oldest(self):
+        """Discard the oldest item, advancing the cursors which point to it."""
+        for subscription in self._subscriptions:
+            if subscription.cursor == self._head:
+                subscription.cursor += 1
+                subscription.dropped += 1
+        self._items.popleft()
+        self._head += 1
+        self.dropped += 1
+
+    def _release(self):
+        """Discard the items which all subscribers have gotten."""
+        if self._subscriptions:
+            head = min(s.cursor for s in self._subscriptions)
+        else:
+            head = self._tail
+        if head > self._head:
+            for i in xrange(head - self._head):
+                self._items.popleft()
+            self._head = head
+            self.not_full.notify_all()
+
+    def _get(self, subscription, block, timeout):
+        self.not_empty.acquire()
+        try:
+            if subscription not in self._subscriptions:
+                raise ValueError("subscription has been cancelled")
+            if not block:
+                if subscription.cursor == self._tail and not self._closed:
+                    raise Empty
+            elif timeout is None:
+                while subscription.cursor == self._tail and not self._closed:
+                    self.not_empty.wait()
+            elif timeout < 0:
+                raise ValueError("'timeout' must be a positive number")
+            else:
+                endtime = _time() + timeout
+                while subscription.cursor == self._tail and not self._closed:
+                    remaining = endtime - _time()
+                    if remaining <= 0.0:
+                        raise Empty
+                    self.not_empty.wait(remaining)
+            if subscription.cursor == self._tail:
+                raise Closed
+            cursor = subscription.cursor
+            item = self._items[cursor - self._head]
+            subscription.cursor = cursor + 1
+            if cursor == self._head:
+                self._release()
+            return item
+        finally:
+            self.not_empty.release()
+
+    def _unsubscribe(self, subscription):
+        self.mutex.acquire()
+        try:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+                self._release()
+        finally:
+            self.mutex.release()
+
+class _Handoff(object):
+    """A party waiting in a `CloseableSynchronousQueue`."""
+    __slots__ = ('item', 'done', 'condition')
+
+    def __init__(self, condition, item=None):
+        self.condition = condition
+        self.item = item
+        self.done = False
+
+class CloseableSynchronousQueue(object):
+    """Closeable queue with no capacity, which hands items directly over.
+
+    A `put` returns only once a `get` has taken its item,
+      and a `get` waits until a `put` offers one,
+      so that no item is ever held by the queue itself.
+    Waiting producers and consumers are each paired in the order they arrived.
+
+    A non-blocking `put` succeeds only if a consumer is already waiting,
+      and a non-blocking `get` only if a producer is.
+
+    Closing the queue raises `Closed` in every waiting `put` and `get`;
+      the items of the waiting `put`s are not delivered.
+    """
+    maxsize = 0
+
+    def __init__(self):
+        import threading
+        self._Condition = threading.Condition
+        self.mutex = threading.Lock()
+        # Each thread waits on a condition of its own,
+        #   which is kept for its later waits on the queue.
+        self._local = threading.local()
+        self._putters = _deque()
+        self._getters = _deque()
+        self._closed = False
+
+    def close(self, discard=False):
+        """Close the queue, as does `CloseableQueue.close`.
+
+        `discard` is accepted for compatibility;
+          the queue never holds any items to discard.
+        """
+        self.mutex.acquire()
+        try:
+            self._close()
+        finally:
+            self.mutex.release()
+
+    def _close(self):
+        if not self._closed:
+            self._closed = True
+            for waiters in (self._putters, self._getters):
+                for waiter in waiters:
+                    waiter.condition.notify()
+                waiters.clear()
+
+    def closed(self):
+        """True iff the queue is closed.  Unreliable like `empty` and `full`."""
+        return self._closed
+
+    def qsize(self):
+        """Always 0, since the queue never holds any items."""
+        return 0
+
+    def waiting(self):
+        """The approximate numbers of waiting `put`s and `get`s, as a pair."""
+        return len(self._putters), len(self._getters)
+
+    def _condition(self):
+        """Return the calling thread's condition for waiting on the queue."""
+        condition = getattr(self._local, 'condition', None)
+        if condition is None:
+            condition = self._local.condition = self._Condition(self.mutex)
+        return condition
+
+    def _wait(self, waiters, waiter, block, timeout, timed_out):
+        """Wait in `waiters` until `waiter` is done.
+
+        Raises `timed_out` if `timeout` or the absence of `block`
+          lets the wait end first, and `Closed` if the queue is closed.
+        """
+        if not block:
+            raise timed_out
+        if timeout is not None and timeout < 0:
+            raise ValueError("'timeout' must be a positive number")
+        waiters.append(waiter)
+        if timeout is None:
+            while not waiter.done and not self._closed:
+                waiter.condition.wait()
+        else:
+            endtime = _time() + timeout
+            while not waiter.done and not self._closed:
+                remaining = endtime - _time()
+                if remaining <= 0.0:
+                    waiters.remove(waiter)
+                    raise timed_out
+                waiter.condition.wait(remaining)
+        if not waiter.done:
+            raise Closed
+
+    def put(self, item, block=True, timeout=None, last=False):
+        """Hand `item` over to a `get`, waiting for one if necessary.
+
+        Works as does `CloseableQueue.put`,
+          raising `Full` if no `get` takes the item in time.
+        If `last` is true, the queue is closed once the item has been taken.
+        """
+        self.mutex.acquire()
+        try:
+            if self._closed:
+                raise Closed
+            if self._getters:
+                getter = self._getters.popleft()
+                getter.item = item
+                getter.done = True
+                getter.condition.notify()
+            else:
+                self._wait(self._putters, _Handoff(self._condition(), item),
+                           block, timeout, Full)
+            if last:
+                self._close()
+        finally:
+            self.mutex.release()
+
+    def get(self, block=True, timeout=None):
+        """Take an item from a `put`, waiting for one if necessary.
+
+        Works as does `CloseableQueue.get`.
+        """
+        self.mutex.acquire()
+        try:
+            if self._putters:
+                putter = self._putters.popleft()
+                putter.done = True
+                putter.condition.notify()
+                return putter.item
+            if self._closed:
+                raise Closed
+            getter = _Handoff(self._condition())
+            self._wait(self._getters, getter, block, timeout, Empty)
+            return getter.item
+        finally:
+            self.mutex.release()
+
+def snapshot(queues):
+    """Return a list of the approximate stats of each of `queues`.
+
+    Suits metrics exporters which sample many queues,
+      since no queue's mutex is taken.
+    The `approx_stats` of the `Closeable*Queue` classes are used;
+      other queues are reported by their `qsize` and `closed` methods,
+      which take no lock in the broadcast and synchronous queues.
+    """
+    stats = []
+    for q in queues:
+        approx_stats = getattr(q, 'approx_stats', None)
+        if approx_stats is not None:
+            stats.append(approx_stats())
+        else:
+            stats.append(dict(qsize=q.qsize(), maxsize=q.maxsize,
+                              closed=q.closed()))
+    return stats
+
+
+class QueueRegistry(object):
+    """Tracks live queues by name, for metrics exporters.
+
+    Queues are held through weak references,
+      so a registered queue disappears from the registry once collected.
+    Any queue can be registered, though only the `Closeable*Queue` classes
+      have all the stats exported by `prometheus`.
+    """
+    def __init__(self):
+        import weakref
+        from itertools import count
+        from threading import Lock
+        self._lock = Lock()
+        self._queues = weakref.WeakValueDictionary()
+        self._count = count(1)
+
+    def register(self, q, name=None):
+        """Register `q` under `name`, and return the name.
+
+        If `name` is None, one is made up from the class name of `q`.
+        Raises `ValueError` if another live queue has the name.
+        """
+        self._lock.acquire()
+        try:
+            if name is None:
+                prefix = q.__class__.__name__
+                while True:
+                    name = '%s-%d' % (prefix, next(self._count))
+                    if name not in self._queues:
+                        break
+            elif self._queues.get(name, q) is not q:
+                raise ValueError("a queue named %r is already registered"
+                                 % (name,))
+            self._queues[name] = q
+            return name
+        finally:
+            self._lock.release()
+
+    def unregister(self, q):
+        """Remove `q` from the registry, if it is registered."""
+        self._lock.acquire()
+        try:
+            for name, other in self._queues.items():
+                if other is q:
+                    del self._queues[name]
+        finally:
+            self._lock.release()
+
+    def queues(self):
+        """Return a list of the ``(name, queue)`` pairs of the live queues,
+          sorted by name."""
+        self._lock.acquire()
+        try:
+            items = self._queues.items()
+        finally:
+            self._lock.release()
+        items.sort(key=lambda item: item[0])
+        return items
+
+    def snapshot(self):
+        """Return a list of the ``(name, stats)`` pairs of the live queues.
+
+        As with the `snapshot` function, no queue's mutex is taken;
+          the registry's own lock is only held to list the queues.
+        """
+        items = self.queues()
+        stats = snapshot([q for name, q in items])
+        return [(name, s) for (name, q), s in zip(items, stats)]
+
+    def prometheus(self):
+        """Return the stats of the live queues
+          in the Prometheus text exposition format."""
+        stats = self.snapshot()
+        lines = []
+        for key, metric, kind, help in _PROMETHEUS_METRICS:
+            samples = [(name, s[key]) for name, s in stats if key in s]
+            if not samples:
+                continue
+            lines.append('# HELP %s %s' % (metric, help))
+            lines.append('# TYPE %s %s' % (metric, kind))
+            for name, value in samples:
+                lines.append('%s{queue="%s"} %s'
+                             % (metric, _prometheus_label(name),
+                                _prometheus_value(value)))
+        lines.append('')
+        return '\n'.join(lines)
+
+# The stats exported by `QueueRegistry.prometheus`,
+#   as ``(key, metric, type, help)``.
+_PROMETHEUS_METRICS = (
+    ('qsize', 'closeable_queue_size', 'gauge',
+     'Number of items in the queue.'),
+    ('maxsize', 'closeable_queue_maxsize', 'gauge',
+     'Maximum number of items in the queue, or 0 if unbounded.'),
+    ('closed', 'closeable_queue_closed', 'gauge',
+     'Whether the queue has been closed.'),
+    ('unfinished_tasks', 'closeable_queue_unfinished_tasks', 'gauge',
+     'Number of items put and not yet marked done.'),
+    ('congested', 'closeable_queue_congested', 'gauge',
+     'Whether the queue is above its high watermark.'),
+    ('put_count', 'closeable_queue_puts_total', 'counter',
+     'Number of items put.'),
+    ('put_wait', 'closeable_queue_put_wait_seconds_total', 'counter',
+     'Total time spent by puts waiting for space.'),
+    ('expired', 'closeable_queue_expired_total', 'counter',
+     'Number of items skipped because their deadline passed.'),
+    ('dropped', 'closeable_queue_dropped_total', 'counter',
+     'Number of items dropped by the overflow policy.'),
+    ('discarded', 'closeable_queue_discarded_total', 'counter',
+     'Number of items discarded by close.'),
+)
+
+def _prometheus_label(value):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    else:
+        value = str(value)
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+def _prometheus_value(value):
+    if isinstance(value, bool):
+        return value and '1' or '0'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+# The registry of queues constructed with a `name`
+#   by classes made without a `registry` of their own.
+queue_registry = QueueRegistry()
+
+
+class MetricsServer(object):
+    """Serves the stats of the queues in `registry` over HTTP,
+      in the Prometheus text format, at the path ``/metrics``.
+
+    `registry` defaults to `queue_registry`.
+    The address actually bound, including any automatically assigned port,
+      is available as `address` once the server has been created.
+    """
+    def __init__(self, registry=None, address=('127.0.0.1', 0)):
+        import BaseHTTPServer
+        import SocketServer
+        if registry is None:
+            registry = queue_registry
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.prometheus()
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+        self.registry = registry
+        self._server = Server(address, Handler)
+        self.address = self._server.server_address
+        self._thread = None
+
+    def serve_forever(self, poll_interval=0.5):
+        self._server.serve_forever(poll_interval)
+
+    def start(self, poll_interval=0.5):
+        """Serve requests from a daemon thread.
+
+        `poll_interval` is the longest time `shutdown` will wait
+          for the thread to notice it.
+        """
+        from threading import Thread
+        self._thread = Thread(name='MetricsServer',
+                              target=self._server.serve_forever,
+                              args=(poll_interval,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def shutdown(self):
+        """Stop serving and close the listening socket."""
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+        self._server.server_close()
+
+
+class MetricsWriter(object):
+    """Writes the stats of the queues in `registry` to the file `path`
+      every `interval` seconds, in the Prometheus text format.
+
+    `registry` defaults to `queue_registry`.
+    Each write replaces the file by renaming a temporary file over it,
+      so that readers such as node_exporter's textfile collector
+      never see a partial file.
+    """
+    def __init__(self, path, interval=15.0, registry=None):
+        if registry is None:
+            registry = queue_registry
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._thread = None
+        self._stopping = None
+
+    def write(self):
+        """Write the stats once."""
+        import os
+        temp = '%s.%d.tmp' % (self.path, os.getpid())
+        f = open(temp, 'w')
+        try:
+            f.write(self.registry.prometheus())
+        finally:
+            f.close()
+        os.rename(temp, self.path)
+
+    def _run(self):
+        while True:
+            self.write()
+            if self._stopping.wait(self.interval):
+                return
+
+    def start(self):
+        """Write the stats from a daemon thread, starting at once."""
+        from threading import Event, Thread
+        self._stopping = Event()
+        self._thread = Thread(name='MetricsWriter', target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop writing, after a last write of the stats."""
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+        self.write()
+
+
+def dequeue(q, getargs={}, on_empty='stop'):
+    """Generates values from the queue `q`.
+
+    This is a fairly flexible function which can also be meaningfully applied
+      to non-closeable queues, by passing a `timeout` in `getargs`.
+
+    The default arguments are suitable for generating an iteration
+      from a queue which is closed after/as the last value is `put` to it.
+
+    To avoid false StopIterations, if a timeout is used with a closeable queue,
+      `on_empty` should be passed as `raise` or some sentinel value.
+
+    `getargs` is a dict which will comprise the keyword arguments to `q.get`.
+
+    `on_empty` determines the response to an `Empty` exception raised by `get`.
+      If 'raise', the `Empty` exception will be raised.
+      If 'stop', the `Empty` exception will be treated as a `Closed` exception.
+      Otherwise, the value passed in `on_empty` will be yielded.
+
+    Note that with the default value of `getargs`,
+      `Empty` exceptions will not occur.
+    """
+    try:
+        while True:
+            yield q.get(**getargs)
+    except Closed:
+        raise StopIteration
+    except Empty:
+        if on_empty == 'raise':
+            raise
+        elif on_empty == 'stop':
+            raise StopIteration
+        else:
+            yield on_empty
+
+def enqueue(it, q, putargs={}, join=False, close=True, join_timeout=None):
+    """`put`s the successive values of the iterable `it` into `q`.
+
+    The default values will close the queue after the final iterated value.
+
+    `putargs` is a dict which will comprise the keyword arguments to `q.put`.
+
+    If `close` is true,
+      `q` must support the `close` method, i.e. be a CloseableQueue.
+    This will have the effect of closing the queue after the end of iteration.
+
+    If `join` is true, the queue is joined after the values are put,
+      and after optionally being closed.
+    `join_timeout` is passed to `join` as its timeout,
+      and the return value of `join` is returned.
+
+    If `q` is closed before all of the values have been put,
+      e.g. by a consumer calling ``close(discard=True)``,
+      no more values are taken from `it`, which is closed if it can be,
+      and the function returns without closing or joining `q`.
+    """
+    it = iter(it)
+    try:
+        for value in it:
+            q.put(value, **putargs)
+    except Closed:
+        close_it = getattr(it, 'close', None)
+        if close_it is not None:
+            close_it()
+        return
+    if close:
+        q.close()
+    if join:
+        return q.join(join_timeout)
+
+def EnqueueThread(it, q=None, name='enqueue', start=True, enqueue=enqueue,
+                  pool=None, **kwargs):
+    """Starts a thread which enqueues the values of the iterable `it`.
+
+    If a queue is not passed, a new one is created.
+
+    A reference to the queue is stored as the property `q`
+      of the returned thread.
+
+    The thread will be started unless `start` is false.
+
+    This is ideal for processing generators
+      and other iterables which lazily process I/O-bound operations.
+
+    Passing the return value of a `dequeue` call will have the effect
+      of creating a processing thread which pulls from and pushes to
+      thread-safe data structures.
+
+    If an `EnqueuePool` is passed as `pool`, the `enqueue` is run
+      on one of its threads, and an `EnqueueHandle` is returned instead.
+
+    Additional keyword arguments are passed on to `enqueue`.
+    """
+    if pool is not None:
+        handle = EnqueueHandle(pool, it, q, enqueue, kwargs)
+        if start:
+            handle.start()
+        return handle
+    from threading import Thread
+    if q is None:
+        q = CloseableQueue()
+    thread = Thread(name=name,
+                    target=enqueue,
+                    args=(it, q),
+                    kwargs=kwargs)
+    thread.q = q
+    if start:
+        thread.start()
+    return thread
+
+class EnqueueHandle(object):
+    """Handle on an `enqueue` run by an `EnqueuePool`.
+
+    Stands in for the thread returned by `EnqueueThread`:
+      the queue is available as `q`,
+      and `start`, `join` and `is_alive` work as do a thread's.
+    `exception` returns the exception raised by `enqueue`, if any.
+    """
+    def __init__(self, pool, it, q, enqueue, kwargs):
+        import threading
+        self.q = CloseableQueue() if q is None else q
+        self._pool = pool
+        self._args = (enqueue, it, self.q, kwargs)
+        self._started = False
+        self._done = threading.Event()
+        self._exception = None
+
+    def start(self):
+        """Submit the `enqueue` to the pool."""
+        if self._started:
+            raise RuntimeError("handles can only be started once")
+        self._started = True
+        self._pool._submit(self)
+
+    def _run(self):
+        enqueue, it, q, kwargs = self._args
+        self._args = None
+        try:
+            enqueue(it, q, **kwargs)
+        except Exception, e:
+            self._exception = e
+        finally:
+            self._done.set()
+
+    def join(self, timeout=None):
+        """Wait until the `enqueue` has finished."""
+        self._done.wait(timeout)
+
+    def is_alive(self):
+        return self._started and not self._done.is_set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def exception(self, timeout=None):
+        """Wait until the `enqueue` has finished; return what it raised."""
+        self._done.wait(timeout)
+        return self._exception
+
+class EnqueuePool(object):
+    """Bounded set of long-lived threads which run `enqueue`s.
+
+    `submit` takes the arguments of `EnqueueThread`
+      and returns an `EnqueueHandle` in place of a thread;
+      `EnqueueThread` itself does the same when passed the pool as `pool`.
+    Threads are created as they are needed, up to `workers` of them,
+      and the `enqueue`s submitted while all of them are busy
+      wait their turn in a queue.
+    Since a thread is busy until its `enqueue` has put its final value,
+      a pool's queues should be drained independently of its `enqueue`s.
+
+    `shutdown` lets the threads exit once the submitted `enqueue`s are done.
+    """
+    def __init__(self, workers=4, name='enqueue'):
+        import threading
+        self.workers = workers
+        self.name = name
+        self._jobs = CloseableQueue()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._idle = 0
+
+    def submit(self, it, q=None, enqueue=enqueue, **kwargs):
+        """Run `enqueue(it, q, **kwargs)` on one of the pool's threads."""
+        return EnqueueThread(it, q, enqueue=enqueue, pool=self, **kwargs)
+
+    def _submit(self, handle):
+        from threading import Thread
+        self._lock.acquire()
+        try:
+            self._jobs.put(handle)
+            if self._idle:
+                self._idle -= 1
+            elif len(self._threads) < self.workers:
+                thread = Thread(name='%s-%d' % (self.name, len(self._threads)),
+                                target=self._work)
+                thread.daemon = True
+                self._threads.append(thread)
+                thread.start()
+        finally:
+            self._lock.release()
+
+    def _work(self):
+        for handle in dequeue(self._jobs):
+            handle._run()
+            self._lock.acquire()
+            self._idle += 1
+            self._lock.release()
+
+    def shutdown(self, wait=True):
+        """Stop accepting `enqueue`s, and optionally wait for the threads."""
+        self._jobs.close()
+        if wait:
+            for thread in list(self._threads):
+                thread.join()
+
+class _Raised(object):
+    """Carries an exception from a producer to the consumer of its queue."""
+    __slots__ = ('exc_info',)
+
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+def _prefetch_into(values, q, fetch):
+    """Put the values of the iterator `values` to `q`, then close it.
+
+    An exception raised by `values` or `fetch` is put in its place,
+      and the iterator is closed if the consumer closes `q` first.
+    """
+    import sys
+    try:
+        try:
+            for value in values:
+                if fetch is not None:
+                    value = fetch(value)
+                q.put(value)
+        except Closed:
+            pass
+        except Exception:
+            try:
+                q.put(_Raised(sys.exc_info()))
+            except Closed:
+                pass
+    finally:
+        q.close()
+        close = getattr(values, 'close', None)
+        if close is not None:
+            close()
+
+class _Prefetched(object):
+    """Iterator over the items of `queues` in turn, re-raising any exceptions.
+
+    Not a generator, so that dropping it before its first `next`
+      still closes the queues and so stops the producers.
+    """
+    def __init__(self, queues):
+        self._queues = queues
+        self._index = 0
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        queues = self._queues
+        try:
+            item = queues[self._index].get()
+        except Closed:
+            self.close()
+            raise StopIteration
+        if type(item) is _Raised:
+            self.close()
+            raise item.exc_info[0], item.exc_info[1], item.exc_info[2]
+        self._index = (self._index + 1) % len(queues)
+        return item
+
+    def close(self):
+        """Close the queues with ``close(discard=True)``."""
+        for q in self._queues:
+            q.close(discard=True)
+
+    def __del__(self):
+        self.close()
+
+def prefetch(iterable, depth, workers=1, fetch=None):
+    """Iterate over `iterable` with up to `depth` values fetched ahead.
+
+    The values are produced in the background into closeable queues,
+      and generated in their original order.
+    If `fetch` is given, `fetch(value)` is produced in place of each value.
+    An exception raised while producing a value is raised in its place.
+
+    With more than one worker, `iterable` must be a sequence,
+      which is split into `workers` interleaved shards,
+      each indexed and fetched by a thread of its own.
+    This suits sequences whose items are independent and slow to get,
+      or independent inputs to a slow `fetch`.
+
+    Closing the returned iterator, or dropping it, even unstarted,
+      closes the queues with ``close(discard=True)``,
+      so that the producers stop at the next value they produce.
+    """
+    from threading import Thread
+    if depth < 1 or workers < 1:
+        raise ValueError("'depth' and 'workers' must be at least 1")
+    if workers == 1:
+        sources = [iter(iterable)]
+    else:
+        count = len(iterable)
+        sources = [(iterable[i] for i in xrange(shard, count, workers))
+                   for shard in xrange(workers)]
+    queues = [CloseableQueue(-(-depth // workers)) for source in sources]
+    for source, q in zip(sources, queues):
+        thread = Thread(name='prefetch', target=_prefetch_into,
+                        args=(source, q, fetch))
+        thread.daemon = True
+        thread.start()
+    return _Prefetched(queues)
+
+
+class _PipeChannel(object):
+    """Minimal cross-process FIFO used for `SharedBlockChannel`'s control data.
+
+    Unlike `multiprocessing.Queue`, `put` writes synchronously,
+      so the order of puts made under a common lock is preserved
+      across processes.
+    Only suitable for small objects which are never allowed
+      to fill up the pipe's buffer.
+    """
+    def __init__(self):
+        import multiprocessing
+        self._reader, self._writer = multiprocessing.Pipe(duplex=False)
+        self._rlock = multiprocessing.Lock()
+        self._wlock = multiprocessing.Lock()
+
+    def put(self, obj):
+        self._wlock.acquire()
+        try:
+            self._writer.send(obj)
+        finally:
+            self._wlock.release()
+
+    def get(self, block=True, timeout=None):
+        """Remove and return an object; raises `Empty` as does `Queue.get`."""
+        if not block:
+            timeout = 0.0
+        elif timeout is not None:
+            if timeout < 0:
+                raise ValueError("'timeout' must be a positive number")
+            endtime = _time() + timeout
+        if not self._rlock.acquire(True, timeout):
+            raise Empty
+        try:
+            if timeout is not None and block:
+                timeout = max(0.0, endtime - _time())
+            if not self._reader.poll(timeout):
+                raise Empty
+            return self._reader.recv()
+        finally:
+            self._rlock.release()
+
+
+class SharedBlock(object):
+    """An array block received from a `SharedBlockChannel`.
+
+    The block's contents remain in its shared memory segment
+      until `release` is called, after which the segment is reused.
+    Blocks can also be used as context managers which release them on exit.
+    """
+    def __init__(self, channel, index, typecode, shape, nbytes):
+        self._channel = channel
+        self.index = index
+        self.typecode = typecode
+        self.shape = shape
+        self.nbytes = nbytes
+
+    @property
+    def data(self):
+        """A read-only buffer over the block's bytes in shared memory."""
+        return buffer(self._channel._segments[self.index], 0, self.nbytes)
+
+    def array(self):
+        """Return the block's contents as an array.
+
+        If NumPy is available, the result is an ndarray of the original shape
+          which is a view onto the shared memory segment,
+          and so is only valid until the block is released.
+        Otherwise it is a one-dimensional `array.array` copy.
+        """
+        try:
+            import numpy
+        except ImportError:
+            result = _array(self.typecode)
+            result.fromstring(self.data)
+            return result
+        segment = self._channel._segments[self.index]
+        itemsize = numpy.dtype(self.typecode).itemsize
+        view = numpy.frombuffer(segment, self.typecode,
+                                self.nbytes // itemsize)
+        return view.reshape(self.shape)
+
+    def release(self):
+        """Return the block's segment to the channel's pool."""
+        if self.index is not None:
+            self._channel._free.put(self.index)
+            self.index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class SharedBlockChannel(object):
+    """Closeable channel which moves array blocks between processes.
+
+    Blocks are copied into a fixed pool of `segments` shared memory segments,
+      each of `segment_size` bytes.
+    Only a small descriptor of each block is sent over the control pipe;
+      the segment is recycled when the consumer releases the `SharedBlock`
+      returned by `get`.
+
+    The channel must be created before the processes which use it
+      and passed to them when they are started.
+
+    `put`, `get` and `close` follow the contracts of `CloseableQueue`:
+      `Closed` is raised by `put` once the channel is closed,
+      and by `get` once it is closed and all blocks have been gotten.
+    As the pool of free segments bounds the channel,
+      `put` blocks, or raises `Full`, while no segment is free.
+
+    Blocks can be `array.array`s, NumPy arrays or other buffer objects.
+    NumPy is not required, but is used by `SharedBlock.array` if present.
+    """
+    def __init__(self, segments=4, segment_size=1 << 20):
+        import multiprocessing
+        from multiprocessing.sharedctypes import RawArray
+        self.segment_size = segment_size
+        self._segments = [RawArray('c', segment_size)
+                          for i in xrange(segments)]
+        self._closed = multiprocessing.RawValue('b', 0)
+        # `_ready` carries block descriptors, followed by `None` once closed.
+        # `_free` carries indices of free segments, followed by -1.
+        self._ready = _PipeChannel()
+        self._free = _PipeChannel()
+        for index in xrange(segments):
+            self._free.put(index)
+
+    def close(self):
+        """Close the channel.
+
+        Blocked `get`s and `put`s will raise `Closed` as they would
+          on a `CloseableQueue`.
+        """
+        self._ready._wlock.acquire()
+        try:
+            if self._closed.value:
+                return
+            self._closed.value = 1
+            self._ready._writer.send(None)
+        finally:
+            self._ready._wlock.release()
+        self._free.put(-1)
+
+    def closed(self):
+        """True iff the channel is closed.  Unreliable like `empty` and `full`."""
+        return bool(self._closed.value)
+
+    def put(self, data, block=True, timeout=None, last=False):
+        """Copy the array `data` into a free segment and send it.
+
+        `block` and `timeout` govern waiting for a free segment
+          as they do for `CloseableQueue.put`.
+
+        Raises `ValueError` if the block does not fit into a segment.
+        """
+        if self._closed.value:
+            raise Closed
+        if hasattr(data, 'dtype') and not data.flags['C_CONTIGUOUS']:
+            data = data.copy()
+        typecode, shape, address, nbytes = self._describe(data)
+        if nbytes > self.segment_size:
+            raise ValueError("block of %d bytes exceeds segment size %d"
+                             % (nbytes, self.segment_size))
+        try:
+            index = self._free.get(block, timeout)
+        except Empty:
+            raise Full
+        if index == -1:
+            # Pass the closing marker on to any other blocked `put`s.
+            self._free.put(-1)
+            raise Closed
+        import ctypes
+        ctypes.memmove(self._segments[index], address, nbytes)
+        sent = False
+        self._ready._wlock.acquire()
+        try:
+            if not self._closed.value:
+                self._ready._writer.send((index, typecode, shape, nbytes))
+                sent = True
+                if last:
+                    self._closed.value = 1
+                    self._ready._writer.send(None)
+        finally:
+            self._ready._wlock.release()
+        if not sent:
+            # The channel was closed while the block was being copied.
+            self._free.put(index)
+            raise Closed
+        if last:
+            self._free.put(-1)
+
+    def get(self, block=True, timeout=None):
+        """Receive the next block as a `SharedBlock`.
+
+        Works as does `CloseableQueue.get`.
+        """
+        descriptor = self._ready.get(block, timeout)
+        if descriptor is None:
+            # Pass the closing marker on to any other consumers.
+            self._ready.put(None)
+            raise Closed
+        return SharedBlock(self, *descriptor)
+
+    @staticmethod
+    def _describe(data):
+        """Return the typecode, shape, address and size of `data`.
+
+        The address is returned as a string holding a copy of the data
+          for blocks which are neither arrays nor NumPy arrays.
+        """
+        if hasattr(data, 'ctypes') and hasattr(data, 'dtype'):
+            return data.dtype.char, data.shape, data.ctypes.data, data.nbytes
+        if isinstance(data, _array):
+            address, length = data.buffer_info()
+            return (data.typecode, (length,),
+                    address, length * data.itemsize)
+        data = str(buffer(data))
+        return 'B', (len(data),), data, len(data)
+
+
+class BufferSerializer(object):
+    """Pickles objects with their large buffers kept out-of-band.
+
+    Strings, bytearrays, arrays and NumPy arrays of at least `threshold`
+      bytes are not copied into the pickle;
+      each is instead written once to a memory-mapped temporary file
+      in `directory`, which defaults to ``/dev/shm`` where available.
+    Smaller objects are pickled in-band as usual.
+
+    `dumps` returns a message consisting of the pickle and a list
+      of descriptors of the out-of-band buffers;
+      `loads` rebuilds the object from such a message
+      and removes the buffers' files.
+    A message which is never loaded must be passed to `discard`,
+      or its files are left behind.
+    NumPy arrays are rebuilt as read-only views onto their memory maps,
+      so that receiving them does not copy their data at all.
+    """
+    def __init__(self, threshold=1 << 16, directory=None):
+        import os
+        if directory is None and os.path.isdir('/dev/shm'):
+            directory = '/dev/shm'
+        self.threshold = threshold
+        self.directory = directory
+
+    def dumps(self, obj):
+        from cPickle import Pickler, HIGHEST_PROTOCOL
+        from cStringIO import StringIO
+        buffers = []
+        def persistent_id(obj):
+            descriptor = self._describe(obj)
+            if descriptor is None:
+                return None
+            buffers.append(self._spool(obj, *descriptor))
+            return len(buffers) - 1
+        output = StringIO()
+        pickler = Pickler(output, HIGHEST_PROTOCOL)
+        pickler.persistent_id = persistent_id
+        try:
+            pickler.dump(obj)
+        except:
+            # Remove the buffers already spooled before the failure.
+            self.discard(('', buffers))
+            raise
+        return output.getvalue(), buffers
+
+    def loads(self, message):
+        from cPickle import Unpickler
+        from cStringIO import StringIO
+        payload, buffers = message
+        unpickler = Unpickler(StringIO(payload))
+        unpickler.persistent_load = lambda pid: self._load(buffers[pid])
+        try:
+            return unpickler.load()
+        finally:
+            self.discard(message)
+
+    def discard(self, message):
+        """Remove the files of the out-of-band buffers of `message`."""
+        import os
+        for descriptor in message[1]:
+            try:
+                os.unlink(descriptor[0])
+            except OSError:
+                pass
+
+    def _describe(self, obj):
+        """Return the kind, format and size of `obj` if it goes out-of-band."""
+        if isinstance(obj, str):
+            kind, format, nbytes = 'str', None, len(obj)
+        elif isinstance(obj, bytearray):
+            kind, format, nbytes = 'bytearray', None, len(obj)
+        elif isinstance(obj, _array):
+            kind, format = 'array', obj.typecode
+            nbytes = len(obj) * obj.itemsize
+        elif hasattr(obj, 'dtype') and hasattr(obj, 'ctypes'):
+            kind, format, nbytes = 'ndarray', (obj.dtype.str, obj.shape), obj.nbytes
+        else:
+            return None
+        if nbytes < self.threshold or not nbytes:
+            return None
+        return kind, format, nbytes
+
+    def _spool(self, obj, kind, format, nbytes):
+        """Write the data of `obj` to a new memory-mapped file."""
+        import mmap, os, tempfile
+        if kind == 'ndarray' and not obj.flags['C_CONTIGUOUS']:
+            obj = obj.copy()
+        fd, path = tempfile.mkstemp(prefix='CloseableQueue-',
+                                    dir=self.directory)
+        try:
+            os.ftruncate(fd, nbytes)
+            mapped = mmap.mmap(fd, nbytes)
+            try:
+                mapped.write(buffer(obj))
+            finally:
+                mapped.close()
+        except:
+            os.close(fd)
+            os.unlink(path)
+            raise
+        os.close(fd)
+        return path, kind, format, nbytes
+
+    def _load(self, descriptor):
+        import mmap
+        path, kind, format, nbytes = descriptor
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), nbytes, access=mmap.ACCESS_READ)
+        if kind == 'ndarray':
+            import numpy
+            dtype, shape = format
+            return numpy.frombuffer(mapped, dtype).reshape(shape)
+        try:
+            if kind == 'str':
+                return mapped[:]
+            elif kind == 'bytearray':
+                return bytearray(mapped)
+            result = _array(format)
+            result.fromstring(buffer(mapped))
+            return result
+        finally:
+            mapped.close()
+
+
+class ProcessQueue(object):
+    """Closeable queue which can be shared between processes.
+
+    Items are pickled by a `BufferSerializer`, so that large buffers
+      are passed through memory-mapped files instead of through the pipe.
+
+    The queue must be created before the processes which use it
+      and passed to them when they are started.
+
+    `put`, `get`, `close` and `closed` work as do those of `CloseableQueue`.
+    Note that a `put` may block while the pipe's buffer is full
+      of small items which have not yet been gotten,
+      and that `close` waits for any such `put` to complete.
+
+    The files of large items remain until the items are gotten,
+      so a queue which is abandoned before it is emptied
+      should be closed with ``close(discard=True)`` to remove them.
+    """
+    def __init__(self, maxsize=0, threshold=1 << 16, directory=None):
+        import multiprocessing
+        self.maxsize = maxsize
+        self.serializer = BufferSerializer(threshold, directory)
+        self._closed = multiprocessing.RawValue('b', 0)
+        # `_channel` carries messages, followed by `None` once closed.
+        self._channel = _PipeChannel()
+        if maxsize > 0:
+            self._slots = multiprocessing.Semaphore(maxsize)
+        else:
+            self._slots = None
+
+    def _send_close(self):
+        """Mark the queue closed.  `_channel._wlock` must be held."""
+        self._closed.value = 1
+        self._channel._writer.send(None)
+        if self._slots is not None:
+            # Wake any blocked `put`s, which will then raise `Closed`.
+            for i in xrange(self.maxsize):
+                self._slots.release()
+
+    def close(self, discard=False):
+        """Close the queue, as does `CloseableQueue.close`.
+
+        If `discard` is true, the items in the queue are discarded
+          and the files of their buffers removed.
+        """
+        self._channel._wlock.acquire()
+        try:
+            if not self._closed.value:
+                self._send_close()
+        finally:
+            self._channel._wlock.release()
+        if discard:
+            self._discard()
+
+    def _discard(self):
+        """Read and discard the messages up to the closing marker."""
+        channel = self._channel
+        channel._rlock.acquire()
+        try:
+            while channel._reader.poll(0):
+                message = channel._reader.recv()
+                if message is None:
+                    # Leave the closing marker for any other consumers.
+                    channel.put(None)
+                    return
+                if self._slots is not None:
+                    self._slots.release()
+                self.serializer.discard(message)
+        finally:
+            channel._rlock.release()
+
+    def closed(self):
+        """True iff the queue is closed.  Unreliable like `empty` and `full`."""
+        return bool(self._closed.value)
+
+    def put(self, item, block=True, timeout=None, last=False):
+        """Put an item into the queue, as does `CloseableQueue.put`."""
+        if self._closed.value:
+            raise Closed
+        if self._slots is not None:
+            if timeout is not None and timeout < 0:
+                raise ValueError("'timeout' must be a positive number")
+            if not self._slots.acquire(block, timeout):
+                raise Full
+        message = self.serializer.dumps(item)
+        self._channel._wlock.acquire()
+        try:
+            if self._closed.value:
+                self.serializer.discard(message)
+                if self._slots is not None:
+                    self._slots.release()
+                raise Closed
+            self._channel._writer.send(message)
+            if last:
+                self._send_close()
+        finally:
+            self._channel._wlock.release()
+
+    def get(self, block=True, timeout=None):
+        """Remove and return an item, as does `CloseableQueue.get`."""
+        message = self._channel.get(block, timeout)
+        if message is None:
+            # Pass the closing marker on to any other consumers.
+            self._channel.put(None)
+            raise Closed
+        if self._slots is not None:
+            self._slots.release()
+        return self.serializer.loads(message)
+
+
+def EnqueueProcess(it, q=None, name='enqueue', start=True, enqueue=enqueue,
+                   **kwargs):
+    """Starts a process which enqueues the values of the iterable `it`.
+
+    This is the multiprocessing analogue of `EnqueueThread`.
+    If a queue is not passed, a new `ProcessQueue` is created.
+
+    A reference to the queue is stored as the property `q`
+      of the returned `multiprocessing.Process`.
+    """
+    from multiprocessing import Process
+    if q is None:
+        q = ProcessQueue()
+    process = Process(name=name,
+                      target=enqueue,
+                      args=(it, q),
+                      kwargs=kwargs)
+    process.q = q
+    if start:
+        process.start()
+    return process
+
+
+def _write_frame(f, obj):
+    """Pickle `obj` to the file `f` as a length-prefixed frame."""
+    from cPickle import dumps, HIGHEST_PROTOCOL
+    _write_bytes(f, dumps(obj, HIGHEST_PROTOCOL))
+
+def _read_frame(f):
+    """Read and unpickle a frame from the file `f`.
+
+    Raises `EOFError` if the file ends before a complete frame is read.
+    Unpickling can run arbitrary code, so `f` must come from a trusted peer.
+    """
+    from cPickle import loads
+    return loads(_read_bytes(f))
+
+def _write_bytes(f, data):
+    """Write the string `data` to the file `f` as a length-prefixed frame."""
+    from struct import pack
+    f.write(pack('!I', len(data)) + data)
+
+def _read_bytes(f, limit=None):
+    """Read a length-prefixed string from the file `f`.
+
+    Raises `EOFError` if the file ends before a complete frame is read,
+      and `AuthenticationError` if the frame is longer than `limit`.
+    """
+    from struct import unpack
+    header = f.read(4)
+    if len(header) < 4:
+        raise EOFError
+    length, = unpack('!I', header)
+    if limit is not None and length > limit:
+        raise AuthenticationError("frame of %d bytes is too long" % length)
+    data = f.read(length)
+    if len(data) < length:
+        raise EOFError
+    return data
+
+
+class AuthenticationError(Exception):
+    """Exception raised when a `QueueServer` and a `RemoteQueue`
+      fail to prove to each other that they share an `authkey`."""
+    pass
+
+_CHALLENGE = '#CHALLENGE#'
+_WELCOME = '#WELCOME#'
+_FAILURE = '#FAILURE#'
+
+def _deliver_challenge(rfile, wfile, authkey):
+    """Check that the peer on the other end of `rfile` and `wfile`
+      knows `authkey`, as does `multiprocessing.connection`.
+
+    The peer must answer a random challenge with its HMAC under `authkey`.
+    Nothing it sends is unpickled, so an unauthenticated peer
+      can't run code by sending a malicious pickle.
+    """
+    import hashlib, hmac, os
+    message = os.urandom(32)
+    _write_bytes(wfile, _CHALLENGE + message)
+    wfile.flush()
+    digest = hmac.new(authkey, message, hashlib.sha256).digest()
+    response = _read_bytes(rfile, 256)
+    if not hmac.compare_digest(response, digest):
+        _write_bytes(wfile, _FAILURE)
+        wfile.flush()
+        raise AuthenticationError("digest received was wrong")
+    _write_bytes(wfile, _WELCOME)
+    wfile.flush()
+
+def _answer_challenge(rfile, wfile, authkey):
+    """Answer the challenge sent by `_deliver_challenge`."""
+    import hashlib, hmac
+    message = _read_bytes(rfile, 256)
+    if not message.startswith(_CHALLENGE):
+        raise AuthenticationError("message received was not a challenge")
+    message = message[len(_CHALLENGE):]
+    _write_bytes(wfile, hmac.new(authkey, message, hashlib.sha256).digest())
+    wfile.flush()
+    if _read_bytes(rfile, 256) != _WELCOME:
+        raise AuthenticationError("digest sent was rejected")
+
+
+class QueueServer(object):
+    """Serves the queue `q` to `RemoteQueue` clients over a socket.
+
+    If `address` is a string, it is used as the path of a Unix domain socket;
+      otherwise it should be a ``(host, port)`` pair.
+    The address actually bound, including any automatically assigned port,
+      is available as `address` once the server has been created.
+
+    Each connection is handled by its own thread,
+      which performs the client's requests on `q` in order.
+    `q` must support `put_many` and `get_many`,
+      i.e. be one of the `Closeable*Queue` classes.
+
+    Requests and items are pickled, and unpickling can run arbitrary code,
+      so a client must be trusted as much as code running in the server.
+    Before any pickle is exchanged, the server and each client prove
+      to each other that they know the string `authkey`,
+      by HMAC challenge and response as in `multiprocessing.connection`;
+      connections which fail to do so are dropped.
+    `authkey` is required for TCP; without one, a Unix domain socket
+      is only as safe as the permissions of its file and directory.
+    The key is not used to encrypt the traffic.
+    """
+    def __init__(self, q, address=('127.0.0.1', 0), authkey=None):
+        import SocketServer
+        if isinstance(address, basestring):
+            base = SocketServer.UnixStreamServer
+        else:
+            base = SocketServer.TCPServer
+            if authkey is None:
+                raise ValueError("an authkey is required to serve over TCP")
+        class Server(SocketServer.ThreadingMixIn, base):
+            daemon_threads = True
+            allow_reuse_address = True
+        self.q = q
+        self._authkey = authkey
+        handler = self._make_handler(base is SocketServer.TCPServer)
+        self._server = Server(address, handler)
+        self.address = self._server.server_address
+        self._thread = None
+
+    def _make_handler(self, tcp):
+        import SocketServer
+        q = self.q
+        authkey = self._authkey
+        class Handler(SocketServer.StreamRequestHandler):
+            disable_nagle_algorithm = tcp
+
+            def handle(self):
+                if authkey is not None:
+                    try:
+                        _deliver_challenge(self.rfile, self.wfile, authkey)
+                        _answer_challenge(self.rfile, self.wfile, authkey)
+                    except (AuthenticationError, EOFError):
+                        return
+                while True:
+                    try:
+                        request = _read_frame(self.rfile)
+                    except EOFError:
+                        return
+                    try:
+                        response = ('ok', QueueServer._perform(q, request))
+                    except Exception, e:
+                        response = ('error', e)
+                    _write_frame(self.wfile, response)
+                    self.wfile.flush()
+        return Handler
+
+    @staticmethod
+    def _perform(q, request):
+        op, args = request[0], request[1:]
+        if op == 'put':
+            items, block, timeout, last = args
+            q.put_many(items, block, timeout, last)
+            return len(items)
+        elif op == 'get':
+            max_items, block, timeout = args
+            return q.get_many(max_items, block, timeout)
+        elif op == 'close':
+            return q.close()
+        elif op == 'closed':
+            return q.closed()
+        elif op == 'qsize':
+            return q.qsize()
+        raise ValueError("unknown request %r" % (op,))
+
+    def serve_forever(self, poll_interval=0.5):
+        self._server.serve_forever(poll_interval)
+
+    def start(self, poll_interval=0.5):
+        """Serve requests from a daemon thread.
+
+        `poll_interval` is the longest time `shutdown` will wait
+          for the thread to notice it.
+        """
+        from threading import Thread
+        self._thread = Thread(name='QueueServer',
+                              target=self._server.serve_forever,
+                              args=(poll_interval,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def shutdown(self):
+        """Stop serving and close the listening socket."""
+        import os
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+        self._server.server_close()
+        if isinstance(self.address, basestring):
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+
+
+class RemoteQueue(object):
+    """Client proxy for a queue served by a `QueueServer`.
+
+    `put`, `get`, `close` and `closed` work as do those
+      of `CloseableQueue`, including `put(last=True)`
+      and the raising of `Closed`.
+
+    To avoid a network round-trip per item:
+
+    - Blocking `put`s are collected into batches of up to `batch` items,
+      each of which is sent in one frame.
+      Pending items are sent when a batch is full,
+      or when `flush` or any other method is called.
+    - Batches are pipelined: up to `window` of them can be awaiting
+      acknowledgement at once, each acknowledgement returning a credit.
+      Once the credits are used up, `put` waits for the server,
+      which applies backpressure by blocking on the served queue.
+      A `Closed` or other error from a pipelined batch
+      is raised by a subsequent `put` or `flush`.
+    - `get` fetches up to `prefetch` items per round-trip
+      and returns them from a local buffer.
+      Prefetched items are no longer available to other consumers.
+
+    `put_many` and `get_many` each transfer all of their items
+      in a single round-trip.
+
+    A `RemoteQueue` can be shared between threads;
+      its requests are serialized by a lock.
+
+    `authkey` must be that of the server.
+    The client also checks that the server knows it
+      before unpickling any reply, and raises `AuthenticationError`
+      if either side fails the check.
+    """
+    def __init__(self, address, batch=1, window=16, prefetch=1,
+                 authkey=None):
+        import socket, threading
+        if isinstance(address, basestring):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(address)
+        else:
+            sock = socket.create_connection(address)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock = sock
+        self._rfile = sock.makefile('rb')
+        self._wfile = sock.makefile('wb')
+        if authkey is not None:
+            try:
+                _answer_challenge(self._rfile, self._wfile, authkey)
+                _deliver_challenge(self._rfile, self._wfile, authkey)
+            except EOFError:
+                sock.close()
+                raise AuthenticationError("connection closed by the server")
+            except AuthenticationError:
+                sock.close()
+                raise
+        self.batch = batch
+        self.window = window
+        self.prefetch = prefetch
+        self._lock = threading.Lock()
+        self._pending = []
+        self._outstanding = 0
+        self._error = None
+        self._buffer = _deque()
+
+    def _send(self, *request):
+        _write_frame(self._wfile, request)
+        self._wfile.flush()
+
+    def _receive(self):
+        status, value = _read_frame(self._rfile)
+        if status == 'error':
+            raise value
+        return value
+
+    def _acknowledge(self, outstanding=0):
+        """Collect acknowledgements until at most `outstanding` remain."""
+        while self._outstanding > outstanding:
+            self._outstanding -= 1
+            try:
+                self._receive()
+            except Exception, e:
+                if self._error is None:
+                    self._error = e
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _send_pending(self):
+        if self._pending:
+            self._acknowledge(self.window - 1)
+            self._send('put', self._pending, True, None, False)
+            self._outstanding += 1
+            self._pending = []
+
+    def _sync(self):
+        """Send any pending items and wait until all have been acknowledged."""
+        self._send_pending()
+        self._acknowledge()
+
+    def _request(self, *request):
+        self._sync()
+        self._send(*request)
+        return self._receive()
+
+    def flush(self):
+        """Send any pending items and wait for their acknowledgement."""
+        with self._lock:
+            self._sync()
+            self._raise_error()
+
+    def put(self, item, block=True, timeout=None, last=False):
+        with self._lock:
+            self._raise_error()
+            if block and timeout is None and not last:
+                self._pending.append(item)
+                if len(self._pending) >= self.batch:
+                    self._send_pending()
+                self._raise_error()
+            else:
+                self._sync()
+                self._raise_error()
+                self._send('put', [item], block, timeout, last)
+                self._receive()
+
+    def put_many(self, items, block=True, timeout=None, last=False):
+        with self._lock:
+            self._sync()
+            self._raise_error()
+            self._send('put', list(items), block, timeout, last)
+            self._receive()
+
+    def get(self, block=True, timeout=None):
+        with self._lock:
+            if not self._buffer:
+                self._buffer.extend(self._request('get', self.prefetch,
+                                                  block, timeout))
+            return self._buffer.popleft()
+
+    def get_many(self, max_items=None, block=True, timeout=None):
+        with self._lock:
+            if self._buffer:
+                if max_items is None:
+                    max_items = len(self._buffer)
+                count = min(max_items, len(self._buffer))
+                return [self._buffer.popleft() for i in xrange(count)]
+            return self._request('get', max_items, block, timeout)
+
+    def close(self):
+        with self._lock:
+            self._request('close')
+
+    def closed(self):
+        with self._lock:
+            return self._request('closed')
+
+    def qsize(self):
+        """The approximate size of the served queue, excluding prefetched items."""
+        with self._lock:
+            return self._request('qsize')
+
+    def disconnect(self):
+        """Send any pending items and close the connection."""
+        with self._lock:
+            try:
+                self._sync()
+                self._raise_error()
+            finally:
+                self._rfile.close()
+                self._wfile.close()
+                self._sock.close()
+
+
+def queue_to_pipe(q, f, max_items=None, close=True):
+    """Write the items of the queue `q` to the file `f` until `q` is closed.
+
+    Whatever items are available are written together as one frame,
+      so that a busy queue is written with few system calls
+      while an idle one still passes on each item without delay.
+    `max_items` limits the number of items per frame.
+
+    If `close` is true, `f` is closed once `q` is closed and drained.
+    If writing fails, e.g. because the reading process has exited,
+      `q` is closed so that its producers will receive `Closed`,
+      and the error is raised.
+    """
+    try:
+        try:
+            while True:
+                _write_frame(f, q.get_many(max_items))
+                f.flush()
+        except Closed:
+            pass
+    except:
+        q.close()
+        raise
+    finally:
+        if close:
+            f.close()
+
+def pipe_to_queue(f, q, putargs={}, close=True):
+    """Put the items read from the file `f` into `q` until end-of-file.
+
+    `f` should carry frames written by `queue_to_pipe` or `enqueue_pipe`.
+
+    `putargs` is a dict which will comprise the keyword arguments
+      to `q.put_many`.
+
+    If `close` is true, `q` is closed once the end of `f` is reached.
+    """
+    try:
+        while True:
+            try:
+                items = _read_frame(f)
+            except EOFError:
+                break
+            q.put_many(items, **putargs)
+    finally:
+        f.close()
+        if close:
+            q.close()
+
+def dequeue_pipe(f=None):
+    """Generates the items of the frames read from `f` until end-of-file.
+
+    Intended for use in a child process of a `PipeStage`,
+      where `f` defaults to standard input.
+    """
+    import sys
+    if f is None:
+        f = sys.stdin
+    while True:
+        try:
+            items = _read_frame(f)
+        except EOFError:
+            return
+        for item in items:
+            yield item
+
+def enqueue_pipe(it, f=None, batch=64):
+    """Write the values of the iterable `it` to `f` in frames of `batch` items.
+
+    Intended for use in a child process of a `PipeStage`,
+      where `f` defaults to standard output.
+    Any partial batch is written at the end of the iteration,
+      after which `f` is flushed but not closed.
+    """
+    import sys
+    from itertools import islice
+    if f is None:
+        f = sys.stdout
+    it = iter(it)
+    while True:
+        items = list(islice(it, batch))
+        if not items:
+            break
+        _write_frame(f, items)
+        if len(items) < batch:
+            break
+    f.flush()
+
+
+class PipeStage(object):
+    """Runs a child process as a pipeline stage.
+
+    Items from the `input` queue are written to the child's standard input,
+      and items read from its standard output are put to the `output` queue.
+    If either queue is not passed, a new `CloseableQueue` is created.
+
+    Closing `input` closes the child's standard input,
+      and `output` is closed when the child closes its standard output.
+    A child written in Python can use `dequeue_pipe` and `enqueue_pipe`
+      to read and write the framed items.
+
+    One thread is used for each direction of the transfer.
+    `args` and any additional keyword arguments are passed
+      to `subprocess.Popen`.
+    """
+    def __init__(self, args, input=None, output=None, max_items=None,
+                 **kwargs):
+        from subprocess import Popen, PIPE
+        from threading import Thread
+        self.input = CloseableQueue() if input is None else input
+        self.output = CloseableQueue() if output is None else output
+        self.process = Popen(args, stdin=PIPE, stdout=PIPE, **kwargs)
+        self.errors = []
+        self._threads = [
+            Thread(name='queue_to_pipe', target=self._run,
+                   args=(queue_to_pipe, self.input, self.process.stdin,
+                         max_items)),
+            Thread(name='pipe_to_queue', target=self._run,
+                   args=(pipe_to_queue, self.process.stdout, self.output))]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def _run(self, function, *args):
+        try:
+            function(*args)
+        except Exception, e:
+            self.errors.append(e)
+
+    def join(self):
+        """Wait for the transfers and the child process to finish.
+
+        Returns the child's exit status.
+        Any exceptions raised by the transfers are available in `errors`.
+        """
+        for thread in self._threads:
+            thread.join()
+        return self.process.wait()
+
+
+class PipelineStage(object):
+    """A stage of a `Pipeline`, run by a number of worker threads.
+
+    Each worker gets items from `input`, applies `function` to them
+      according to `kind`, and puts the results to `output`.
+    `output` is closed once the last worker has finished,
+      so that closing a pipeline's first queue closes each stage in turn.
+
+    `stats` reports the time the workers have spent in `function` (busy),
+      waiting to get items (starved) and waiting to put them (blocked).
+    Any exceptions raised by `function` are collected in `errors`;
+      a worker which raises one closes `input` and stops.
+    """
+    def __init__(self, name, kind, function, workers, input, output):
+        import threading
+        self.name = name
+        self.kind = kind
+        self.function = function
+        self.input = input
+        self.output = output
+        self.errors = []
+        self.workers = 0
+        self._threads = []
+        # The busy, starved and blocked times and the item count
+        #   of each worker, which only that worker updates.
+        self._times = []
+        self._running = 0
+        self._lock = threading.Lock()
+        self._initial_workers = workers
+
+    def __repr__(self):
+        return '<PipelineStage %r>' % (self.name,)
+
+    def start(self):
+        self.add_workers(self._initial_workers)
+
+    def add_workers(self, count):
+        """Start `count` more workers, unless the stage has finished."""
+        from threading import Thread
+        self._lock.acquire()
+        try:
+            if self._threads and not self._running:
+                return
+            for i in xrange(count):
+                times = [0.0, 0.0, 0.0, 0]
+                thread = Thread(name='%s-%d' % (self.name, self.workers),
+                                target=self._work, args=(times,))
+                thread.daemon = True
+                self._times.append(times)
+                self._threads.append(thread)
+                self._running += 1
+                self.workers += 1
+                thread.start()
+        finally:
+            self._lock.release()
+
+    def _work(self, times):
+        try:
+            try:
+                if self.kind == 'source':
+                    self._produce(times)
+                else:
+                    self._consume(times)
+            except Closed:
+                # A downstream stage has stopped taking items.
+                if self.input is not None:
+                    self.input.close()
+            except Exception, e:
+                self.errors.append(e)
+                if self.input is not None:
+                    self.input.close()
+        finally:
+            self._lock.acquire()
+            try:
+                self._running -= 1
+                last = not self._running
+            finally:
+                self._lock.release()
+            if last and self.output is not None:
+                self.output.close()
+
+    def _produce(self, times):
+        """Put the values of the iterator `function` to `output`."""
+        next, put, clock = self.function.next, self.output.put, _time
+        while True:
+            start = clock()
+            try:
+                item = next()
+            except StopIteration:
+                return
+            made = clock()
+            put(item)
+            times[0] += made - start
+            times[2] += clock() - made
+            times[3] += 1
+
+    def _consume(self, times):
+        get, function, clock = self.input.get, self.function, _time
+        put = self.output.put if self.output is not None else None
+        kind = self.kind
+        while True:
+            start = clock()
+            try:
+                item = get()
+            except Closed:
+                return
+            got = clock()
+            blocked = 0.0
+            if kind == 'map':
+                results = (function(item),)
+            elif kind == 'filter':
+                results = (item,) if function(item) else ()
+            elif kind == 'flat_map':
+                results = function(item)
+            else:
+                function(item)
+                results = ()
+            for result in results:
+                before = clock()
+                put(result)
+                blocked += clock() - before
+            times[0] += clock() - got - blocked
+            times[1] += got - start
+            times[2] += blocked
+            times[3] += 1
+
+    def join(self, timeout=None):
+        for thread in list(self._threads):
+            thread.join(timeout)
+
+    def stats(self):
+        """Return a dict of the stage's totals over all of its workers.
+
+        `busy`, `starved` and `blocked` are in seconds,
+          and `items` counts the items the stage has processed.
+        """
+        totals = [0.0, 0.0, 0.0, 0]
+        for times in list(self._times):
+            for i, value in enumerate(times):
+                totals[i] += value
+        busy, starved, blocked, items = totals
+        return dict(name=self.name, workers=self.workers, items=items,
+                    busy=busy, starved=starved, blocked=blocked)
+
+class Pipeline(object):
+    """Chain of stages connected by closeable queues.
+
+    `source` is either an iterable, whose values are put to the first queue
+      by a thread of its own, or a closeable queue to be used as the first.
+    `maxsize` is that of the first queue, if one is created.
+
+    Stages are added with `map`, `filter`, `flat_map` and `sink`,
+      each of which takes the number of worker threads to run it,
+      and the `maxsize` of the queue to which it puts its results.
+    These methods return the pipeline, so that calls can be chained.
+    Unless a `sink` is added, the results can be gotten from `output`
+      or by iterating over the pipeline.
+
+    The stages' threads are started by `start`.
+    Each stage closes its output queue once it has finished,
+      so that closing the first queue, e.g. with `close`,
+      lets the stages drain and finish in turn.
+    `stats` reports the time spent by each stage's workers
+      working, waiting for items and waiting to put their results;
+      `bottleneck` picks out the stage whose workers are busiest.
+    """
+    def __init__(self, source, maxsize=0):
+        self.stages = []
+        if hasattr(source, 'get'):
+            self.input = source
+        else:
+            self.input = CloseableQueue(maxsize)
+            self.stages.append(PipelineStage('source', 'source', iter(source),
+                                             1, None, self.input))
+        self.output = self.input
+        self._started = False
+        self._sunk = False
+
+    def _add(self, kind, function, workers, maxsize, name):
+        if self._started:
+            raise RuntimeError("stages can't be added once started")
+        if self._sunk:
+            raise ValueError("no stage can follow a sink")
+        if name is None:
+            name = '%s-%d' % (kind, len(self.stages))
+        output = None if kind == 'sink' else CloseableQueue(maxsize)
+        self.stages.append(PipelineStage(name, kind, function, workers,
+                                         self.output, output))
+        self.output = output
+        self._sunk = kind == 'sink'
+        return self
+
+    def map(self, function, workers=1, maxsize=0, name=None):
+        """Add a stage which puts `function(item)` for each item."""
+        return self._add('map', function, workers, maxsize, name)
+
+    def filter(self, function, workers=1, maxsize=0, name=None):
+        """Add a stage which passes on the items for which `function` is true."""
+        return self._add('filter', function, workers, maxsize, name)
+
+    def flat_map(self, function, workers=1, maxsize=0, name=None):
+        """Add a stage which puts each value of the iterable `function(item)`."""
+        return self._add('flat_map', function, workers, maxsize, name)
+
+    def sink(self, function, workers=1, name=None):
+        """Add a final stage which calls `function(item)` for each item."""
+        return self._add('sink', function, workers, 0, name)
+
+    def start(self):
+        """Start the threads of all of the stages."""
+        if self._started:
+            raise RuntimeError("pipelines can only be started once")
+        self._started = True
+        for stage in self.stages:
+            stage.start()
+        return self
+
+    def close(self):
+        """Close the first queue, so that the stages finish in turn."""
+        self.input.close()
+
+    def join(self):
+        """Wait for all of the stages to finish.
+
+        The first exception raised in any stage is then raised.
+        """
+        for stage in self.stages:
+            stage.join()
+        for stage in self.stages:
+            if stage.errors:
+                raise stage.errors[0]
+
+    def __iter__(self):
+        if self.output is None:
+            raise TypeError("the pipeline ends in a sink")
+        return dequeue(self.output)
+
+    def stats(self):
+        """Return a list of the `stats` of each stage, in order."""
+        return [stage.stats() for stage in self.stages]
+
+    def bottleneck(self):
+        """Return the stage whose workers have spent most of their time busy.
+
+        It is the stage which would most benefit from `add_workers`.
+        """
+        def busy_share(stage):
+            stats = stage.stats()
+            total = stats['busy'] + stats['starved'] + stats['blocked']
+            return stats['busy'] / total if total else 0.0
+        return max(self.stages, key=busy_share)
+
+class ConsumerPool(object):
+    """Pool of threads which consume the items of `q` with `function`,
+      growing and shrinking the number of threads with the load.
+
+    Every `interval` seconds the pool observes the backlog of `q`,
+      the share of that time its workers spent idle waiting for items,
+      and the time producers spent waiting for space in `q`
+      (as counted by the `put_wait` of the `Closeable*Queue` classes).
+    An interval in which the workers were nearly always busy
+      while items were backed up or producers blocked votes to grow the pool,
+      and one in which they were mostly idle with nothing backed up
+      votes to shrink it.
+    Only `patience` consecutive votes the same way change the pool's size,
+      which is then doubled or reduced by one,
+      within `min_workers` and `max_workers`.
+
+    Workers call `task_done` for each item, and exit once `q` is closed
+      and empty; `drained` is then set, and `on_drained` called if given.
+    Any exceptions raised by `function` are collected in `errors`.
+    """
+    def __init__(self, q, function, min_workers=1, max_workers=8,
+                 interval=0.5, patience=2, on_drained=None, start=True):
+        import threading
+        if not 1 <= min_workers <= max_workers:
+            raise ValueError("need 1 <= min_workers <= max_workers")
+        self.q = q
+        self.function = function
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.interval = interval
+        self.patience = patience
+        self.on_drained = on_drained
+        self.errors = []
+        self.workers = 0
+        self.drained = threading.Event()
+        self._lock = threading.Lock()
+        # The idle time of each worker, including those since retired,
+        #   which only that worker updates.
+        self._idle = []
+        self._retiring = 0
+        self._votes = 0
+        self._scaler = None
+        if start:
+            self.start()
+
+    def start(self):
+        """Start the minimum number of workers, and the scaling thread."""
+        from threading import Thread
+        self._add_workers(self.min_workers)
+        self._scaler = Thread(name='scale', target=self._scale)
+        self._scaler.daemon = True
+        self._scaler.start()
+
+    def join(self, timeout=None):
+        """Wait until the pool has drained.  Returns True iff it has."""
+        self.drained.wait(timeout)
+        return self.drained.is_set()
+
+    def _add_workers(self, count):
+        from threading import Thread
+        self._lock.acquire()
+        try:
+            for i in xrange(count):
+                idle = [0.0]
+                self._idle.append(idle)
+                thread = Thread(name='consume', target=self._work,
+                                args=(idle,))
+                thread.daemon = True
+                self.workers += 1
+                thread.start()
+        finally:
+            self._lock.release()
+
+    def _retire(self):
+        """True iff the calling worker should exit to shrink the pool."""
+        if not self._retiring:
+            return False
+        self._lock.acquire()
+        try:
+            if self._retiring:
+                self._retiring -= 1
+                return True
+            return False
+        finally:
+            self._lock.release()
+
+    def _work(self, idle):
+        q, function, clock = self.q, self.function, _time
+        try:
+            while not self._retire():
+                start = clock()
+                try:
+                    item = q.get(timeout=self.interval)
+                except Empty:
+                    continue
+                except Closed:
+                    return
+                finally:
+                    idle[0] += clock() - start
+                try:
+                    function(item)
+                except Exception, e:
+                    self.errors.append(e)
+                finally:
+                    q.task_done()
+        finally:
+            self._lock.acquire()
+            try:
+                self.workers -= 1
+                # The last worker sets `drained` even if it exits
+                #   to shrink the pool, rather than on finding `q` closed.
+                drained = (not self.workers and not self.drained.is_set()
+                           and q.closed() and not q.qsize())
+                if drained:
+                    self.drained.set()
+            finally:
+                self._lock.release()
+            if drained and self.on_drained is not None:
+                self.on_drained()
+
+    def _scale(self):
+        last_idle = sum(idle[0] for idle in list(self._idle))
+        last_wait = getattr(self.q, 'put_wait', 0.0)
+        while not self.drained.wait(self.interval):
+            idle = sum(idle[0] for idle in list(self._idle))
+            wait = getattr(self.q, 'put_wait', 0.0)
+            workers = max(self.workers, 1)
+            self.rescale(self.q.qsize(),
+                         (idle - last_idle) / (workers * self.interval),
+                         wait - last_wait)
+            last_idle, last_wait = idle, wait
+
+    def rescale(self, backlog, idle, blocked):
+        """Vote on the pool's size, given the observations of an interval.
+
+        `backlog` is the size of `q`, `idle` the share of the interval
+          the workers spent waiting for items,
+          and `blocked` the time producers spent waiting for space.
+        Returns the change in the number of workers.
+        """
+        if idle < 0.1 and (backlog or blocked):
+            vote = 1
+        elif idle > 0.5 and not backlog and not blocked:
+            vote = -1
+        else:
+            vote = 0
+        if not vote or (self._votes > 0) != (vote > 0):
+            self._votes = vote
+        else:
+            self._votes += vote
+        if abs(self._votes) < self.patience:
+            return 0
+        self._votes = 0
+        self._lock.acquire()
+        try:
+            workers = self.workers - self._retiring
+            if vote > 0:
+                change = min(workers, self.max_workers - workers)
+            else:
+                change = -min(1, workers - self.min_workers)
+            if change < 0:
+                self._retiring -= change
+        finally:
+            self._lock.release()
+        if change > 0:
+            self._add_workers(change)
+        return change
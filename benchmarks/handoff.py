@@ -0,0 +1,51 @@
+"""Benchmark of handoff latency through `CloseableSynchronousQueue`.
+
+A ping-pong between two threads, each of which puts an item to one queue
+  and then gets the reply from another, is timed for `COUNT` round trips,
+  once with a pair of `CloseableSynchronousQueue`s
+  and once with a pair of `CloseableQueue(1)`s.
+The mean one-way handoff latency is half the mean round trip.
+
+Run as ``python benchmarks/handoff.py`` from the distribution directory.
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from CloseableQueue import CloseableQueue, CloseableSynchronousQueue, Closed
+
+COUNT = 20000
+
+def echo(requests, replies):
+    try:
+        while True:
+            replies.put(requests.get())
+    except Closed:
+        pass
+
+def ping_pong(make_queue):
+    requests, replies = make_queue(), make_queue()
+    thread = threading.Thread(target=echo, args=(requests, replies))
+    thread.start()
+    start = time.time()
+    for i in xrange(COUNT):
+        requests.put(i)
+        replies.get()
+    elapsed = time.time() - start
+    requests.close()
+    thread.join()
+    return elapsed
+
+def main():
+    print '%26s %14s' % ('queue', 'handoff (us)')
+    for name, make_queue in (('CloseableSynchronousQueue',
+                              CloseableSynchronousQueue),
+                             ('CloseableQueue(1)',
+                              lambda: CloseableQueue(1))):
+        elapsed = min(ping_pong(make_queue) for i in xrange(3))
+        print '%26s %14.1f' % (name, elapsed / COUNT / 2 * 1e6)
+
+if __name__ == '__main__':
+    main()
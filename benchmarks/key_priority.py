@@ -0,0 +1,58 @@
+"""Benchmark of `CloseableKeyPriorityQueue` against the tuple-wrapping idiom.
+
+Puts and then gets `COUNT` items, once by wrapping each item
+  in a ``(priority, sequence, item)`` tuple for a `CloseablePriorityQueue`,
+  and once by passing its priority to a `CloseableKeyPriorityQueue`.
+Timings are given both for random float priorities, which are nearly all
+  distinct, and for a small number of integer priority levels.
+
+Run as ``python benchmarks/key_priority.py`` from the distribution directory.
+"""
+import os
+import random
+import sys
+import time
+from itertools import count
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from CloseableQueue import CloseablePriorityQueue, CloseableKeyPriorityQueue
+
+COUNT = 200000
+
+class Job(object):
+    pass
+
+def tuple_wrapping(priorities, jobs):
+    q = CloseablePriorityQueue()
+    sequence = count()
+    start = time.time()
+    for priority, job in zip(priorities, jobs):
+        q.put((priority, next(sequence), job))
+    for i in xrange(len(jobs)):
+        q.get()[2]
+    return time.time() - start
+
+def key_priority(priorities, jobs):
+    q = CloseableKeyPriorityQueue()
+    start = time.time()
+    for priority, job in zip(priorities, jobs):
+        q.put(job, priority=priority)
+    for i in xrange(len(jobs)):
+        q.get()
+    return time.time() - start
+
+def main():
+    rand = random.Random(0)
+    jobs = [Job() for i in xrange(COUNT)]
+    cases = (('distinct floats', [rand.random() for i in xrange(COUNT)]),
+             ('10 int levels', [rand.randrange(10) for i in xrange(COUNT)]))
+    print '%16s %12s %12s %8s' % ('priorities', 'tuples (s)', 'keyed (s)',
+                                  'speedup')
+    for name, priorities in cases:
+        wrapped = tuple_wrapping(priorities, jobs)
+        keyed = key_priority(priorities, jobs)
+        print '%16s %12.3f %12.3f %7.2fx' % (name, wrapped, keyed,
+                                             wrapped / keyed)
+
+if __name__ == '__main__':
+    main()
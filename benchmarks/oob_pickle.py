@@ -0,0 +1,61 @@
+"""Benchmark of `ProcessQueue`'s out-of-band buffers against in-band pickling.
+
+Sends payloads of 1 MB to 100 MB from a producer process to the parent,
+  once through a `multiprocessing.Queue`, which pickles them in-band,
+  and once through a `ProcessQueue`, which passes them through
+  memory-mapped files.
+
+In-band, each payload is copied into the pickle, written to the pipe,
+  read from the pipe and copied out of the pickle.
+Out-of-band, it is copied once into the memory map and once out of it
+  (or not at all in the case of NumPy arrays).
+
+Run as ``python benchmarks/oob_pickle.py`` from the distribution directory.
+"""
+import multiprocessing
+import os
+import sys
+import time
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from CloseableQueue import ProcessQueue
+
+SIZES = (1 << 20, 10 << 20, 100 << 20)
+TOTAL = 400 << 20
+
+def produce(q, payload, count):
+    for i in xrange(count):
+        q.put(payload)
+
+def measure(q, payload, count):
+    producer = multiprocessing.Process(target=produce,
+                                       args=(q, payload, count))
+    start = time.time()
+    producer.start()
+    for i in xrange(count):
+        q.get()
+    elapsed = time.time() - start
+    producer.join()
+    return elapsed
+
+def payloads(size):
+    yield 'str', 'x' * size
+    yield 'array', array('d', [0.0]) * (size // 8)
+
+def main():
+    print '%6s %10s %6s %14s %17s %8s' % ('type', 'size', 'count',
+                                          'in-band MB/s', 'out-of-band MB/s',
+                                          'speedup')
+    for size in SIZES:
+        for kind, payload in payloads(size):
+            count = max(2, TOTAL // size)
+            megabytes = float(size * count) / (1 << 20)
+            inband = measure(multiprocessing.Queue(2), payload, count)
+            outofband = measure(ProcessQueue(2), payload, count)
+            print '%6s %7d MB %6d %14.1f %17.1f %7.2fx' % (
+                kind, size >> 20, count, megabytes / inband,
+                megabytes / outofband, inband / outofband)
+
+if __name__ == '__main__':
+    main()
@@ -14,10 +14,25 @@ taken from Python 2.6.5's ``test`` regression tests module.
 """
 from CloseableQueue import CloseableQueue, Closed
 from CloseableQueue import CloseableLifoQueue, CloseablePriorityQueue
+from CloseableQueue import CloseableArrayQueue, CloseableIndexedPriorityQueue
+from CloseableQueue import CloseableKeyPriorityQueue, CloseableDelayQueue
+from CloseableQueue import CloseableCoalescingQueue, CloseableFairQueue
+from CloseableQueue import CloseableSynchronousQueue, dequeue
+from Queue import Empty, Full
 from test_queue import BlockingTestMixin, BaseQueueTest
 from test_queue import FailingQueue, FailingQueueTest
 import unittest
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from concurrent import futures
+except ImportError:
+    futures = None
+
 # Because the method queue_test.BaseQueueTest.simple_queue_test
 #   uses the queue class name,
 #   it has to be the name of one of the Queue classes.
@@ -228,6 +243,59 @@ class CloseableQueueTest(unittest.TestCase, BlockingTestMixin):
         else:
             self.fail('Closed exception not raised.')
 
+    def test_approx_readers(self):
+        q = self.type2test()
+        q.put(1)
+        q.put(2)
+        self.assertEqual(2, q.approx_qsize())
+        self.assertFalse(q.approx_closed())
+        q.close()
+        self.assert_(q.approx_closed())
+        stats = q.approx_stats()
+        self.assertEqual((2, True, 2), (stats['qsize'], stats['closed'],
+                                        stats['unfinished_tasks']))
+
+    def test_task_done_batches(self):
+        q = self.type2test()
+        q.put_many((1, 2, 3))
+        q.get_many()
+        self.assertFalse(q.join(0.01))
+        q.task_done(2)
+        self.assertFalse(q.join(0.01))
+        self.assertRaises(ValueError, q.task_done, 2)
+        q.task_done(1)
+        self.assert_(q.join(0.01))
+
+    def test_join_closed(self):
+        q = self.type2test()
+        self.assert_(q.join(0.01))
+        self.assertFalse(q.join_closed(0.01))
+        self.do_blocking_test(q.join_closed, (), q.close, ())
+        self.assert_(self.result)
+        q = self.type2test()
+        q.put(1, last=True)
+        self.assertFalse(q.join_closed(0.01))
+        q.get()
+        self.do_blocking_test(q.join_closed, (10,), q.task_done, ())
+        self.assert_(self.result)
+
+    def test_close_discard(self):
+        """Discarding the contents raises `Closed` in `get` at once."""
+        q = self.type2test(2)
+        q.put(1)
+        q.put(2)
+        try:
+            self.do_exceptional_blocking_test(q.put, (3, True, 10),
+                                              q.close, (True,), Closed)
+        except Closed:
+            pass
+        else:
+            self.fail('Closed exception not raised.')
+        self.assertRaises(Closed, q.get, False)
+        self.assertEqual(0, q.qsize())
+        self.assertEqual(2, q.discarded)
+        q.join()
+
     def worker(self, q):
         """Worker based on `test_queue.BaseQueueTest.worker`.
 
@@ -282,6 +350,1488 @@ class CloseablePriorityQueueTest(CloseableQueueTest):
     tuple_sort = lambda self, it: tuple(sorted(it))
 
 
+class CloseableQueueDeadlineTest(unittest.TestCase, BlockingTestMixin):
+    """Tests item deadlines and the `ttl` option."""
+    type2test = CloseableQueue
+    tuple_sort = tuple
+
+    def test_expired_items_skipped(self):
+        import time
+        q = self.type2test()
+        q.put(1, deadline=time.time() - 1)
+        q.put(2)
+        q.put(3, deadline=time.time() + 60)
+        self.assertEqual(self.tuple_sort((2, 3)), get_tuple(q, {}, 2))
+        self.assertEqual(1, q.expired)
+
+    def test_ttl(self):
+        import time
+        q = self.type2test(ttl=0.05)
+        q.put(1)
+        time.sleep(0.1)
+        q.put(2)
+        self.assertEqual(2, q.get(block=False))
+        self.assertRaises(Empty, q.get, block=False)
+        self.assertEqual(1, q.expired)
+
+    def test_get_many_skips_expired(self):
+        import time
+        q = self.type2test()
+        q.put(1, deadline=time.time() - 1)
+        q.put(2, deadline=time.time() - 1)
+        self.assertRaises(Empty, q.get_many, None, True, 0.05)
+        q.put(3)
+        self.assertEqual([3], list(q.get_many()))
+
+    def test_get_many_zero(self):
+        q = self.type2test(ttl=60)
+        q.put(1)
+        self.assertEqual(0, len(q.get_many(0)))
+        self.assertEqual([1], list(q.get_many()))
+
+    def test_expired_items_are_done(self):
+        import time
+        q = self.type2test()
+        q.put(1, deadline=time.time() - 1, last=True)
+        self.assertRaises(Closed, q.get)
+        q.join()
+
+    def test_sweep(self):
+        import time
+        q = self.type2test()
+        for i in xrange(10):
+            q.put(i, deadline=time.time() - 1)
+        q.put(10)
+        # Amortized sweeps have removed some expired items already.
+        self.assert_(q.qsize() < 11)
+        q.sweep()
+        self.assertEqual(1, q.qsize())
+        self.assertEqual(10, q.expired)
+        self.assertEqual(10, q.get())
+
+    def test_sweep_keeps_order(self):
+        import time
+        q = self.type2test()
+        for i in (7, 1, 4, 9, 5, 2):
+            q.put(i, deadline=time.time() + (-1 if i in (4, 2) else 60))
+        self.assertEqual(2, q.sweep())
+        self.assertEqual(self.tuple_sort((7, 1, 9, 5)), get_tuple(q, {}, 4))
+
+class CloseableLifoQueueDeadlineTest(CloseableQueueDeadlineTest):
+    type2test = CloseableLifoQueue
+    tuple_sort = lambda self, it: tuple(reversed(it))
+
+class CloseablePriorityQueueDeadlineTest(CloseableQueueDeadlineTest):
+    type2test = CloseablePriorityQueue
+    tuple_sort = lambda self, it: tuple(sorted(it))
+
+class DeadlineSupportTest(unittest.TestCase):
+    """Tests which classes accept deadlines."""
+    def test_key_priorities(self):
+        """The `key` of a priority queue is applied to the unwrapped item."""
+        import time
+        for cls in (CloseableKeyPriorityQueue, CloseableIndexedPriorityQueue):
+            q = cls(key=lambda item: -item, ttl=60)
+            q.put(1, deadline=time.time() - 1)
+            q.put_many((2, 3))
+            self.assertEqual([3, 2], list(q.get_many()))
+            self.assertEqual(1, q.expired)
+
+    def test_sweep(self):
+        """Classes with storage of their own sweep expired items too."""
+        import time
+        past, future = time.time() - 1, time.time() + 60
+        for cls, items in ((CloseableKeyPriorityQueue, [3, 1, 2, 1]),
+                           (CloseableIndexedPriorityQueue, [3, 1, 2, 1]),
+                           (CloseableFairQueue, [('a', 1), ('b', 1),
+                                                 ('a', 2), ('b', 2)]),
+                           (CloseableDelayQueue, [3, 1, 2, 1])):
+            q = cls()
+            for item in items:
+                q.put(item, deadline=future)
+            for i in xrange(100):
+                q.put(items[i % 4], deadline=past)
+            if cls is CloseableDelayQueue:
+                q.put(0, delay=60, deadline=past)
+            q.sweep()
+            self.assertEqual(len(items), q.qsize(), cls)
+            self.assertEqual(q.expired, 101 if cls is CloseableDelayQueue
+                                        else 100)
+            expected = list(items)
+            if cls in (CloseableKeyPriorityQueue,
+                       CloseableIndexedPriorityQueue):
+                expected.sort()
+            self.assertEqual(expected, list(q.get_many()), cls)
+            q.task_done(len(items))
+            q.join()
+
+    def test_unsupported(self):
+        import time
+        self.assertRaises(TypeError, CloseableArrayQueue, 'i', ttl=1)
+        self.assertRaises(TypeError, CloseableCoalescingQueue, ttl=1)
+        q = CloseableCoalescingQueue()
+        self.assertRaises(TypeError, q.put, ('key', 1),
+                          deadline=time.time() + 1)
+        self.assertEqual(0, q.qsize())
+        q = CloseableArrayQueue('i')
+        self.assertRaises(TypeError, q.put, 1, deadline=time.time() + 1)
+        self.assertEqual(0, q.qsize())
+
+
+class OverflowPolicyTest(unittest.TestCase):
+    """Tests the `overflow` policies of the closeable queues."""
+    def fill(self, q, items):
+        self.drops = []
+        q.on_drop = self.drops.append
+        for item in items:
+            q.put(item, block=False)
+
+    def test_drop_oldest(self):
+        q = CloseableQueue(2, overflow='drop_oldest')
+        self.fill(q, (1, 2, 3, 4))
+        self.assertEqual([3, 4], q.get_many())
+        self.assertEqual([1, 2], self.drops)
+        self.assertEqual(2, q.dropped)
+
+    def test_drop_newest(self):
+        q = CloseableQueue(2, overflow='drop_newest')
+        self.fill(q, (1, 2, 3, 4))
+        self.assertEqual([1, 2], q.get_many())
+        self.assertEqual([3, 4], self.drops)
+
+    def test_drop_lowest(self):
+        q = CloseablePriorityQueue(3, overflow='drop_lowest')
+        self.fill(q, (5, 1, 4, 2, 9, 3))
+        self.assertEqual([1, 2, 3], q.get_many())
+        self.assertEqual([5, 9, 4], self.drops)
+
+    def test_drop_lowest_indexed(self):
+        q = CloseableIndexedPriorityQueue(2, overflow='drop_lowest')
+        self.fill(q, (5, 1, 4, 9))
+        self.assertEqual([1, 4], q.get_many())
+        self.assertEqual([5, 9], self.drops)
+
+    def test_drop_lowest_key(self):
+        q = CloseableKeyPriorityQueue(2, overflow='drop_lowest')
+        self.fill(q, (5, 1, 4, 9))
+        self.assertEqual([1, 4], q.get_many())
+        self.assertEqual([5, 9], self.drops)
+
+    def test_drop_oldest_array(self):
+        q = CloseableArrayQueue('i', 2, overflow='drop_oldest')
+        self.fill(q, (1, 2, 3))
+        self.assertEqual([2, 3], q.get_many().tolist())
+
+    def test_dropped_items_are_done(self):
+        q = CloseableQueue(1, overflow='drop_oldest')
+        q.put_many((1, 2), last=True)
+        self.assertEqual(2, q.get())
+        q.task_done()
+        q.join()
+        self.assertRaises(Closed, q.put, 3)
+
+    def test_drop_oldest_lifo(self):
+        q = CloseableLifoQueue(3, overflow='drop_oldest')
+        self.fill(q, (1, 2, 3, 4))
+        self.assertEqual([4, 3, 2], q.get_many())
+        self.assertEqual([1], self.drops)
+
+    def test_failed_put_drops_nothing(self):
+        """An item isn't dropped to make room for a put which fails."""
+        for q in (CloseableQueue(1, overflow='drop_oldest'),
+                  CloseableArrayQueue('i', 1, overflow='drop_oldest'),
+                  CloseableKeyPriorityQueue(1, overflow='drop_lowest')):
+            q.put(1)
+            self.assertRaises(TypeError, q.put, 0, colour='red')
+            self.assertEqual(0, q.dropped)
+            self.assertEqual([1], list(q.get_many()))
+        q = CloseableArrayQueue('i', 1, overflow='drop_oldest')
+        q.put(1)
+        self.assertRaises(TypeError, q.put, 'x')
+        self.assertEqual([1], q.get_many().tolist())
+
+    def test_unsupported_policy(self):
+        self.assertRaises(TypeError, CloseablePriorityQueue, 1,
+                          overflow='drop_oldest')
+        self.assertRaises(TypeError, CloseableLifoQueue, 1,
+                          overflow='drop_lowest')
+        self.assertRaises(TypeError, CloseableQueue, 1,
+                          overflow='drop_lowest')
+        self.assertRaises(ValueError, CloseableQueue, 1, overflow='drop')
+
+
+@unittest.skipIf(futures is None, "concurrent.futures is not installed")
+class AsyncTest(unittest.TestCase):
+    """Tests the `get_async` and `put_async` methods."""
+    type2test = CloseableQueue
+
+    def test_get_async_waits_for_put(self):
+        q = self.type2test()
+        gets = [q.get_async() for i in xrange(3)]
+        self.assertFalse(any(f.done() for f in gets))
+        q.put_many([1, 2, 3])
+        self.assertEqual([1, 2, 3], [f.result(0) for f in gets])
+        self.assertEqual(0, q.qsize())
+
+    def test_get_async_of_available_item(self):
+        q = self.type2test()
+        q.put(1)
+        self.assertEqual(1, q.get_async().result(0))
+
+    def test_cancelled_get_is_unlinked(self):
+        q = self.type2test()
+        gets = [q.get_async() for i in xrange(3)]
+        self.assertTrue(gets[1].cancel())
+        q.put(1)
+        q.put(2)
+        self.assertEqual([1, 2], [gets[0].result(0), gets[2].result(0)])
+
+    def test_put_async_waits_for_space(self):
+        q = self.type2test(1)
+        q.put(1)
+        puts = [q.put_async(2), q.put_async(3, last=True)]
+        self.assertFalse(any(f.done() for f in puts))
+        self.assertEqual(1, q.get())
+        self.assertTrue(puts[0].done())
+        self.assertFalse(puts[1].done())
+        self.assertEqual([2, 3], list(dequeue(q)))
+        self.assertTrue(puts[1].done())
+
+    def test_cancelled_put_is_not_put(self):
+        q = self.type2test(1)
+        q.put(1)
+        self.assertTrue(q.put_async(2).cancel())
+        q.get()
+        self.assertRaises(Empty, q.get, False)
+
+    def test_close_fails_waiters(self):
+        q = self.type2test(1)
+        get = q.get_async()
+        q.put(1)
+        self.assertEqual(1, get.result(0))
+        q.put(2)
+        put = q.put_async(3)
+        q.close()
+        self.assertRaises(Closed, put.result, 0)
+        self.assertEqual(2, q.get_async().result(0))
+        self.assertRaises(Closed, q.get_async().result, 0)
+        self.assertRaises(Closed, q.put_async(4).result, 0)
+
+    def test_blocked_thread_get(self):
+        import threading
+        q = self.type2test()
+        get = q.get_async()
+        gotten = []
+        thread = threading.Thread(target=lambda: gotten.append(q.get()))
+        thread.start()
+        q.put_many([1, 2])
+        thread.join(10)
+        self.assertEqual((1, [2]), (get.result(0), gotten))
+
+    def test_callbacks_run_outside_mutex(self):
+        q = self.type2test()
+        results = self.type2test()
+        q.get_async().add_done_callback(
+            lambda f: results.put(q.qsize() + f.result()))
+        q.put(1)
+        self.assertEqual(1, results.get(False))
+
+    def test_many_waiters(self):
+        q = self.type2test()
+        gets = [q.get_async() for i in xrange(10000)]
+        for f in gets[::2]:
+            f.cancel()
+        q.put_many(xrange(5000))
+        self.assertEqual(range(5000), [f.result(0) for f in gets[1::2]])
+
+
+class PriorityAsyncTest(AsyncTest):
+    type2test = CloseablePriorityQueue
+
+
+class WatermarkTest(unittest.TestCase):
+    """Tests the watermark callbacks of the closeable queues."""
+    def make_queue(self, **kwargs):
+        self.events = []
+        def high(q):
+            self.events.append(('high', q.qsize()))
+        def low(q):
+            self.events.append(('low', q.qsize()))
+        return CloseableQueue(on_high_watermark=high, on_low_watermark=low,
+                              **kwargs)
+
+    def test_hysteresis(self):
+        q = self.make_queue(high_watermark=3, low_watermark=1)
+        q.put_many((1, 2))
+        self.assertEqual([], self.events)
+        q.put(3)
+        self.assertEqual([('high', 3)], self.events)
+        self.assert_(q.congested)
+        q.put(4)
+        q.get()
+        q.get()
+        q.put(5)
+        self.assertEqual(1, len(self.events))
+        q.get_many(2)
+        self.assertEqual([('high', 3), ('low', 1)], self.events)
+        self.assertFalse(q.congested)
+
+    def test_default_low_watermark(self):
+        q = self.make_queue(high_watermark=4)
+        q.put_many(range(4))
+        q.get()
+        self.assert_(q.congested)
+        q.get()
+        self.assertFalse(q.congested)
+
+    def test_close(self):
+        q = self.make_queue(high_watermark=2)
+        q.put_many((1, 2))
+        q.close()
+        self.assertEqual([('high', 2), ('low', 2)], self.events)
+        self.assertFalse(q.congested)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, CloseableQueue,
+                          high_watermark=2, low_watermark=2)
+
+
+class SnapshotTest(unittest.TestCase):
+    """Tests the `snapshot` function."""
+    def test_snapshot(self):
+        from CloseableQueue import CloseableBroadcastQueue, snapshot
+        q = CloseableQueue(5, overflow='drop_newest')
+        q.put_many(range(7))
+        broadcast = CloseableBroadcastQueue(3)
+        broadcast.subscribe()
+        broadcast.put(1, last=True)
+        stats = snapshot([q, broadcast, CloseableSynchronousQueue()])
+        self.assertEqual([5, 1, 0], [s['qsize'] for s in stats])
+        self.assertEqual([5, 3, 0], [s['maxsize'] for s in stats])
+        self.assertEqual([False, True, False], [s['closed'] for s in stats])
+        self.assertEqual(2, stats[0]['dropped'])
+
+
+class RegistryTest(unittest.TestCase):
+    """Tests `QueueRegistry` and its exporters."""
+    def setUp(self):
+        from CloseableQueue import CloseableQueueFactory, QueueRegistry
+        self.registry = QueueRegistry()
+        self.type2test = CloseableQueueFactory(registry=self.registry)
+
+    def test_register(self):
+        q = self.type2test(name='jobs')
+        other = self.type2test()
+        self.assertEqual('jobs', q.name)
+        self.assertEqual('CloseableQueue-1', other.name)
+        self.assertEqual([('CloseableQueue-1', other), ('jobs', q)],
+                         self.registry.queues())
+        self.assertRaises(ValueError, self.type2test, name='jobs')
+        self.registry.unregister(q)
+        self.assertEqual([('CloseableQueue-1', other)],
+                         self.registry.queues())
+
+    def test_default_registry(self):
+        """Queues given a `name` are registered in `queue_registry`."""
+        from CloseableQueue import queue_registry
+        q = CloseableQueue(name='test_default_registry')
+        unnamed = CloseableQueue()
+        try:
+            self.assertTrue(('test_default_registry', q)
+                            in queue_registry.queues())
+            self.assertEqual(None, unnamed.name)
+        finally:
+            queue_registry.unregister(q)
+
+    def test_weak_references(self):
+        import gc
+        q = self.type2test(name='temporary')
+        del q
+        gc.collect()
+        self.assertEqual([], self.registry.queues())
+
+    def test_put_count(self):
+        q = self.type2test()
+        q.put(1)
+        q.put_many(range(3))
+        q.transfer_to(self.type2test())
+        self.assertEqual(4, q.approx_stats()['put_count'])
+
+    def test_prometheus(self):
+        q = self.type2test(2, name='a "quoted"\nname', overflow='drop_newest')
+        q.put_many(range(3))
+        q.get()
+        text = self.registry.prometheus()
+        label = '{queue="a \\"quoted\\"\\nname"}'
+        self.assertTrue('# TYPE closeable_queue_size gauge\n' in text)
+        self.assertTrue('\ncloseable_queue_size%s 1\n' % label in text)
+        self.assertTrue('\ncloseable_queue_maxsize%s 2\n' % label in text)
+        self.assertTrue('\ncloseable_queue_closed%s 0\n' % label in text)
+        self.assertTrue('# TYPE closeable_queue_puts_total counter\n' in text)
+        self.assertTrue('\ncloseable_queue_puts_total%s 2\n' % label in text)
+        self.assertTrue('\ncloseable_queue_dropped_total%s 1\n' % label
+                        in text)
+        self.assertTrue('\ncloseable_queue_put_wait_seconds_total%s 0.0\n'
+                        % label in text)
+
+    def test_other_queues(self):
+        """Queues without `approx_stats` export their size and state."""
+        q = CloseableSynchronousQueue()
+        self.registry.register(q, 'handoff')
+        text = self.registry.prometheus()
+        self.assertTrue('closeable_queue_size{queue="handoff"} 0\n' in text)
+        self.assertFalse('puts_total' in text)
+
+    def test_server(self):
+        import urllib2
+        from CloseableQueue import MetricsServer
+        q = self.type2test(name='served')
+        q.put(1)
+        server = MetricsServer(self.registry)
+        server.start(0.05)
+        try:
+            url = 'http://%s:%d' % server.address
+            response = urllib2.urlopen(url + '/metrics')
+            self.assertTrue(response.info()['Content-Type']
+                            .startswith('text/plain; version=0.0.4'))
+            self.assertEqual(self.registry.prometheus(), response.read())
+            try:
+                urllib2.urlopen(url + '/other')
+            except urllib2.HTTPError, e:
+                self.assertEqual(404, e.code)
+            else:
+                self.fail("expected a 404 response")
+        finally:
+            server.shutdown()
+
+    def test_writer(self):
+        import os, shutil, tempfile
+        from CloseableQueue import MetricsWriter
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'queues.prom')
+            q = self.type2test(name='written')
+            writer = MetricsWriter(path, 60, self.registry)
+            writer.start()
+            q.put(1)
+            writer.stop()
+            self.assertEqual(['queues.prom'], os.listdir(directory))
+            text = open(path).read()
+            self.assertEqual(self.registry.prometheus(), text)
+            self.assertTrue('closeable_queue_size{queue="written"} 1\n'
+                            in text)
+        finally:
+            shutil.rmtree(directory)
+
+
+class CloseableQueueBulkTest(unittest.TestCase, BlockingTestMixin):
+    """Tests the `put_many` and `get_many` methods."""
+    type2test = CloseableQueue
+    tuple_sort = tuple
+
+    def test_put_many_get_many(self):
+        q = self.type2test()
+        q.put_many((2, 1, 3))
+        self.assertEqual(3, q.qsize())
+        self.assertEqual(self.tuple_sort((2, 1, 3)), tuple(q.get_many()))
+
+    def test_put_many_iterator(self):
+        q = self.type2test()
+        q.put_many(iter((2, 1, 3)))
+        self.assertEqual(self.tuple_sort((2, 1, 3)), tuple(q.get_many()))
+
+    def test_get_many_max_items(self):
+        q = self.type2test()
+        q.put_many(range(10))
+        self.assertEqual(4, len(q.get_many(4)))
+        self.assertEqual(6, len(q.get_many()))
+
+    def test_put_many_last(self):
+        q = self.type2test()
+        q.put_many((1, 2), last=True)
+        self.assertEqual(self.tuple_sort((1, 2)), tuple(q.get_many()))
+        self.assertRaises(Closed, q.get_many, None, False)
+        self.assertRaises(Closed, q.put_many, (3,))
+
+    def test_put_many_chunks_bounded_queue(self):
+        """A bounded queue takes the items in chunks as space frees up."""
+        q = self.type2test(2)
+        items = tuple(range(5))
+        self.do_blocking_test(q.put_many, (items,),
+                              get_tuple, (q, {'timeout': 2}, 5))
+        self.assertEqual(0, q.qsize())
+
+    def test_put_many_nonblocking_full(self):
+        q = self.type2test(2)
+        self.assertRaises(Full, q.put_many, (1, 2, 3), False)
+        self.assertEqual(2, q.qsize())
+
+    def test_get_many_blocks_until_put(self):
+        q = self.type2test()
+        result = self.do_blocking_test(q.get_many, (), q.put, (1,))
+        self.assertEqual((1,), tuple(result))
+
+    def test_get_many_raises_closed_on_close(self):
+        q = self.type2test()
+        try:
+            self.do_exceptional_blocking_test(q.get_many, (None, True, 2),
+                                              q.close, (), Closed)
+        except Closed:
+            pass
+        else:
+            self.fail('Closed exception not raised.')
+
+    def test_drain(self):
+        q = self.type2test()
+        self.assertEqual(0, len(q.drain()))
+        q.put_many((2, 1, 3))
+        self.assertEqual(2, len(q.drain(2)))
+        q.close()
+        self.assertEqual(1, len(q.drain()))
+        self.assertEqual(0, len(q.drain()))
+
+    def test_transfer_to(self):
+        q = self.type2test()
+        other = self.type2test(3)
+        q.put_many((2, 1, 3, 5, 4))
+        self.assertEqual(2, q.transfer_to(other, 2))
+        self.assertEqual(1, q.transfer_to(other))
+        self.assertEqual(0, q.transfer_to(other))
+        self.assertEqual((2, 3), (q.qsize(), other.qsize()))
+        self.assertEqual(self.tuple_sort((2, 1, 3, 5, 4))[3:],
+                         tuple(q.get_many()))
+        self.assertEqual(sorted(self.tuple_sort((2, 1, 3, 5, 4))[:3]),
+                         sorted(other.drain()))
+
+    def test_transfer_in_both_directions(self):
+        import threading
+        a = self.type2test()
+        b = self.type2test()
+        a.put_many(range(100))
+        def shuffle(source, target):
+            for i in xrange(500):
+                source.transfer_to(target, 7)
+        threads = [threading.Thread(target=shuffle, args=(a, b)),
+                   threading.Thread(target=shuffle, args=(b, a))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(range(100), sorted(tuple(a.drain()) + tuple(b.drain())))
+
+    def test_transfer_to_accounting_and_close(self):
+        q = self.type2test()
+        other = self.type2test()
+        q.put_many((1, 2), last=True)
+        self.assertEqual(2, q.transfer_to(other, close=True))
+        q.join()
+        self.assert_(other.closed())
+        self.assertRaises(Closed, q.transfer_to, other)
+        self.assertEqual([1, 2], sorted(other.get_many()))
+        other.task_done()
+        other.task_done()
+        other.join()
+
+    def test_transfer_to_unsupported_target(self):
+        """Unsupported targets are refused before any items are moved."""
+        from CloseableQueue import CloseableBroadcastQueue
+        q = self.type2test()
+        q.put_many((1, 2))
+        for other in (CloseableBroadcastQueue(), CloseableSynchronousQueue(),
+                      CloseableFairQueue(tenant_maxsize=2),
+                      CloseableQueue(2, overflow='drop_oldest')):
+            self.assertRaises(TypeError, q.transfer_to, other)
+            self.assertEqual(2, q.qsize())
+            self.assertEqual(2, q.unfinished_tasks)
+
+    def test_transfer_to_rejected(self):
+        """Items the target can't store are put back in the queue."""
+        q, twin = self.type2test(), self.type2test()
+        q.put_many((300, 400))
+        twin.put_many((300, 400))
+        other = CloseableArrayQueue('B')
+        self.assertRaises(OverflowError, q.transfer_to, other)
+        self.assertEqual(0, other.qsize())
+        self.assertEqual(0, other.unfinished_tasks)
+        self.assertEqual(2, q.unfinished_tasks)
+        self.assertEqual(list(twin.get_many(2)), list(q.get_many(2)))
+
+    def test_transfer_to_ttl(self):
+        """Moved items are given deadlines by the target's `ttl`."""
+        import time
+        q = self.type2test()
+        other = CloseableQueue(ttl=0.01)
+        q.put_many((1, 2))
+        self.assertEqual(2, q.transfer_to(other))
+        time.sleep(0.05)
+        self.assertRaises(Empty, other.get, False)
+        self.assertEqual(2, other.expired)
+
+class CloseableLifoQueueBulkTest(CloseableQueueBulkTest):
+    type2test = CloseableLifoQueue
+    tuple_sort = lambda self, it: tuple(reversed(it))
+
+class CloseablePriorityQueueBulkTest(CloseableQueueBulkTest):
+    type2test = CloseablePriorityQueue
+    tuple_sort = lambda self, it: tuple(sorted(it))
+
+
+def make_int_array_queue(maxsize=0):
+    """Creates a small-block `CloseableArrayQueue` of C ints."""
+    return CloseableArrayQueue('i', maxsize, blocksize=4)
+
+class CloseableArrayQueueTest(CloseableQueueTest):
+    type2test = staticmethod(make_int_array_queue)
+
+class CloseableArrayQueueBulkTest(CloseableQueueBulkTest):
+    type2test = staticmethod(make_int_array_queue)
+
+    def test_blocks_are_recycled(self):
+        q = self.type2test()
+        for i in xrange(3):
+            q.put_many(range(10))
+            self.assertEqual(range(10), q.get_many().tolist())
+        self.assertEqual(0, len(q.queue))
+
+    def test_get_many_returns_array(self):
+        from array import array
+        q = self.type2test()
+        q.put_many(array('i', range(7)))
+        result = q.get_many(5)
+        self.assertEqual(array('i', range(5)), result)
+        self.assertEqual(5, q.get())
+        self.assertEqual(array('i', [6]), q.get_many())
+
+    def test_put_many_buffer(self):
+        from array import array
+        q = self.type2test()
+        q.put_many(buffer(array('i', (5, 6, 7))))
+        self.assertEqual([5, 6, 7], q.get_many().tolist())
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_put_many_ndarray(self):
+        q = self.type2test()
+        q.put_many(numpy.arange(10, dtype='i'))
+        result = numpy.frombuffer(q.get_many(), 'i')
+        self.assertEqual(range(10), result.tolist())
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_put_many_noncontiguous_ndarray(self):
+        q = self.type2test()
+        q.put_many(numpy.arange(10, dtype='i')[::2])
+        self.assertEqual([0, 2, 4, 6, 8], q.get_many().tolist())
+
+    def test_put_many_other_typecode(self):
+        from array import array
+        q = self.type2test()
+        q.put_many(array('h', (1, 2, 3)))
+        self.assertEqual([1, 2, 3], q.get_many().tolist())
+
+    def test_put_many_wrong_dtype(self):
+        class FakeDtype:
+            char = 'd'
+        class FakeNdarray(list):
+            dtype = FakeDtype()
+        q = self.type2test()
+        self.assertRaises(TypeError, q.put_many, FakeNdarray((1.0,)))
+
+
+def put_blocks(channel, count, length):
+    """Puts `count` integer arrays of `length` items to `channel` and closes it.
+
+    Used as the target of a producer process.
+    """
+    from array import array
+    for i in xrange(count):
+        channel.put(array('i', [i] * length))
+    channel.close()
+
+class CloseableIndexedPriorityQueueTest(CloseablePriorityQueueTest):
+    type2test = CloseableIndexedPriorityQueue
+
+class CloseableIndexedPriorityQueueBulkTest(CloseablePriorityQueueBulkTest):
+    type2test = CloseableIndexedPriorityQueue
+
+class IndexedPriorityQueueTest(unittest.TestCase):
+    """Tests the handle-based operations of `CloseableIndexedPriorityQueue`."""
+    def test_stable_order(self):
+        q = CloseableIndexedPriorityQueue()
+        for item in 'abcd':
+            q.put(item, priority=1)
+        q.put('z', priority=0)
+        self.assertEqual(list('zabcd'), q.get_many())
+
+    def test_key(self):
+        q = CloseableIndexedPriorityQueue(key=len)
+        q.put_many(['ccc', 'a', 'bb'])
+        self.assertEqual(['a', 'bb', 'ccc'], q.get_many())
+
+    def test_update_priority(self):
+        q = CloseableIndexedPriorityQueue()
+        handles = [q.put(i) for i in xrange(10)]
+        q.update_priority(handles[7], -1)
+        q.update_priority(handles[0], 100)
+        self.assertEqual([7, 1, 2, 3, 4, 5, 6, 8, 9, 0], q.get_many())
+        self.assertRaises(ValueError, q.update_priority, handles[0], 1)
+
+    def test_cancel(self):
+        q = CloseableIndexedPriorityQueue(3)
+        handles = q.put_many([3, 1, 2])
+        self.assert_(q.cancel(handles[1]))
+        self.failIf(q.cancel(handles[1]))
+        self.failIf(handles[1].pending)
+        self.assertEqual(2, q.qsize())
+        self.assertEqual([2, 3], q.get_many())
+        q.task_done()
+        q.task_done()
+        q.join()
+
+    def test_handles_with_ttl(self):
+        import time
+        q = CloseableIndexedPriorityQueue(ttl=60)
+        handle = q.put('a', priority=2)
+        expired = q.put('b', priority=1, deadline=time.time() - 1)
+        self.assertEqual('a', handle.item)
+        self.assertEqual('b', expired.item)
+        self.assertTrue("'a'" in repr(handle))
+        q.update_priority(handle, 0)
+        self.assertEqual(['a'], q.get_many())
+        self.assertEqual(1, q.expired)
+
+    @unittest.skipIf(futures is None, "concurrent.futures is not installed")
+    def test_cancel_serves_put_async(self):
+        q = CloseableIndexedPriorityQueue(1)
+        handle = q.put(1)
+        put = q.put_async(2)
+        self.assertFalse(put.done())
+        q.cancel(handle)
+        self.assertTrue(put.result(0).pending)
+        self.assertEqual(2, q.get())
+
+    def test_cancel_checks_watermarks(self):
+        lows = []
+        q = CloseableIndexedPriorityQueue(high_watermark=2, low_watermark=0,
+                                          on_low_watermark=lows.append)
+        handles = q.put_many([1, 2])
+        self.assertTrue(q.congested)
+        for handle in handles:
+            q.cancel(handle)
+        self.assertFalse(q.congested)
+        self.assertEqual([q], lows)
+
+    def test_heap_invariant_under_churn(self):
+        import random
+        rand = random.Random(0)
+        q = CloseableIndexedPriorityQueue()
+        handles = q.put_many([rand.random() for i in xrange(200)])
+        for handle in rand.sample(handles, 50):
+            q.cancel(handle)
+        for handle in rand.sample(handles, 100):
+            if handle.pending:
+                q.update_priority(handle, rand.random())
+        self.assertEqual(150, q.qsize())
+        for index, handle in enumerate(q.queue):
+            self.assertEqual(index, handle.index)
+        priorities = []
+        while q.qsize():
+            priorities.append(q.queue[0].priority)
+            q.get()
+        self.assertEqual(sorted(priorities), priorities)
+
+
+class CloseableKeyPriorityQueueTest(CloseablePriorityQueueTest):
+    type2test = CloseableKeyPriorityQueue
+
+class CloseableKeyPriorityQueueBulkTest(CloseablePriorityQueueBulkTest):
+    type2test = CloseableKeyPriorityQueue
+
+class KeyPriorityQueueTest(unittest.TestCase):
+    """Tests the priorities and ordering of `CloseableKeyPriorityQueue`."""
+    def test_payloads_not_compared(self):
+        class Incomparable(object):
+            def __lt__(self, other):
+                raise TypeError("compared a payload")
+            __le__ = __gt__ = __ge__ = __lt__
+        q = CloseableKeyPriorityQueue()
+        items = [Incomparable() for i in xrange(4)]
+        for priority, item in zip((2, 1, 2, 1), items):
+            q.put(item, priority=priority)
+        self.assertEqual([items[1], items[3], items[0], items[2]],
+                         q.get_many())
+
+    def test_key(self):
+        q = CloseableKeyPriorityQueue(key=len)
+        q.put_many(['ccc', 'a', 'bb', 'b'])
+        self.assertEqual(['a', 'b', 'bb', 'ccc'], q.get_many())
+        self.assertEqual([], q.queue)
+
+
+class CloseableDelayQueueTest(CloseableQueueTest):
+    """Runs the closeability tests on undelayed items of a delay queue."""
+    type2test = CloseableDelayQueue
+
+class DelayQueueTest(unittest.TestCase):
+    """Tests the scheduling of `CloseableDelayQueue`."""
+    def test_delivered_in_due_order(self):
+        import time
+        q = CloseableDelayQueue(resolution=0.001, slots=4, levels=2)
+        start = time.time()
+        delays = (0.09, 0.01, 0.05, 0.03, 0.2)
+        for delay in delays:
+            q.put(delay, at=start + delay)
+        q.close()
+        for delay in sorted(delays):
+            self.assertEqual(delay, q.get(timeout=2))
+            self.assert_(time.time() >= start + delay)
+        self.assertRaises(Closed, q.get)
+
+    def test_not_visible_before_due(self):
+        q = CloseableDelayQueue()
+        q.put(1, delay=10)
+        self.assertEqual(1, q.qsize())
+        self.assertRaises(Empty, q.get, block=False)
+        self.assertRaises(Empty, q.get, timeout=0.05)
+        q.put(2)
+        self.assertEqual(2, q.get(block=False))
+
+    def test_delay_counts_toward_maxsize(self):
+        q = CloseableDelayQueue(1)
+        q.put(1, delay=10)
+        self.assertRaises(Full, q.put, 2, block=False)
+
+    def test_close_drain(self):
+        q = CloseableDelayQueue()
+        q.put(1, delay=0.05, last=True)
+        self.assertRaises(Empty, q.get, block=False)
+        self.assertEqual(1, q.get(timeout=2))
+        self.assertRaises(Closed, q.get)
+
+    def test_close_discard(self):
+        q = CloseableDelayQueue(on_close='discard')
+        q.put(1)
+        q.put(2, delay=10)
+        q.close()
+        self.assertEqual(1, q.qsize())
+        self.assertEqual(1, q.get())
+        q.task_done()
+        q.join()
+        self.assertRaises(Closed, q.get)
+
+    def test_common_keyword_arguments(self):
+        from CloseableQueue import queue_registry
+        highs = []
+        q = CloseableDelayQueue(name='test_delay', high_watermark=2,
+                                on_high_watermark=highs.append, ttl=60)
+        try:
+            self.assertTrue(('test_delay', q) in queue_registry.queues())
+            q.put(1)
+            q.put(2, delay=10)
+            self.assertEqual([q], highs)
+            self.assertTrue(q.congested)
+            self.assertEqual(1, q.get(block=False))
+        finally:
+            queue_registry.unregister(q)
+        self.assertRaises(TypeError, CloseableDelayQueue,
+                          overflow='drop_oldest')
+
+    def test_ttl_counts_from_due_time(self):
+        q = CloseableDelayQueue(ttl=0.05)
+        q.put(1, delay=0.1)
+        self.assertEqual(1, q.get(timeout=2))
+        self.assertEqual(0, q.expired)
+
+    def test_timeout_spans_expired_items(self):
+        """Skipping an expired item doesn't restart the timeout of `get`."""
+        import time
+        q = CloseableDelayQueue()
+        q.put(1, delay=0.2, deadline=time.time())
+        start = time.time()
+        self.assertRaises(Empty, q.get, timeout=0.3)
+        self.assert_(time.time() - start < 0.45)
+        self.assertEqual(1, q.expired)
+
+    def test_drain_takes_due_items(self):
+        q = CloseableDelayQueue()
+        q.put(1, delay=10)
+        q.put(2)
+        self.assertEqual([2], q.drain())
+        self.assertEqual([], q.drain())
+        other = CloseableQueue()
+        q.put(3)
+        self.assertEqual(1, q.transfer_to(other))
+        self.assertEqual([3], other.drain())
+        self.assertEqual(1, q.qsize())
+        q.put(4)
+        self.assertEqual(4, q.get(block=False))
+
+    def test_many_pending_items(self):
+        import random
+        rand = random.Random(0)
+        q = CloseableDelayQueue(resolution=0.001, slots=8, levels=3)
+        delays = [rand.uniform(0, 0.2) for i in xrange(500)]
+        for delay in delays:
+            q.put(delay, delay=delay)
+        q.close()
+        self.assertEqual(500, len(list(dequeue(q, {'timeout': 2}))))
+
+
+class CoalescingQueueTest(unittest.TestCase, BlockingTestMixin):
+    """Tests the `CloseableCoalescingQueue` class."""
+    def test_latest_value_in_original_position(self):
+        q = CloseableCoalescingQueue()
+        q.put_many([('a', 1), ('b', 1), ('a', 2)])
+        self.assertEqual([('a', 2), ('b', 1)], q.get_many())
+        self.assertEqual(1, q.coalesced)
+
+    def test_move_to_back(self):
+        q = CloseableCoalescingQueue(move_to_back=True)
+        q.put_many([('a', 1), ('b', 1), ('a', 2)])
+        self.assertEqual([('b', 1), ('a', 2)], q.get_many())
+
+    def test_replacing_put_does_not_block(self):
+        q = CloseableCoalescingQueue(1)
+        q.put(('a', 1))
+        q.put(('a', 2), block=False)
+        self.assertRaises(Full, q.put, ('b', 1), block=False)
+        self.assertEqual(('a', 2), q.get())
+
+    def test_join_counts_replaced_values_done(self):
+        q = CloseableCoalescingQueue()
+        q.put(('a', 1))
+        q.put(('a', 2))
+        q.get()
+        q.task_done()
+        q.join()
+
+    def test_drain_then_closed(self):
+        q = CloseableCoalescingQueue()
+        q.put(('a', 1))
+        q.put(('a', 2), last=True)
+        self.assertRaises(Closed, q.put, ('b', 1))
+        self.assertEqual(('a', 2), q.get())
+        self.assertRaises(Closed, q.get)
+
+
+class FairQueueTest(unittest.TestCase, BlockingTestMixin):
+    """Tests the `CloseableFairQueue` class."""
+    def test_round_robin(self):
+        q = CloseableFairQueue()
+        q.put_many([('a', i) for i in xrange(4)] + [('b', 0), ('c', 0)])
+        self.assertEqual([('a', 0), ('b', 0), ('c', 0),
+                          ('a', 1), ('a', 2), ('a', 3)], q.get_many())
+
+    def test_weights(self):
+        q = CloseableFairQueue(weights={'a': 2, 'b': 0.5})
+        q.put_many([('a', i) for i in xrange(6)] + [('b', i) for i in xrange(3)])
+        self.assertEqual('aaaabaabb', ''.join(t for t, v in q.get_many()))
+
+    def test_sub_queues_are_reclaimed(self):
+        q = CloseableFairQueue()
+        q.put(('a', 1))
+        self.assertEqual(1, q.tenant_qsize('a'))
+        q.get()
+        self.assertEqual(0, q.tenant_qsize('a'))
+        self.assertEqual({}, q.queue)
+
+    def test_tenant_maxsize(self):
+        q = CloseableFairQueue(3, tenant_maxsize=2)
+        q.put_many([('a', 1), ('a', 2), ('b', 1)])
+        self.assertRaises(Full, q.put, ('a', 3), block=False)
+        self.assertRaises(Full, q.put, ('c', 1), block=False)
+        self.assertRaises(Full, q.put_many, [('b', 2), ('a', 3)], block=False)
+
+    def test_blocked_put_waits_for_its_tenant(self):
+        q = CloseableFairQueue(tenant_maxsize=1)
+        q.put_many([('a', 1), ('b', 1)])
+        self.do_blocking_test(q.put, (('b', 2),), q.get_many, (2,))
+        self.assertEqual([('b', 2)], q.get_many())
+
+    def test_close_drains_every_tenant(self):
+        q = CloseableFairQueue()
+        q.put_many([('a', 1), ('b', 1), ('b', 2)], last=True)
+        self.assertEqual(3, len(list(dequeue(q))))
+        self.assertRaises(Closed, q.get)
+
+
+class SynchronousQueueTest(unittest.TestCase, BlockingTestMixin):
+    """Tests the `CloseableSynchronousQueue` class."""
+    def test_put_waits_for_get(self):
+        q = CloseableSynchronousQueue()
+        gotten = []
+        self.do_blocking_test(q.put, (1,), lambda: gotten.append(q.get()), ())
+        self.assertEqual([1], gotten)
+
+    def test_get_waits_for_put(self):
+        q = CloseableSynchronousQueue()
+        self.assertEqual(1, self.do_blocking_test(q.get, (), q.put, (1,)))
+
+    def test_no_waiting_party(self):
+        q = CloseableSynchronousQueue()
+        self.assertRaises(Full, q.put, 1, block=False)
+        self.assertRaises(Full, q.put, 1, timeout=0.01)
+        self.assertRaises(Empty, q.get, block=False)
+        self.assertRaises(Empty, q.get, timeout=0.01)
+        self.assertEqual((0, 0), q.waiting())
+
+    def test_close_wakes_put(self):
+        q = CloseableSynchronousQueue()
+        try:
+            self.do_exceptional_blocking_test(q.put, (1,), q.close, (), Closed)
+        except Closed:
+            pass
+        else:
+            self.fail('Closed exception not raised.')
+        self.assertRaises(Closed, q.get, block=False)
+
+    def test_close_wakes_get(self):
+        q = CloseableSynchronousQueue()
+        try:
+            self.do_exceptional_blocking_test(q.get, (), q.close, (), Closed)
+        except Closed:
+            pass
+        else:
+            self.fail('Closed exception not raised.')
+        self.assertRaises(Closed, q.put, 1)
+
+    def test_last(self):
+        q = CloseableSynchronousQueue()
+        self.do_blocking_test(q.put, (1, True, None, True), q.get, ())
+        self.assertTrue(q.closed())
+        self.assertRaises(Closed, q.get)
+
+    def test_handoff_in_order(self):
+        import threading
+        from CloseableQueue import enqueue
+        q = CloseableSynchronousQueue()
+        producer = threading.Thread(target=enqueue, args=(xrange(100), q))
+        producer.start()
+        self.assertEqual(range(100), list(dequeue(q)))
+        producer.join()
+
+
+class CloseableBroadcastQueueTest(unittest.TestCase, BlockingTestMixin):
+    """Tests the `CloseableBroadcastQueue` class."""
+    def test_each_subscriber_gets_every_item(self):
+        from CloseableQueue import CloseableBroadcastQueue, dequeue
+        q = CloseableBroadcastQueue()
+        subscriptions = [q.subscribe() for i in xrange(3)]
+        for i in xrange(5):
+            q.put(i)
+        q.close()
+        for subscription in subscriptions:
+            self.assertEqual(range(5), list(dequeue(subscription)))
+        self.assertEqual(0, q.qsize())
+
+    def test_items_released_by_slowest(self):
+        from CloseableQueue import CloseableBroadcastQueue
+        q = CloseableBroadcastQueue()
+        fast, slow = q.subscribe(), q.subscribe()
+        q.put(1)
+        q.put(2)
+        fast.get()
+        fast.get()
+        self.assertEqual(2, q.qsize())
+        slow.get()
+        self.assertEqual(1, q.qsize())
+        slow.unsubscribe()
+        self.assertEqual(0, q.qsize())
+
+    def test_late_subscriber(self):
+        from CloseableQueue import CloseableBroadcastQueue
+        q = CloseableBroadcastQueue()
+        q.put(1)
+        subscription = q.subscribe()
+        q.put(2)
+        self.assertEqual(2, subscription.get(block=False))
+        self.assertRaises(Empty, subscription.get, block=False)
+
+    def test_block_policy(self):
+        from CloseableQueue import CloseableBroadcastQueue
+        q = CloseableBroadcastQueue(2)
+        fast, slow = q.subscribe(), q.subscribe()
+        q.put(1)
+        q.put(2)
+        fast.get()
+        self.assertRaises(Full, q.put, 3, block=False)
+        self.do_blocking_test(q.put, (3,), slow.get, ())
+        self.assertEqual([2, 3], [slow.get(), slow.get()])
+
+    def test_drop_policy(self):
+        from CloseableQueue import CloseableBroadcastQueue
+        q = CloseableBroadcastQueue(2, policy='drop')
+        fast, slow = q.subscribe(), q.subscribe()
+        for i in xrange(4):
+            q.put(i)
+            fast.get()
+        self.assertEqual([2, 3], [slow.get(), slow.get()])
+        self.assertEqual(2, slow.dropped)
+        self.assertEqual(0, fast.dropped)
+        self.assertEqual(2, q.dropped)
+
+    def test_close_wakes_subscribers(self):
+        from CloseableQueue import CloseableBroadcastQueue
+        q = CloseableBroadcastQueue()
+        subscription = q.subscribe()
+        try:
+            self.do_exceptional_blocking_test(subscription.get, (True, 2),
+                                              q.close, (), Closed)
+        except Closed:
+            pass
+        else:
+            self.fail('Closed exception not raised.')
+        self.assertRaises(Closed, q.put, 1)
+
+    def test_last(self):
+        from CloseableQueue import CloseableBroadcastQueue
+        q = CloseableBroadcastQueue()
+        subscription = q.subscribe()
+        q.put(1, last=True)
+        self.assertEqual(1, subscription.get())
+        self.assertRaises(Closed, subscription.get)
+
+
+class SharedBlockChannelTest(unittest.TestCase):
+    """Tests the cross-process `SharedBlockChannel`."""
+    def test_blocks_from_process(self):
+        from CloseableQueue import SharedBlockChannel, dequeue
+        from multiprocessing import Process
+        channel = SharedBlockChannel(segments=2, segment_size=1024)
+        producer = Process(target=put_blocks, args=(channel, 5, 100))
+        producer.start()
+        sums = []
+        for block in dequeue(channel, {'timeout': 10}):
+            with block:
+                sums.append(sum(block.array()))
+        producer.join(10)
+        self.assertEqual([i * 100 for i in xrange(5)], sums)
+
+    def test_put_after_close(self):
+        from CloseableQueue import SharedBlockChannel
+        channel = SharedBlockChannel(segments=1, segment_size=64)
+        channel.put('abc', last=True)
+        self.assert_(channel.closed())
+        self.assertRaises(Closed, channel.put, 'def')
+        block = channel.get(timeout=1)
+        self.assertEqual('abc', str(block.data))
+        block.release()
+        self.assertRaises(Closed, channel.get, timeout=1)
+
+    def test_full_when_no_segment_free(self):
+        from CloseableQueue import SharedBlockChannel
+        channel = SharedBlockChannel(segments=1, segment_size=64)
+        channel.put('a')
+        self.assertRaises(Full, channel.put, 'b', timeout=0.05)
+        channel.get().release()
+        channel.put('b', timeout=1)
+
+    def test_close_releases_blocked_put(self):
+        from CloseableQueue import SharedBlockChannel
+        import threading
+        channel = SharedBlockChannel(segments=1, segment_size=64)
+        channel.put('a')
+        timer = threading.Timer(0.1, channel.close)
+        timer.start()
+        self.assertRaises(Closed, channel.put, 'b', timeout=10)
+        timer.join()
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_ndarray_block(self):
+        from CloseableQueue import SharedBlockChannel
+        channel = SharedBlockChannel(segments=1, segment_size=1024)
+        original = numpy.arange(12.0).reshape(3, 4)
+        channel.put(original.T)
+        with channel.get() as block:
+            self.assert_((block.array() == original.T).all())
+
+    def test_oversized_block(self):
+        from CloseableQueue import SharedBlockChannel
+        channel = SharedBlockChannel(segments=1, segment_size=4)
+        self.assertRaises(ValueError, channel.put, 'abcdef')
+
+
+class BufferSerializerTest(unittest.TestCase):
+    def test_round_trip(self):
+        from CloseableQueue import BufferSerializer
+        from array import array
+        serializer = BufferSerializer(threshold=16)
+        obj = {'big': 'x' * 100, 'small': 'y',
+               'array': array('d', range(10)), 'bytes': bytearray('z' * 20)}
+        message = serializer.dumps(obj)
+        self.assertEqual(3, len(message[1]))
+        self.assertEqual(obj, serializer.loads(message))
+
+    def test_loads_removes_buffers(self):
+        from CloseableQueue import BufferSerializer
+        import os
+        serializer = BufferSerializer(threshold=16)
+        message = serializer.dumps('x' * 100)
+        path = message[1][0][0]
+        self.assert_(os.path.exists(path))
+        serializer.loads(message)
+        self.failIf(os.path.exists(path))
+
+    def test_failed_dumps_removes_buffers(self):
+        from CloseableQueue import BufferSerializer
+        import os, shutil, tempfile
+        directory = tempfile.mkdtemp()
+        try:
+            serializer = BufferSerializer(threshold=16, directory=directory)
+            self.assertRaises(Exception, serializer.dumps,
+                              ['x' * 100, lambda: 1])
+            self.assertEqual([], os.listdir(directory))
+        finally:
+            shutil.rmtree(directory)
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_ndarray(self):
+        from CloseableQueue import BufferSerializer
+        serializer = BufferSerializer(threshold=16)
+        original = numpy.arange(12.0).reshape(3, 4).T
+        result = serializer.loads(serializer.dumps(original))
+        self.assertEqual(original.shape, result.shape)
+        self.assert_((original == result).all())
+
+
+class ProcessQueueTest(unittest.TestCase):
+    """Tests the `ProcessQueue` class and `EnqueueProcess` function."""
+    def test_EnqueueProcess(self):
+        from CloseableQueue import EnqueueProcess, ProcessQueue, dequeue
+        q = ProcessQueue(2, threshold=16)
+        items = ['x' * 100, 'y', range(50)]
+        process = EnqueueProcess(iter(items), q)
+        result = list(dequeue(q, {'timeout': 10}))
+        process.join(10)
+        self.assertEqual(items, result)
+
+    def test_put_after_last(self):
+        from CloseableQueue import ProcessQueue
+        q = ProcessQueue()
+        q.put(1, last=True)
+        self.assert_(q.closed())
+        self.assertRaises(Closed, q.put, 2)
+        self.assertEqual(1, q.get(timeout=1))
+        self.assertRaises(Closed, q.get, timeout=1)
+
+    def test_full(self):
+        from CloseableQueue import ProcessQueue
+        q = ProcessQueue(1)
+        q.put(1)
+        self.assertRaises(Full, q.put, 2, timeout=0.05)
+        self.assertEqual(1, q.get())
+        q.put(2, block=False)
+
+    def test_close_releases_blocked_put(self):
+        from CloseableQueue import ProcessQueue
+        import threading
+        q = ProcessQueue(1)
+        q.put(1)
+        timer = threading.Timer(0.1, q.close)
+        timer.start()
+        self.assertRaises(Closed, q.put, 2, timeout=10)
+        timer.join()
+        self.assertEqual(1, q.get())
+
+    def test_close_discard(self):
+        from CloseableQueue import ProcessQueue
+        import os, shutil, tempfile
+        directory = tempfile.mkdtemp()
+        try:
+            q = ProcessQueue(2, threshold=16, directory=directory)
+            q.put('x' * 100)
+            q.put('y' * 100)
+            self.assertEqual(2, len(os.listdir(directory)))
+            q.close(discard=True)
+            self.assertEqual([], os.listdir(directory))
+            self.assertRaises(Closed, q.get, timeout=1)
+            self.assertRaises(Closed, q.get, timeout=1)
+        finally:
+            shutil.rmtree(directory)
+
+
+class RemoteQueueTest(unittest.TestCase, BlockingTestMixin):
+    """Tests `RemoteQueue` against a `QueueServer` on the loopback interface."""
+    authkey = 'secret'
+
+    def server_address(self):
+        return ('127.0.0.1', 0)
+
+    def setUp(self):
+        from CloseableQueue import QueueServer
+        self.q = CloseableQueue()
+        self.server = QueueServer(self.q, self.server_address(), self.authkey)
+        self.server.start(poll_interval=0.01)
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.disconnect()
+        self.server.shutdown()
+
+    def connect(self, **kwargs):
+        from CloseableQueue import RemoteQueue
+        kwargs.setdefault('authkey', self.authkey)
+        client = RemoteQueue(self.server.address, **kwargs)
+        self.clients.append(client)
+        return client
+
+    def test_put_get(self):
+        client = self.connect()
+        client.put(1)
+        client.put(2)
+        self.assertEqual(1, client.get(timeout=2))
+        self.assertEqual(2, self.q.get(timeout=2))
+
+    def test_batched_puts(self):
+        client = self.connect(batch=4, window=2)
+        for i in xrange(10):
+            client.put(i)
+        client.flush()
+        self.assertEqual(range(10), self.q.get_many())
+
+    def test_prefetch(self):
+        client = self.connect(prefetch=3)
+        self.q.put_many(range(5))
+        self.assertEqual(0, client.get())
+        self.assertEqual(2, client.qsize())
+        self.assertEqual([1, 2], client.get_many())
+        self.assertEqual([3, 4], client.get_many())
+
+    def test_last_propagates_closed(self):
+        from CloseableQueue import dequeue
+        producer = self.connect(batch=8)
+        consumer = self.connect(prefetch=8)
+        for i in xrange(20):
+            producer.put(i)
+        producer.put(20, last=True)
+        self.assert_(self.q.closed())
+        self.assertEqual(range(21), list(dequeue(consumer)))
+        self.assert_(consumer.closed())
+
+    def test_put_after_close(self):
+        client = self.connect()
+        client.close()
+        client.put(1)
+        self.assertRaises(Closed, client.flush)
+        self.assertRaises(Closed, client.put, 1, timeout=1)
+
+    def test_close_releases_blocked_get(self):
+        client = self.connect()
+        try:
+            self.do_exceptional_blocking_test(client.get, (True, 2),
+                                              self.q.close, (), Closed)
+        except Closed:
+            pass
+        else:
+            self.fail('Closed exception not raised.')
+
+    def test_get_timeout(self):
+        client = self.connect()
+        self.assertRaises(Empty, client.get, timeout=0.05)
+
+    def test_wrong_authkey(self):
+        from CloseableQueue import AuthenticationError, RemoteQueue
+        self.assertRaises(AuthenticationError, RemoteQueue,
+                          self.server.address, authkey='wrong')
+        self.assertEqual(0, self.q.qsize())
+
+    def test_unauthenticated_pickle_not_loaded(self):
+        """A pickle sent in place of the handshake is never unpickled."""
+        import cPickle, os, shutil, socket, struct, tempfile
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'pwned')
+        class Payload(object):
+            def __reduce__(self):
+                return (os.mkdir, (path,))
+        if isinstance(self.server.address, basestring):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.server.address)
+        else:
+            sock = socket.create_connection(self.server.address)
+        try:
+            data = cPickle.dumps(('put', [Payload()], True, None, False))
+            sock.sendall(struct.pack('!I', len(data)) + data)
+            sock.settimeout(2)
+            while sock.recv(4096):
+                pass
+        finally:
+            sock.close()
+        try:
+            self.assertFalse(os.path.exists(path))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_tcp_requires_authkey(self):
+        from CloseableQueue import QueueServer
+        self.assertRaises(ValueError, QueueServer, self.q, ('127.0.0.1', 0))
+
+class UnixRemoteQueueTest(RemoteQueueTest):
+    """Runs the `RemoteQueue` tests over a Unix domain socket."""
+    def server_address(self):
+        import os, tempfile
+        self.directory = tempfile.mkdtemp()
+        return os.path.join(self.directory, 'queue')
+
+    def tearDown(self):
+        import os
+        RemoteQueueTest.tearDown(self)
+        os.rmdir(self.directory)
+
+
+# Child process for `PipeStageTest`, which doubles each of its input items.
+DOUBLING_CHILD = """
+from CloseableQueue import dequeue_pipe, enqueue_pipe
+enqueue_pipe((2 * x for x in dequeue_pipe()), batch=4)
+"""
+
+class PipeStageTest(unittest.TestCase):
+    """Tests the subprocess pipe bridge."""
+    def start_child(self, code, **kwargs):
+        from CloseableQueue import PipeStage
+        import os, sys
+        directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=directory)
+        return PipeStage([sys.executable, '-c', code], env=env, **kwargs)
+
+    def test_round_trip(self):
+        from CloseableQueue import enqueue, dequeue
+        stage = self.start_child(DOUBLING_CHILD)
+        enqueue(xrange(10), stage.input)
+        result = list(dequeue(stage.output, {'timeout': 10}))
+        self.assertEqual(0, stage.join())
+        self.assertEqual([2 * x for x in xrange(10)], result)
+        self.assertEqual([], stage.errors)
+
+    def test_child_exit_closes_queues(self):
+        import time
+        stage = self.start_child("pass")
+        self.assertRaises(Closed, stage.output.get, timeout=10)
+        stage.process.wait()
+        try:
+            for i in xrange(10000):
+                stage.input.put(i, timeout=10)
+                # Give the transfer thread the chance to find the pipe broken.
+                time.sleep(0.001)
+        except Closed:
+            pass
+        else:
+            self.fail('Closed exception not raised.')
+        self.assertEqual(0, stage.join())
+        self.assertEqual(1, len(stage.errors))
+
+    def test_pipe_round_trip(self):
+        from CloseableQueue import queue_to_pipe, pipe_to_queue
+        import os
+        read_fd, write_fd = os.pipe()
+        source = CloseableQueue()
+        source.put_many(range(5), last=True)
+        queue_to_pipe(source, os.fdopen(write_fd, 'wb'))
+        sink = CloseableQueue()
+        pipe_to_queue(os.fdopen(read_fd, 'rb'), sink)
+        self.assertEqual(range(5), sink.get_many())
+        self.assert_(sink.closed())
+
+
 class CloseableQueueIterationTest(unittest.TestCase, BlockingTestMixin):
     """Tests the `enqueue` and `dequeue` functions."""
     type2test = CloseableQueue
@@ -324,6 +1874,33 @@ class CloseableQueueIterationTest(unittest.TestCase, BlockingTestMixin):
         self.do_iterable_test((6, 4, 5), q, on_empty='stop', close=False)
         self.do_iterable_test((9, 8, 7), q, on_empty='stop', close=True)
 
+    def test_enqueue_join_timeout(self):
+        from CloseableQueue import enqueue
+        q = self.type2test()
+        self.assertFalse(enqueue((1, 2), q, join=True, join_timeout=0.01))
+        self.assertEqual(2, len(q.get_many()))
+        q.task_done(2)
+        self.assert_(enqueue((), q, close=False, join=1, join_timeout=0.01))
+        self.assertEqual(None, enqueue((), q, close=False, join_timeout=0.01))
+
+    def test_consumer_close_stops_enqueue(self):
+        """`enqueue` stops and closes its iterator once `q` is closed."""
+        from CloseableQueue import EnqueueThread
+        closed = []
+        def numbers():
+            try:
+                for i in xrange(1000000):
+                    yield i
+            finally:
+                closed.append(True)
+        q = self.type2test(2)
+        thread = EnqueueThread(numbers(), q, join=True)
+        q.get()
+        q.close(discard=True)
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([True], closed)
+
     def test_EnqueueThread(self):
         """Perfunctory test of the EnqueueThread convenience function."""
         from CloseableQueue import EnqueueThread
@@ -340,6 +1917,255 @@ class CloseablePriorityQueueIterationTest(CloseableQueueIterationTest):
     type2test = CloseablePriorityQueue
     tuple_sort = lambda self, it: tuple(sorted(it))
 
+class CloseableDelayQueueIterationTest(CloseableQueueIterationTest):
+    type2test = CloseableDelayQueue
+
+
+class PipelineTest(unittest.TestCase):
+    """Tests the `Pipeline` class."""
+    def test_stages(self):
+        from CloseableQueue import Pipeline
+        p = Pipeline(xrange(20), maxsize=4)
+        p.map(lambda x: x * 3, workers=3, maxsize=2)
+        p.filter(lambda x: x % 2, workers=2)
+        p.flat_map(lambda x: (x, -x))
+        result = sorted(p.start())
+        p.join()
+        expected = sorted(y for x in xrange(20) if x * 3 % 2
+                            for y in (x * 3, -x * 3))
+        self.assertEqual(expected, result)
+
+    def test_sink_and_stats(self):
+        from CloseableQueue import Pipeline
+        import time
+        seen = []
+        p = (Pipeline(xrange(10))
+             .map(lambda x: time.sleep(0.005) or x, name='slow')
+             .sink(seen.append))
+        p.start().join()
+        self.assertEqual(range(10), seen)
+        stats = p.stats()
+        self.assertEqual(['source', 'slow', 'sink-2'],
+                         [s['name'] for s in stats])
+        self.assertEqual([10, 10, 10], [s['items'] for s in stats])
+        self.assertTrue(stats[1]['busy'] >= 0.05)
+        self.assertTrue(stats[2]['starved'] >= 0.04)
+        self.assertEqual('slow', p.bottleneck().name)
+        self.assertRaises(TypeError, iter, p)
+
+    def test_close_cascades(self):
+        from CloseableQueue import Pipeline
+        q = CloseableQueue()
+        p = Pipeline(q).map(abs, workers=2).map(str).start()
+        q.put(-1)
+        p.close()
+        self.assertEqual(['1'], list(p))
+        p.join()
+        for stage in p.stages:
+            self.assert_(stage.output.closed())
+
+    def test_error_stops_upstream(self):
+        from CloseableQueue import Pipeline
+        from itertools import count
+        p = Pipeline(count(), maxsize=1).map(lambda x: 1 / (5 - x)).start()
+        list(p)
+        self.assertRaises(ZeroDivisionError, p.join)
+
+    def test_add_workers(self):
+        from CloseableQueue import Pipeline
+        q = CloseableQueue()
+        p = Pipeline(q).map(abs).start()
+        p.stages[0].add_workers(2)
+        self.assertEqual(3, p.stages[0].stats()['workers'])
+        q.put_many([-1, -2, -3], last=True)
+        self.assertEqual([1, 2, 3], sorted(p))
+        p.join()
+        p.stages[0].add_workers(1)
+        self.assertEqual(3, p.stages[0].workers)
+
+
+class ConsumerPoolTest(unittest.TestCase):
+    """Tests the `ConsumerPool` class."""
+    def test_drains(self):
+        from CloseableQueue import ConsumerPool
+        q = CloseableQueue()
+        seen = []
+        drained = []
+        pool = ConsumerPool(q, lambda x: seen.append(1 / x), max_workers=2,
+                            on_drained=lambda: drained.append(True))
+        q.put_many([1, 0, 2], last=True)
+        self.assert_(pool.join(10))
+        q.join()
+        self.assertEqual([0, 1], sorted(seen))
+        self.assertEqual([True], drained)
+        self.assertEqual(0, pool.workers)
+        self.assertEqual(1, len(pool.errors))
+
+    def test_rescale_hysteresis(self):
+        from CloseableQueue import ConsumerPool
+        q = CloseableQueue()
+        # A long interval keeps the pool's own scaling out of the way.
+        pool = ConsumerPool(q, id, max_workers=3, interval=60)
+        self.assertEqual(0, pool.rescale(10, 0.0, 0.0))
+        self.assertEqual(0, pool.rescale(0, 0.3, 0.0))
+        self.assertEqual(0, pool.rescale(0, 0.0, 0.5))
+        self.assertEqual(1, pool.rescale(0, 0.0, 0.5))
+        self.assertEqual(0, pool.rescale(10, 0.0, 0.0))
+        self.assertEqual(1, pool.rescale(10, 0.0, 0.0))
+        self.assertEqual(3, pool.workers)
+        self.assertEqual(0, pool.rescale(0, 0.9, 0.0))
+        self.assertEqual(-1, pool.rescale(0, 0.9, 0.0))
+        q.close()
+        self.assert_(pool.join(10))
+
+    def test_drains_with_shrink_pending(self):
+        """Workers which exit to shrink the pool after `q` closes
+          still leave it drained."""
+        from CloseableQueue import ConsumerPool
+        import threading, time
+        started = threading.Event()
+        release = threading.Event()
+        def work(item):
+            started.set()
+            release.wait(10)
+        q = CloseableQueue()
+        pool = ConsumerPool(q, work, max_workers=3, interval=60, patience=1)
+        pool.rescale(10, 0.0, 0.0)
+        pool.rescale(10, 0.0, 0.0)
+        self.assertEqual(3, pool.workers)
+        q.put(1)
+        self.assert_(started.wait(10))
+        self.assertEqual(-1, pool.rescale(0, 0.9, 0.0))
+        q.close()
+        # The idle workers exit on `Closed` before the busy one retires.
+        for i in xrange(1000):
+            if pool.workers == 1:
+                break
+            time.sleep(0.01)
+        self.assertEqual(1, pool.workers)
+        release.set()
+        self.assert_(pool.join(10))
+        self.assertEqual(0, pool.workers)
+
+    def test_grows_under_load(self):
+        from CloseableQueue import ConsumerPool
+        import time
+        q = CloseableQueue()
+        pool = ConsumerPool(q, lambda x: time.sleep(0.01), max_workers=4,
+                            interval=0.05, patience=1)
+        q.put_many(xrange(300), last=True)
+        self.assert_(pool.join(10))
+        self.assertEqual(4, len(pool._idle))
+
+
+class EnqueuePoolTest(unittest.TestCase):
+    """Tests the `EnqueuePool` class."""
+    def test_many_enqueues_few_threads(self):
+        from CloseableQueue import EnqueuePool, dequeue
+        pool = EnqueuePool(workers=2)
+        handles = [pool.submit(xrange(i)) for i in xrange(50)]
+        for i, handle in enumerate(handles):
+            self.assertEqual(range(i), list(dequeue(handle.q)))
+        for handle in handles:
+            handle.join(10)
+            self.assertFalse(handle.is_alive())
+            self.assertEqual(None, handle.exception())
+        self.assert_(len(pool._threads) <= 2)
+        pool.shutdown()
+
+    def test_EnqueueThread_with_pool(self):
+        from CloseableQueue import EnqueuePool, EnqueueThread, dequeue
+        pool = EnqueuePool(workers=1)
+        q = CloseableQueue()
+        handle = EnqueueThread((3, 1, 2), q, start=False, pool=pool)
+        self.assertFalse(handle.is_alive())
+        handle.start()
+        self.assertEqual([3, 1, 2], list(dequeue(handle.q)))
+        handle = EnqueueThread((1, 2), pool=pool, join=True)
+        self.assertEqual([1, 2], list(dequeue(handle.q)))
+        handle.q.task_done()
+        self.assertFalse(handle.done())
+        handle.q.task_done()
+        handle.join(10)
+        self.assert_(handle.done())
+        pool.shutdown()
+
+    def test_exception(self):
+        from CloseableQueue import EnqueuePool
+        pool = EnqueuePool()
+        handle = pool.submit(1 / x for x in (1, 0))
+        self.assert_(isinstance(handle.exception(10), ZeroDivisionError))
+        self.assertEqual(1, handle.q.get())
+        self.assertFalse(handle.q.closed())
+        pool.shutdown()
+        self.assertRaises(Closed, pool.submit, ())
+
+
+class PrefetchTest(unittest.TestCase):
+    """Tests the `prefetch` function."""
+    def test_order(self):
+        from CloseableQueue import prefetch
+        self.assertEqual(range(10), list(prefetch(xrange(10), 3)))
+        self.assertEqual([], list(prefetch((), 3)))
+
+    def test_fetch(self):
+        from CloseableQueue import prefetch
+        self.assertEqual(range(0, 20, 2),
+                         list(prefetch(xrange(10), 2, fetch=lambda x: 2 * x)))
+
+    def test_exception_in_position(self):
+        from CloseableQueue import prefetch
+        it = prefetch((1 / x for x in (1, 1, 0, 1)), 4)
+        self.assertEqual([1, 1], [next(it), next(it)])
+        self.assertRaises(ZeroDivisionError, next, it)
+        self.assertRaises(StopIteration, next, it)
+
+    def test_workers(self):
+        from CloseableQueue import prefetch
+        import time
+        fetched = prefetch(range(23), 4, workers=3,
+                           fetch=lambda x: time.sleep(0.001 * (x % 3)) or x)
+        self.assertEqual(range(23), list(fetched))
+        it = prefetch(range(10), 4, workers=2, fetch=lambda x: 1 / (x - 5))
+        self.assertEqual([-1, -1, -1, -1, -1], [next(it) for i in xrange(5)])
+        self.assertRaises(ZeroDivisionError, next, it)
+
+    def test_abandon_stops_producer(self):
+        from CloseableQueue import prefetch
+        import threading
+        stopped = threading.Event()
+        def numbers():
+            try:
+                i = 0
+                while True:
+                    yield i
+                    i += 1
+            finally:
+                stopped.set()
+        it = prefetch(numbers(), 2)
+        self.assertEqual(0, next(it))
+        it.close()
+        stopped.wait(10)
+        self.assert_(stopped.is_set())
+
+    def test_drop_unstarted_stops_producer(self):
+        from CloseableQueue import prefetch
+        import gc, threading
+        stopped = threading.Event()
+        def numbers():
+            try:
+                i = 0
+                while True:
+                    yield i
+                    i += 1
+            finally:
+                stopped.set()
+        it = prefetch(numbers(), 2)
+        del it
+        gc.collect()
+        stopped.wait(10)
+        self.assert_(stopped.is_set())
+
 
 def make_test_suite():
     from unittest import TestSuite, defaultTestLoader
@@ -354,11 +2180,49 @@ def make_test_suite():
 
     closeability_cases = (CloseableQueueTest,
                           CloseableLifoQueueTest,
-                          CloseablePriorityQueueTest)
+                          CloseablePriorityQueueTest,
+                          CloseableArrayQueueTest,
+                          CloseableIndexedPriorityQueueTest,
+                          CloseableKeyPriorityQueueTest,
+                          CloseableDelayQueueTest)
+    deadline_cases = (CloseableQueueDeadlineTest,
+                      CloseableLifoQueueDeadlineTest,
+                      CloseablePriorityQueueDeadlineTest,
+                      DeadlineSupportTest)
+    overflow_cases = (OverflowPolicyTest,)
+    async_cases = (AsyncTest, PriorityAsyncTest)
+    monitoring_cases = (WatermarkTest, SnapshotTest, RegistryTest)
+    bulk_cases = (CloseableQueueBulkTest,
+                  CloseableLifoQueueBulkTest,
+                  CloseablePriorityQueueBulkTest,
+                  CloseableArrayQueueBulkTest,
+                  CloseableIndexedPriorityQueueBulkTest,
+                  CloseableKeyPriorityQueueBulkTest)
     iteration_cases = (CloseableQueueIterationTest,
                        CloseableLifoQueueIterationTest,
-                       CloseablePriorityQueueIterationTest)
-    new_functionality_cases = chain(closeability_cases, iteration_cases)
+                       CloseablePriorityQueueIterationTest,
+                       CloseableDelayQueueIterationTest)
+    variant_cases = (IndexedPriorityQueueTest,
+                     KeyPriorityQueueTest,
+                     DelayQueueTest,
+                     CoalescingQueueTest,
+                     FairQueueTest,
+                     SynchronousQueueTest,
+                     CloseableBroadcastQueueTest)
+    process_cases = (SharedBlockChannelTest,
+                     BufferSerializerTest,
+                     ProcessQueueTest,
+                     PipeStageTest)
+    pipeline_cases = (PipelineTest, ConsumerPoolTest, EnqueuePoolTest,
+                      PrefetchTest)
+    remote_cases = (RemoteQueueTest,
+                    UnixRemoteQueueTest)
+    new_functionality_cases = chain(closeability_cases, deadline_cases,
+                                    overflow_cases, async_cases,
+                                    monitoring_cases, bulk_cases,
+                                    iteration_cases, pipeline_cases,
+                                    variant_cases, process_cases,
+                                    remote_cases)
     new_functionality_suite = TestSuite(load(case)
                                         for case in new_functionality_cases)
 